@@ -0,0 +1,248 @@
+"""
+Benchmark the detection pipeline stages without a camera or a display.
+
+Runs the energy core and aruco marker detection stages over synthetic
+arena images or recorded frame files and prints per-stage latency
+percentiles, frames per second and peak memory as JSON.
+
+Examples:
+    python benchmark.py --frames 200
+    python benchmark.py --images 'recordings/*.png' --output baseline.json
+    python benchmark.py --replay match.frames
+"""
+import argparse
+import glob
+import json
+import resource
+import sys
+import time
+import tracemalloc
+import numpy as np
+import cv2
+from cv2 import aruco
+from detect_aruco_markers_from_image import \
+    ARUCO_DICT, ARUCO_DETECTER_PARAMETERS, MTX, DIST, SIZE_OF_MARKER
+from detect_energy_cores_from_image import ECORE_COLOR_RANGES
+from utils.aruco_utils import aruco_poses_to_transforms, image_to_gray
+from utils.buffer_arena import BufferArena
+from utils.ecore_utils import \
+    image_to_center_points, image_to_center_points_multi
+from utils.frame_log import FrameLog
+from utils.synthetic_arena import random_arena, render_arena
+
+
+SYNTHETIC_ARENAS = 10
+MARKER_COUNT = 20
+CORES_PER_CLASS = 5
+WARMUP_FRAMES = 5
+# Frames to run with tracemalloc on. Tracing slows the stages down so
+# the latencies are measured in a separate pass.
+MEMORY_FRAMES = 5
+PERCENTILES = (50, 90, 99)
+
+
+def synthetic_frames(count, marker_count, cores_per_class, seed=0):
+    """
+    Render arenas with random marker and energy core positions
+    """
+    rng = np.random.default_rng(seed)
+    frames = []
+    for _ in range(count):
+        markers, cores = random_arena(rng, marker_count,
+                                      ECORE_COLOR_RANGES, cores_per_class)
+        frames.append(render_arena(markers, cores, ARUCO_DICT))
+    return frames
+
+
+def recorded_frames(pattern):
+    frames = [cv2.imread(path) for path in sorted(glob.glob(pattern))]
+    return [frame for frame in frames if frame is not None]
+
+
+def replay_frames(path):
+    """
+    Get read-only views to the frames of a frame log without copying them
+    """
+    frame_log = FrameLog(path)
+    return [frame_log.frame(index) for index in range(len(frame_log))]
+
+
+def run_stages(frame):
+    """
+    Run each pipeline stage once and yield the stage name and the time it
+    took in seconds
+    """
+    start = time.perf_counter()
+    for _, low_color, high_color in ECORE_COLOR_RANGES:
+        image_to_center_points(frame, low_color, high_color)
+    yield 'ecore_per_class', time.perf_counter() - start
+
+    start = time.perf_counter()
+    image_to_center_points_multi(frame, ECORE_COLOR_RANGES)
+    yield 'ecore_multi', time.perf_counter() - start
+
+    start = time.perf_counter()
+    corners, detected_ids, _ = aruco.detectMarkers(
+        frame, ARUCO_DICT, parameters=ARUCO_DETECTER_PARAMETERS)
+    yield 'detect_markers', time.perf_counter() - start
+
+    start = time.perf_counter()
+    rvecs, _, _ = aruco.estimatePoseSingleMarkers(
+        corners, SIZE_OF_MARKER, MTX, DIST)
+    yield 'estimate_pose', time.perf_counter() - start
+
+    start = time.perf_counter()
+    aruco_poses_to_transforms(detected_ids=detected_ids,
+                              corners=corners,
+                              rvecs=rvecs)
+    yield 'poses_to_transforms', time.perf_counter() - start
+
+
+def run_pipeline(frame, arena=None):
+    """
+    Run the energy core and marker detection the way a detection loop
+    does, optionally with preallocated buffers
+    """
+    image_to_center_points_multi(frame, ECORE_COLOR_RANGES, arena=arena)
+    aruco.detectMarkers(image_to_gray(frame, arena),
+                        ARUCO_DICT,
+                        parameters=ARUCO_DETECTER_PARAMETERS)
+
+
+def allocation_stats(frames):
+    """
+    Measure the memory allocated by the pipeline per frame without and
+    with a buffer arena. Only allocations made through Python and NumPy
+    are traced, which covers the images OpenCV returns.
+
+    Returns : dictionary
+        without_arena, with_arena : dictionary
+            mean_bytes_per_frame : Average of the peak traced memory
+                allocated while processing a frame
+            arena_allocations : Buffers the arena allocated after the
+                warmup frames, zero in steady state
+    """
+    results = {}
+    for name, arena in (('without_arena', None),
+                        ('with_arena', BufferArena())):
+        for frame in frames[:WARMUP_FRAMES]:
+            run_pipeline(frame, arena)
+        warm_allocations = arena.allocations if arena else 0
+
+        tracemalloc.start()
+        frame_bytes = []
+        for index in range(MEMORY_FRAMES):
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            run_pipeline(frames[index % len(frames)], arena)
+            frame_bytes.append(tracemalloc.get_traced_memory()[1] - current)
+        tracemalloc.stop()
+
+        results[name] = {
+            'mean_bytes_per_frame': float(np.mean(frame_bytes)),
+            'arena_allocations':
+                (arena.allocations if arena else 0) - warm_allocations,
+        }
+    return results
+
+
+def latency_stats(seconds):
+    milliseconds = 1000 * np.asarray(seconds)
+    stats = {'mean_ms': float(np.mean(milliseconds))}
+    for percentile in PERCENTILES:
+        stats[f'p{percentile}_ms'] = \
+            float(np.percentile(milliseconds, percentile))
+    stats['max_ms'] = float(np.max(milliseconds))
+    return stats
+
+
+def benchmark(frames, iterations):
+    """
+    Run the stages over the frames
+
+    Returns : dictionary
+        Machine readable benchmark results
+    """
+    for frame in frames[:WARMUP_FRAMES]:
+        for _ in run_stages(frame):
+            pass
+
+    stage_seconds = {}
+    frame_seconds = []
+    for index in range(iterations):
+        frame = frames[index % len(frames)]
+        total = 0.0
+        for stage, seconds in run_stages(frame):
+            stage_seconds.setdefault(stage, []).append(seconds)
+            total += seconds
+        frame_seconds.append(total)
+
+    tracemalloc.start()
+    for index in range(MEMORY_FRAMES):
+        for _ in run_stages(frames[index % len(frames)]):
+            pass
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        max_rss *= 1024
+
+    return {
+        'frames': iterations,
+        'frame_shape': list(frames[0].shape),
+        'stages': {stage: latency_stats(seconds)
+                   for stage, seconds in stage_seconds.items()},
+        'frame': latency_stats(frame_seconds),
+        'fps': iterations / sum(frame_seconds),
+        'peak_traced_memory_bytes': peak_traced,
+        'max_rss_bytes': max_rss,
+        'allocations': allocation_stats(frames),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--images',
+                        help='Glob pattern of recorded frame files. '
+                             'Synthetic arenas are used if not given.')
+    parser.add_argument('--replay',
+                        help='Frame log recorded with RecordingVideoSource')
+    parser.add_argument('--frames', type=int, default=100,
+                        help='Number of frames to run')
+    parser.add_argument('--markers', type=int, default=MARKER_COUNT,
+                        help='Markers in each synthetic arena')
+    parser.add_argument('--cores', type=int, default=CORES_PER_CLASS,
+                        help='Energy cores of each color in synthetic arenas')
+    parser.add_argument('--output',
+                        help='Write the results to this file instead of '
+                             'stdout')
+    args = parser.parse_args()
+
+    if args.images:
+        frames = recorded_frames(args.images)
+        if not frames:
+            parser.error(f'No images found with {args.images}')
+        source = args.images
+    elif args.replay:
+        frames = replay_frames(args.replay)
+        if not frames:
+            parser.error(f'No frames in {args.replay}')
+        source = args.replay
+    else:
+        frames = synthetic_frames(SYNTHETIC_ARENAS, args.markers, args.cores)
+        source = 'synthetic'
+
+    results = {'source': source}
+    results.update(benchmark(frames, args.frames))
+
+    if args.output:
+        with open(args.output, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Example script to detect both the aruco markers and the energy cores
+from each frame in parallel worker processes. Each frame is copied once
+to shared memory and both detections read it from there.
+"""
+from detect_aruco_markers_from_image import (
+    ARUCO_DICT_ID, ARUCO_DETECTER_PARAMETERS, MTX, DIST, SIZE_OF_MARKER,
+    CALIBRATION_FILE)
+from detect_energy_cores_from_image import ECORE_COLOR_RANGES
+from utils.parallel_detectors import ParallelDetectionPipeline, \
+    detector_config
+from utils.results_publisher import ResultsPublisher, RESULTS_NAME, \
+    RESULTS_PORT
+from utils.select_video_source import create_video_source
+
+
+# Select the camera source by setting this
+# Options: 'gstreamer', 'webcam', 'ffmpeg', 'replay', 'shared' or 'simulator'
+VIDEO_SOURCE = "ffmpeg"
+REPLAY_FILE = None
+# Number of worker processes, None uses all the cores
+WORKERS = None
+# Frames detected at the same time. More frames in flight use the workers
+# better but add latency.
+MAX_FRAMES_IN_FLIGHT = 2
+# The detections of each frame are published as binary records over UDP
+# multicast and shared memory, read them with utils/results_reader.py.
+# Print them at most every PRINT_INTERVAL seconds, None to not print.
+PRINT_INTERVAL = 1.0
+
+
+def print_detections(markers, cores):
+    for marker in markers:
+        position = marker['position']
+        print(f'Aruco {marker["id"]}: X: {position[0]:.2f}, '
+              f'Y: {position[1]:.2f}, '
+              f'Rotation: {marker["rotation"][2]:.2f} Degrees')
+    for name, positions in cores.items():
+        for i, core in enumerate(positions):
+            print(f'{name} Core {i}: X: {core[0]:.2f}, Y: {core[1]:.2f}')
+
+
+def main():
+    source = create_video_source(VIDEO_SOURCE, replay_file=REPLAY_FILE)
+    config = detector_config(ARUCO_DICT_ID, ARUCO_DETECTER_PARAMETERS, MTX,
+                             DIST, SIZE_OF_MARKER, ECORE_COLOR_RANGES,
+                             calibration_file=CALIBRATION_FILE)
+    publisher = ResultsPublisher(
+        RESULTS_NAME, RESULTS_PORT,
+        class_names=[name for name, _, _ in ECORE_COLOR_RANGES],
+        print_interval=PRINT_INTERVAL,
+        print_function=print_detections)
+    pipeline = None
+
+    try:
+        while True:
+            if not source.wait_for_new_frame(timeout=1.0):
+                if getattr(source, 'ended', False):
+                    # The replay or the capture daemon has ended
+                    break
+                continue
+            frame, info = source.latest_frame(copy=False)
+            if frame is None:
+                continue
+            if pipeline is None:
+                pipeline = ParallelDetectionPipeline(frame.shape, config,
+                                                     workers=WORKERS)
+
+            if pipeline.frames_in_flight >= MAX_FRAMES_IN_FLIGHT:
+                for done_info, detections in pipeline.collect(block=True):
+                    publisher.publish(done_info, detections['markers'],
+                                      detections['cores'])
+            pipeline.submit(frame, info)
+            for done_info, detections in pipeline.collect():
+                publisher.publish(done_info, detections['markers'],
+                                  detections['cores'])
+    except KeyboardInterrupt:
+        print("Closing")
+    finally:
+        if pipeline is not None:
+            pipeline.close()
+        publisher.close()
+        source.stop()
+
+
+if __name__ == '__main__':
+    main()
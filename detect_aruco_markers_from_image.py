@@ -1,18 +1,31 @@
 """
 Example script to detect aruco markers from an image using OpenCV
 """
-import json
-import numpy as np
 import cv2
 from cv2 import aruco
-from utils.aruco_utils import aruco_poses_to_transforms
-from utils.select_video_source import select_video_source
+from utils.aruco_utils import aruco_poses_to_arrays, image_to_gray
+from utils.arena_mapping import DEFAULT_CORNER_MARKERS
+from utils.arena_region import make_arena_region, offset_corners
+from utils.aruco_tracker import TrackingArucoDetector
+from utils.pyramid_detection import detect_markers_pyramid
+from utils.preview_server import PreviewServer
+from utils.results_publisher import ResultsPublisher
+from utils.buffer_arena import BufferArena
+from utils.calibration import load_calibration
+from utils.parameter_sweep import load_aruco_config
+from utils.select_video_source import create_video_source
 
 
 # Select the camera source by setting this
-VIDEO_SOURCE = "ffmpeg"  # Options: 'gstreamer', 'webcam' or 'opencv'
+# Options: 'gstreamer', 'webcam', 'ffmpeg', 'replay', 'shared' or 'simulator'
+VIDEO_SOURCE = "ffmpeg"
+# Frame log to replay when VIDEO_SOURCE is 'replay'
+REPLAY_FILE = None
+# Set to a file name to record the frames to a frame log for replaying
+RECORD_FILE = None
 
-ARUCO_DICT = aruco.Dictionary_get(aruco.DICT_4X4_50)
+ARUCO_DICT_ID = aruco.DICT_4X4_50
+ARUCO_DICT = aruco.Dictionary_get(ARUCO_DICT_ID)
 ARUCO_DETECTER_PARAMETERS = aruco.DetectorParameters_create()
 # Let's set some aruco detection parameters to make the marker
 # detection a bit more stable
@@ -20,31 +33,99 @@ ARUCO_DETECTER_PARAMETERS.cornerRefinementMethod = aruco.CORNER_REFINE_SUBPIX
 ARUCO_DETECTER_PARAMETERS.cornerRefinementWinSize = 5
 ARUCO_DETECTER_PARAMETERS.minMarkerDistanceRate = 0.05
 ARUCO_DETECTER_PARAMETERS.cornerRefinementMinAccuracy = 0.5
+# Set to an aruco config file written by sweep_detector_params.py to use
+# its parameters instead of the ones above
+ARUCO_CONFIG_FILE = None
+if ARUCO_CONFIG_FILE:
+    ARUCO_DETECTER_PARAMETERS = load_aruco_config(ARUCO_CONFIG_FILE)
+# Search markers only around their last known positions and do a full
+# frame detection every FULL_SWEEP_INTERVAL frames or when a marker is lost
+USE_TRACKING_DETECTOR = True
+FULL_SWEEP_INTERVAL = 10
+# Set to e.g. 0.5 to detect the markers from a downscaled frame and refine
+# the corners from the full resolution frame. Used when the tracking
+# detector is off. Check the accuracy with the pyramid_detection module.
+PYRAMID_SCALE = 1.0
+# Detect only inside the arena. Set to 'markers' to derive the arena from
+# the corner markers of utils.arena_mapping.DEFAULT_CORNER_MARKERS or to a
+# list of its [x, y] corners in pixels.
+ARENA_REGION = None
 
 # Read camera calibration params. The calibration parameters are
 # camera model specific. These calibration params have been made for
 # Rapsberry Pi Camera Module 2 but they seem to work OK with a webcam too.
 # To create your own calibration params see this guide:
 # https://github.com/robot-uprising-hq/ai-backend-connector/blob/master/docs/Camera-Calibration.md
-with open('rpi-camera-calib-params.json') as json_file:
-    calib_params = json.load(json_file)
-    MTX = np.array(calib_params['mtx'], dtype=np.float32)
-    DIST = np.array(calib_params['dist'], dtype=np.float32)
+# The calibration is loaded once and its derived data is cached next to
+# the file, see utils/calibration.py
+CALIBRATION_FILE = 'rpi-camera-calib-params.json'
+CALIBRATION = load_calibration(CALIBRATION_FILE)
+MTX = CALIBRATION.mtx
+DIST = CALIBRATION.dist
 SIZE_OF_MARKER = 0.15
+# Undistort the detected corners before the pose estimation so that the
+# positions are in undistorted pixel coordinates. Only the corners are
+# undistorted, not the whole frame.
+UNDISTORT_POINTS = True
 
+# Set HEADLESS to True to skip all drawing and windows in the detection
+# loop. Set PREVIEW_PORT to e.g. 8080 to still see downscaled previews at
+# http://localhost:8080/ without slowing down the detection.
+HEADLESS = False
+PREVIEW_PORT = None
 
-def print_transforms(transforms):
+# Publish the markers of each frame as binary records over UDP multicast
+# and shared memory. Read them from other processes with
+# utils/results_reader.py, e.g.
+# python -m utils.results_reader --name ai-simple-markers
+PUBLISH_RESULTS = True
+RESULTS_NAME = 'ai-simple-markers'
+RESULTS_PORT = 5301
+# Print the markers at most every PRINT_INTERVAL seconds, None to not print
+PRINT_INTERVAL = 1.0
+
+
+def print_transforms(markers, cores=None):
     """
     Function to pretty print the Aruco marker ID, X and Y coordinate
-    and rotation of the robots found.
+    and rotation of the robots found. The print function of the results
+    publisher.
     """
-    for aruco_id in transforms.keys():
-        position = transforms[aruco_id]['position']
-        rotation = transforms[aruco_id]['rotation']
+    for marker in markers:
+        position = marker['position']
+        rotation = marker['rotation']
 
-        print(f'=== Aruco {aruco_id}\n'
+        print(f'=== Aruco {marker["id"]}\n'
               f'Position: X: {position[0]:.2f}, Y: {position[1]:.2f}\n'
-              f'Rotation: {rotation[0]:.2f} Degrees\n')
+              f'Rotation: {rotation[2]:.2f} Degrees\n')
+
+
+def draw_markers(image, corners, detected_ids, scale=1.0):
+    """
+    Draw the detected markers to an image that is scaled from the frame
+    """
+    if detected_ids is None:
+        return image
+    scaled_corners = [marker_corners * scale for marker_corners in corners]
+    return aruco.drawDetectedMarkers(image, scaled_corners, detected_ids)
+
+
+def show_frame(frame, corners, detected_ids, rvecs, tvecs):
+    """
+    Show the frame with the detected markers and their axes in a window
+    """
+    if tvecs is not None and rvecs is not None:
+        imaxis = draw_markers(frame, corners, detected_ids)
+        for i, _ in enumerate(tvecs):
+            aruco.drawAxis(imaxis,
+                           MTX,
+                           DIST,
+                           rvecs[i],
+                           tvecs[i],
+                           SIZE_OF_MARKER)
+        cv2.imshow('frame', imaxis)
+    else:
+        cv2.imshow('frame', frame)
 
 
 def main():
@@ -52,42 +133,91 @@ def main():
     Get an image from the chosen video source and then detect the robots
     from the image. Finally print the coordinates of the found robots.
     """
-    get_image_func = select_video_source(VIDEO_SOURCE)
-
-    while True:
-        # Capture stream frame by frame
-        frame = get_image_func()
-        if frame is None:
-            continue
-
-        corners, detected_ids, rejected_img_points = \
-            aruco.detectMarkers(frame,
-                                ARUCO_DICT,
-                                parameters=ARUCO_DETECTER_PARAMETERS)
-
-        rvecs, tvecs, _ = aruco.estimatePoseSingleMarkers(corners,
-                                                          SIZE_OF_MARKER,
-                                                          MTX,
-                                                          DIST)
-
-        if tvecs is not None and rvecs is not None:
-            imaxis = aruco.drawDetectedMarkers(frame, corners, detected_ids)
-            for i, _ in enumerate(tvecs):
-                aruco.drawAxis(imaxis,
-                               MTX,
-                               DIST,
-                               rvecs[i],
-                               tvecs[i],
-                               SIZE_OF_MARKER)
-            cv2.imshow('frame', imaxis)
-            transforms = aruco_poses_to_transforms(detected_ids=detected_ids,
-                                                   corners=corners,
-                                                   rvecs=rvecs)
-            print_transforms(transforms)
-        else:
-            cv2.imshow('frame', frame)
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
+    source = create_video_source(VIDEO_SOURCE,
+                                 replay_file=REPLAY_FILE,
+                                 record_file=RECORD_FILE)
+    tracking_detector = TrackingArucoDetector(
+        ARUCO_DICT,
+        ARUCO_DETECTER_PARAMETERS,
+        full_sweep_interval=FULL_SWEEP_INTERVAL)
+    preview_server = PreviewServer(PREVIEW_PORT) if PREVIEW_PORT else None
+    # Reuse the image buffers of the pipeline from frame to frame
+    arena = BufferArena()
+    arena_region = make_arena_region(ARENA_REGION, DEFAULT_CORNER_MARKERS)
+    publisher = ResultsPublisher(RESULTS_NAME, RESULTS_PORT,
+                                 multicast=PUBLISH_RESULTS,
+                                 shared_memory=PUBLISH_RESULTS,
+                                 print_interval=PRINT_INTERVAL,
+                                 print_function=print_transforms)
+
+    # The frames are copied to the buffer of the first frame
+    frame_buffer = None
+    try:
+        while True:
+            if not source.wait_for_new_frame(timeout=1.0):
+                if getattr(source, 'ended', False):
+                    # The replay or the capture daemon has ended
+                    break
+                continue
+            frame, info = source.latest_frame(out=frame_buffer)
+            if frame is None:
+                continue
+            frame_buffer = frame
+
+            # The detectors see only the arena and their corners are moved
+            # back to frame coordinates
+            detection_frame, offset = frame, (0, 0)
+            if arena_region is not None:
+                detection_frame, offset = arena_region.apply(frame, arena)
+
+            if USE_TRACKING_DETECTOR:
+                corners, detected_ids, rejected_img_points = \
+                    tracking_detector.detect(detection_frame)
+            elif PYRAMID_SCALE < 1.0:
+                corners, detected_ids, rejected_img_points = \
+                    detect_markers_pyramid(detection_frame,
+                                           ARUCO_DICT,
+                                           ARUCO_DETECTER_PARAMETERS,
+                                           PYRAMID_SCALE,
+                                           arena=arena)
+            else:
+                corners, detected_ids, rejected_img_points = \
+                    aruco.detectMarkers(image_to_gray(detection_frame, arena),
+                                        ARUCO_DICT,
+                                        parameters=ARUCO_DETECTER_PARAMETERS)
+            corners = offset_corners(corners, offset)
+            rejected_img_points = offset_corners(rejected_img_points, offset)
+            if arena_region is not None:
+                arena_region.update(corners, detected_ids)
+
+            if UNDISTORT_POINTS:
+                pose_corners, rvecs, tvecs = CALIBRATION.estimate_poses(
+                    corners, SIZE_OF_MARKER)
+            else:
+                pose_corners = corners
+                rvecs, tvecs, _ = aruco.estimatePoseSingleMarkers(
+                    corners, SIZE_OF_MARKER, MTX, DIST)
+
+            markers = aruco_poses_to_arrays(detected_ids, pose_corners, rvecs)
+            publisher.publish(info, markers=markers)
+
+            if preview_server is not None:
+                preview_server.publish(
+                    frame,
+                    lambda image, scale, corners=corners, ids=detected_ids:
+                        draw_markers(image, corners, ids, scale))
+            if HEADLESS:
+                continue
+            show_frame(frame, corners, detected_ids, rvecs, tvecs)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    except KeyboardInterrupt:
+        print("Closing")
+    finally:
+        source.stop()
+        publisher.close()
+        if USE_TRACKING_DETECTOR:
+            print(f'Tracking detector stats: {tracking_detector.stats()}')
 
 
 if __name__ == '__main__':
@@ -3,12 +3,26 @@ Example script to detect objects by color from an image using OpenCV.
 """
 import numpy as np
 import cv2
-from utils.ecore_utils import image_to_center_points
-from utils.select_video_source import select_video_source
+from utils.ecore_utils import \
+    image_to_center_points_multi, offset_center_points
+from utils.pyramid_detection import image_to_center_points_pyramid
+from utils.preview_server import PreviewServer
+from utils.results_publisher import ResultsPublisher
+from utils.buffer_arena import BufferArena
+from utils.calibration import load_calibration
+from utils.motion_gate import GatedCoreDetector
+from utils.arena_region import make_arena_region
+from utils.parameter_sweep import load_ecore_config
+from utils.select_video_source import create_video_source
 
 
 # Select the camera source by setting this
-VIDEO_SOURCE = "ffmpeg"  # Options: 'gstreamer', 'webcam' or 'opencv'
+# Options: 'gstreamer', 'webcam', 'ffmpeg', 'replay', 'shared' or 'simulator'
+VIDEO_SOURCE = "ffmpeg"
+# Frame log to replay when VIDEO_SOURCE is 'replay'
+REPLAY_FILE = None
+# Set to a file name to record the frames to a frame log for replaying
+RECORD_FILE = None
 
 # Low and High values in HSV-colorspace for detecting color range.
 # See the these articles to understand more about HSV-colorspace:
@@ -20,50 +34,164 @@ POS_ECORE_HIGH_COLOR = np.array([175, 255, 255], dtype=np.float32)
 NEG_ECORE_LOW_COLOR = np.array([25, 80, 100], dtype=np.float32)
 NEG_ECORE_HIGH_COLOR = np.array([40, 255, 255], dtype=np.float32)
 
+# All the color classes to detect. The frame is blurred and converted to
+# HSV only once no matter how many classes are listed here.
+ECORE_COLOR_RANGES = [
+    ('Positive', POS_ECORE_LOW_COLOR, POS_ECORE_HIGH_COLOR),
+    ('Negative', NEG_ECORE_LOW_COLOR, NEG_ECORE_HIGH_COLOR),
+]
+# Set to an ecore config file written by sweep_detector_params.py to use
+# its minimum area and erode and dilate iterations
+ECORE_CONFIG_FILE = None
+ECORE_OPTIONS = load_ecore_config(ECORE_CONFIG_FILE) \
+    if ECORE_CONFIG_FILE else {}
 
-def print_core_positions(pos_ecore_positions, neg_ecore_positions):
+# Set to e.g. 0.5 to find the cores from a downscaled frame and refine
+# their centers from the full resolution frame
+PYRAMID_SCALE = 1.0
+
+# Process only the parts of the frame that have changed since they were
+# last processed and skip frames identical to the previous one. Used when
+# PYRAMID_SCALE is 1.0.
+MOTION_GATING = False
+
+# Process only the arena to save time and to not find false cores outside
+# it. Set to a list of the [x, y] corners of the arena in pixels.
+ARENA_REGION = None
+
+# Set to a camera calibration file to report the core positions in
+# undistorted pixel coordinates like the aruco marker positions. Only the
+# found centers are undistorted, not the whole frame.
+CALIBRATION_FILE = 'rpi-camera-calib-params.json'
+
+# Set HEADLESS to True to skip all drawing and windows in the detection
+# loop. Set PREVIEW_PORT to e.g. 8080 to still see downscaled previews at
+# http://localhost:8080/ without slowing down the detection.
+HEADLESS = False
+PREVIEW_PORT = None
+
+# Publish the cores of each frame as binary records over UDP multicast
+# and shared memory. Read them from other processes with
+# utils/results_reader.py, e.g.
+# python -m utils.results_reader --name ai-simple-cores
+PUBLISH_RESULTS = True
+RESULTS_NAME = 'ai-simple-cores'
+RESULTS_PORT = 5302
+# Print the cores at most every PRINT_INTERVAL seconds, None to not print
+PRINT_INTERVAL = 1.0
+
+
+def print_core_positions(markers, core_positions):
     """
-    Function to pretty print the X and Y coordinates for energy cores
+    Function to pretty print the X and Y coordinates for energy cores.
+    The print function of the results publisher.
     """
-    if pos_ecore_positions:
-        for i, core in enumerate(pos_ecore_positions):
-            print(f'Positive Core {i}: X: {core[0]:.2f}, Y: {core[1]:.2f}')
-    if neg_ecore_positions:
-        for i, core in enumerate(neg_ecore_positions):
-            print(f'Negative Core {i}: X: {core[0]:.2f}, Y: {core[1]:.2f}')
-    if not pos_ecore_positions and not neg_ecore_positions:
+    for name, positions in core_positions.items():
+        for i, core in enumerate(positions):
+            print(f'{name} Core {i}: X: {core[0]:.2f}, Y: {core[1]:.2f}')
+    if not any(len(positions) for positions in core_positions.values()):
         print('No Energy Cores detected')
     print('=== Done\n')
 
 
+def draw_core_positions(image, core_positions, scale=1.0):
+    """
+    Draw a circle around the found energy cores to an image that is
+    scaled from the frame
+    """
+    for name, positions in core_positions.items():
+        for core in positions:
+            center = (int(core[0] * scale), int(core[1] * scale))
+            cv2.circle(image, center, int(40 * scale), (255, 255, 255), 2)
+            cv2.putText(image, name, center, cv2.FONT_HERSHEY_SIMPLEX,
+                        0.4, (255, 255, 255))
+
+
 def main():
     """
     Get an image from the chosen video source and then detect the energy
     cores from the image. Finally print the coordinates of the found
     energy cores.
     """
-    get_image_func = select_video_source(VIDEO_SOURCE)
-
-    while True:
-        frame = get_image_func()
-        if frame is None:
-            continue
-
-        cv2.imshow('frame', frame)
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
-
-        pos_ecore_positions = image_to_center_points(
-            frame,
-            POS_ECORE_LOW_COLOR,
-            POS_ECORE_HIGH_COLOR,
-            'Positive Energy Cores')
-        neg_ecore_positions = image_to_center_points(
-            frame,
-            NEG_ECORE_LOW_COLOR,
-            NEG_ECORE_HIGH_COLOR,
-            'Negative Energy Cores')
-        print_core_positions(pos_ecore_positions, neg_ecore_positions)
+    source = create_video_source(VIDEO_SOURCE,
+                                 replay_file=REPLAY_FILE,
+                                 record_file=RECORD_FILE)
+
+    preview_server = PreviewServer(PREVIEW_PORT) if PREVIEW_PORT else None
+    calibration = load_calibration(CALIBRATION_FILE) \
+        if CALIBRATION_FILE else None
+    # Reuse the image buffers of the pipeline from frame to frame
+    arena = BufferArena()
+    gated_detector = GatedCoreDetector(ECORE_COLOR_RANGES, **ECORE_OPTIONS) \
+        if MOTION_GATING else None
+    arena_region = make_arena_region(ARENA_REGION)
+    publisher = ResultsPublisher(
+        RESULTS_NAME, RESULTS_PORT,
+        class_names=[name for name, _, _ in ECORE_COLOR_RANGES],
+        multicast=PUBLISH_RESULTS,
+        shared_memory=PUBLISH_RESULTS,
+        print_interval=PRINT_INTERVAL,
+        print_function=print_core_positions)
+
+    # The frames are copied to the buffer of the first frame
+    frame_buffer = None
+    try:
+        while True:
+            if not source.wait_for_new_frame(timeout=1.0):
+                if getattr(source, 'ended', False):
+                    # The replay or the capture daemon has ended
+                    break
+                continue
+            frame, info = source.latest_frame(out=frame_buffer)
+            if frame is None:
+                continue
+            frame_buffer = frame
+
+            if not HEADLESS:
+                cv2.imshow('frame', frame)
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+
+            # The detectors see only the arena and their center points are
+            # moved back to frame coordinates
+            detection_frame, offset = frame, (0, 0)
+            if arena_region is not None:
+                detection_frame, offset = arena_region.apply(frame, arena)
+
+            if PYRAMID_SCALE < 1.0:
+                core_positions = image_to_center_points_pyramid(
+                    detection_frame,
+                    ECORE_COLOR_RANGES,
+                    PYRAMID_SCALE,
+                    arena=arena,
+                    **ECORE_OPTIONS)
+            elif gated_detector is not None:
+                core_positions = gated_detector.detect(detection_frame)
+            else:
+                core_positions = image_to_center_points_multi(
+                    detection_frame,
+                    ECORE_COLOR_RANGES,
+                    debug=not HEADLESS,
+                    arena=arena,
+                    **ECORE_OPTIONS)
+            core_positions = offset_center_points(core_positions, offset)
+            publisher.publish(
+                info,
+                cores=calibration.undistort_center_points(core_positions)
+                if calibration is not None else core_positions)
+
+            if preview_server is not None:
+                preview_server.publish(
+                    frame,
+                    lambda image, scale, positions=core_positions:
+                        draw_core_positions(image, positions, scale))
+    except KeyboardInterrupt:
+        print("Closing")
+    finally:
+        source.stop()
+        publisher.close()
+        if gated_detector is not None:
+            print(f'Motion gating stats: {gated_detector.stats()}')
 
 
 if __name__ == '__main__':
@@ -1,4 +1,4 @@
-import socket
+from utils.robot_commander import get_commander
 
 
 ROBOT_IP = "127.0.0.1"
@@ -8,9 +8,10 @@ RIGHT_TRACK_SPEED = 100
 
 
 def main():
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.sendto(bytes(f"{LEFT_TRACK_SPEED};{RIGHT_TRACK_SPEED}", "utf-8"),
-                (ROBOT_IP, ROBOT_PORT))
+    commander = get_commander()
+    commander.add_robot('robot', ROBOT_IP, ROBOT_PORT)
+    commander.set_speeds('robot', LEFT_TRACK_SPEED, RIGHT_TRACK_SPEED)
+    commander.flush()
 
 
 if __name__ == '__main__':
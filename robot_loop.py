@@ -0,0 +1,144 @@
+"""
+Example script that ties the vision to the robot commands. Each robot
+whose aruco marker is visible turns and drives towards the nearest
+positive energy core.
+"""
+import asyncio
+import numpy as np
+from detect_aruco_markers_from_image import \
+    ARUCO_DICT, ARUCO_DETECTER_PARAMETERS, MTX, DIST, SIZE_OF_MARKER, \
+    CALIBRATION
+from detect_energy_cores_from_image import ECORE_COLOR_RANGES, ECORE_OPTIONS
+from utils.arena_mapping import DEFAULT_CORNER_MARKERS, ArenaMapper
+from utils.arena_region import make_arena_region
+from utils.latency import MetricsServer, StatsReporter, get_latency_stats
+from utils.object_tracker import DetectionTracker
+from utils.robot_commander import get_commander
+from utils.select_video_source import create_video_source
+from utils.sense_plan_act import SensePlanActLoop, make_detector
+
+
+# Select the camera source by setting this
+# Options: 'gstreamer', 'webcam', 'ffmpeg', 'replay', 'shared' or 'simulator'
+VIDEO_SOURCE = "ffmpeg"
+REPLAY_FILE = None
+
+# Print the latency stats every this many seconds, None to disable. Set
+# METRICS_PORT to e.g. 9100 to serve them at http://localhost:9100/metrics
+STATS_INTERVAL = 10
+METRICS_PORT = None
+
+# Aruco marker id of each robot and the robot's IP address and port
+ROBOTS = {
+    0: ("127.0.0.1", 3001),
+}
+TARGET_CORES = 'Positive'
+MAX_SPEED = 100
+# Heading error in degrees at which the robot only turns
+TURN_ONLY_ANGLE = 45
+# Detect the energy cores only on every this many frames and predict them
+# from their tracks in between. The cores move slowly so the robots are
+# steered with the predictions just fine. When the loop drops frames the
+# interval is raised up to MAX_CORE_DETECT_INTERVAL.
+CORE_DETECT_INTERVAL = 3
+MAX_CORE_DETECT_INTERVAL = 8
+
+# Aruco marker ids at the arena corners and their arena coordinates. The
+# robots are steered in arena coordinates once all of them have been seen.
+# The simulator draws the same markers. Change them in
+# utils.arena_mapping.DEFAULT_CORNER_MARKERS or set to None to steer in
+# pixel coordinates.
+ARENA_CORNER_MARKERS = DEFAULT_CORNER_MARKERS
+# Process only the playfield. Set to 'markers' to derive it from the
+# corner markers above or to a list of its [x, y] corners in pixels.
+ARENA_REGION = None
+
+
+def drive_to_nearest_core(detections, frame_info, commander):
+    """
+    Control callback that steers each visible robot to the nearest core
+    """
+    if detections.get('arena') is not None:
+        markers, cores = detections['arena']
+    else:
+        markers, cores = detections['markers'], detections['cores']
+    cores = np.array(cores.get(TARGET_CORES, []),
+                     dtype=np.float32).reshape(-1, 2)
+    robots = set(commander.robots)
+    for marker in markers:
+        robot = marker['id'].item()
+        if robot not in robots:
+            continue
+        if not len(cores):
+            commander.set_speeds(robot, 0, 0, frame_info.timestamp)
+            continue
+
+        offsets = cores - marker['position']
+        target = offsets[np.argmin(np.hypot(offsets[:, 0], offsets[:, 1]))]
+        heading = np.degrees(np.arctan2(target[1], target[0]))
+        # Wrap the error to -180..180 degrees
+        error = (heading - marker['rotation'][2] + 180) % 360 - 180
+
+        turn = np.clip(error / TURN_ONLY_ANGLE, -1, 1)
+        forward = 1 - abs(turn)
+        commander.set_speeds(robot,
+                             MAX_SPEED * np.clip(forward + turn, -1, 1),
+                             MAX_SPEED * np.clip(forward - turn, -1, 1),
+                             frame_info.timestamp)
+
+
+def make_robot_loop(source, commander,
+                    arena_corner_markers=ARENA_CORNER_MARKERS,
+                    arena_region=ARENA_REGION):
+    """
+    Make the loop that detects the robots and the cores from the frames of
+    the source and steers the commander's robots with
+    drive_to_nearest_core
+    """
+    arena_mapper = ArenaMapper(arena_corner_markers) \
+        if arena_corner_markers else None
+    tracker = DetectionTracker(
+        ECORE_COLOR_RANGES,
+        core_detect_interval=CORE_DETECT_INTERVAL,
+        max_core_detect_interval=MAX_CORE_DETECT_INTERVAL)
+    detect = make_detector(ARUCO_DICT, ARUCO_DETECTER_PARAMETERS, MTX, DIST,
+                           SIZE_OF_MARKER, ECORE_COLOR_RANGES,
+                           calibration=CALIBRATION,
+                           arena_mapper=arena_mapper,
+                           tracker=tracker,
+                           timer=get_latency_stats(),
+                           ecore_options=ECORE_OPTIONS,
+                           region=make_arena_region(arena_region,
+                                                    arena_corner_markers))
+    return SensePlanActLoop(source, detect, drive_to_nearest_core, commander,
+                            tracker=tracker)
+
+
+def main():
+    commander = get_commander()
+    for robot, (ip, port) in ROBOTS.items():
+        commander.add_robot(robot, ip, port)
+
+    source = create_video_source(VIDEO_SOURCE, replay_file=REPLAY_FILE)
+    loop = make_robot_loop(source, commander)
+    reporter = StatsReporter(interval=STATS_INTERVAL) \
+        if STATS_INTERVAL else None
+    metrics_server = MetricsServer(port=METRICS_PORT) \
+        if METRICS_PORT else None
+
+    try:
+        asyncio.run(loop.run())
+    except KeyboardInterrupt:
+        print("Closing")
+    finally:
+        commander.stop_all()
+        source.stop()
+        if reporter is not None:
+            reporter.stop()
+        if metrics_server is not None:
+            metrics_server.stop()
+        print(f'Loop stats: {loop.stats()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""
+Decode the camera stream once and serve the frames to local processes.
+
+Runs a capture daemon that decodes the stream into a shared memory ring.
+Set VIDEO_SOURCE to 'shared' in the detection scripts to read the frames
+from the ring, so several scripts can run at once without decoding the
+stream twice or fighting over its port.
+
+Examples:
+    python run_capture_daemon.py
+    python run_capture_daemon.py --url recordings/match.avi --max-fps 30
+"""
+import argparse
+import signal
+from utils.capture_daemon import RING_NAME, RING_SLOTS, CaptureDaemon
+from utils.ffmpeg_video_source import URL
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--url', default=URL,
+                        help='Stream, video file or camera for '
+                             'cv2.VideoCapture')
+    parser.add_argument('--name', default=RING_NAME,
+                        help='Name of the shared memory ring')
+    parser.add_argument('--slots', type=int, default=RING_SLOTS,
+                        help='Frames in the ring. A consumer may fall this '
+                             'many frames minus one behind.')
+    parser.add_argument('--max-fps', type=float,
+                        help='Limit the frame rate, e.g. for video files')
+    args = parser.parse_args()
+
+    daemon = CaptureDaemon(args.url, args.name, args.slots, args.max_fps)
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        print("Closing")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Load test the vision to robot command loop with simulated robots.
+
+Runs the loop of robot_loop.py against a RobotSimulator whose robots take
+the same UDP commands as the robots running the ai-robot-udp firmware,
+and prints the frame rate, dropped frames, commands and latency stats as
+JSON when done.
+
+Examples:
+    python simulate_robots.py --robots 10 --seconds 30
+    python simulate_robots.py --robots 50 --marker-size 48 --no-corners
+"""
+import argparse
+import asyncio
+import json
+import sys
+from detect_energy_cores_from_image import ECORE_COLOR_RANGES
+from robot_loop import ARENA_CORNER_MARKERS, make_robot_loop
+from utils.latency import StatsReporter, get_latency_stats
+from utils.robot_commander import get_commander
+from utils.robot_simulator import (
+    CORES_PER_CLASS, FIRST_PORT, FPS, HOST, MARKER_SIZE, RobotSimulator,
+    SimulatorVideoSource)
+
+
+# Seconds run before the stats are reset so that the startup, e.g. the
+# first arena mapping, is not measured
+WARMUP_SECONDS = 2.0
+
+
+async def run_for(loop, seconds):
+    task = asyncio.create_task(loop.run())
+    await asyncio.sleep(seconds)
+    loop.stop()
+    await task
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--robots', type=int, default=1,
+                        help='Number of simulated robots')
+    parser.add_argument('--seconds', type=float, default=20.0,
+                        help='Seconds to run after the warmup')
+    parser.add_argument('--fps', type=float, default=FPS,
+                        help='Frames rendered per second')
+    parser.add_argument('--cores', type=int, default=CORES_PER_CLASS,
+                        help='Energy cores of each color')
+    parser.add_argument('--marker-size', type=int, default=MARKER_SIZE,
+                        help='Marker size in pixels. Use smaller markers '
+                             'with many robots.')
+    parser.add_argument('--first-port', type=int, default=FIRST_PORT,
+                        help='UDP port of the first robot')
+    parser.add_argument('--no-corners', action='store_true',
+                        help='Draw no arena corner markers, which frees '
+                             'their marker ids for robots')
+    parser.add_argument('--arena-region', action='store_true',
+                        help='Process only the arena inside the corner '
+                             'markers')
+    parser.add_argument('--stats-interval', type=float,
+                        help='Also print the latency stats this often')
+    parser.add_argument('--output',
+                        help='Write the results to this file instead of '
+                             'stdout')
+    args = parser.parse_args()
+
+    corner_markers = None if args.no_corners else ARENA_CORNER_MARKERS
+    simulator = RobotSimulator(args.robots, ECORE_COLOR_RANGES,
+                               cores_per_class=args.cores,
+                               first_port=args.first_port,
+                               corner_markers=corner_markers,
+                               marker_size=args.marker_size)
+    source = SimulatorVideoSource(simulator, fps=args.fps)
+    commander = get_commander()
+    for marker_id, port in zip(simulator.marker_ids, simulator.ports):
+        commander.add_robot(marker_id, HOST, port)
+    loop = make_robot_loop(source, commander, corner_markers,
+                           'markers' if args.arena_region else None)
+    reporter = StatsReporter(interval=args.stats_interval, reset=True) \
+        if args.stats_interval else None
+
+    try:
+        asyncio.run(run_for(loop, WARMUP_SECONDS))
+        loop.frames_processed = 0
+        loop.frames_dropped = 0
+        get_latency_stats().reset()
+        asyncio.run(run_for(loop, args.seconds))
+    except KeyboardInterrupt:
+        print("Closing")
+    finally:
+        commander.stop_all()
+        source.stop()
+        if reporter is not None:
+            reporter.stop()
+
+    stats = loop.stats()
+    results = {
+        'robots': args.robots,
+        'seconds': args.seconds,
+        'fps': args.fps,
+        'processed_fps': stats['frames_processed'] / args.seconds,
+        'frames_processed': stats['frames_processed'],
+        'frames_dropped': stats['frames_dropped'],
+        'late_frames': source.late_frames,
+        'commands': stats['commands'],
+        'simulator': simulator.stats(),
+        'latency': stats['latency'],
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Sweep the detector parameters and find the best speed and accuracy trades.
+
+Runs the aruco marker detection and the energy core detection with each
+combination of the parameter grids over synthetic arenas or recorded
+frames and measures the recall, position error and time per frame of
+each. The Pareto-optimal settings, those that no other setting beats in
+all three, are written as config files that the detection scripts load
+with ARUCO_CONFIG_FILE and ECORE_CONFIG_FILE.
+
+Synthetic arenas have exact truth. Recorded frames have no truth, so the
+detections of the current parameters of the detection scripts, including
+the ones loaded from ARUCO_CONFIG_FILE and ECORE_CONFIG_FILE, are used as
+the truth and the results are relative to them.
+
+Examples:
+    python sweep_detector_params.py --frames 30
+    python sweep_detector_params.py --replay match.frames --grid grid.json
+"""
+import argparse
+import json
+import os
+from benchmark import recorded_frames, replay_frames
+from detect_aruco_markers_from_image import \
+    ARUCO_DICT, ARUCO_DETECTER_PARAMETERS
+from detect_energy_cores_from_image import ECORE_COLOR_RANGES, ECORE_OPTIONS
+from utils.parameter_sweep import (
+    ARUCO_GRID, ECORE_GRID, pareto_front, recorded_corpus, save_config,
+    sweep_aruco, sweep_ecore, synthetic_corpus)
+
+
+MARKER_COUNT = 20
+CORES_PER_CLASS = 5
+OUTPUT_DIR = 'sweep-results'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--images',
+                        help='Glob pattern of recorded frame files. '
+                             'Synthetic arenas are used if not given.')
+    parser.add_argument('--replay',
+                        help='Frame log recorded with RecordingVideoSource')
+    parser.add_argument('--frames', type=int, default=30,
+                        help='Number of synthetic arenas, or the most '
+                             'recorded frames to use')
+    parser.add_argument('--markers', type=int, default=MARKER_COUNT,
+                        help='Markers in each synthetic arena')
+    parser.add_argument('--cores', type=int, default=CORES_PER_CLASS,
+                        help='Energy cores of each color in synthetic arenas')
+    parser.add_argument('--grid',
+                        help='JSON file with "aruco" and "ecore" grids of '
+                             'parameter name to a list of values, replacing '
+                             'the default grids')
+    parser.add_argument('--detectors', default='aruco,ecore',
+                        help='Comma separated detectors to sweep')
+    parser.add_argument('--output-dir', default=OUTPUT_DIR,
+                        help='Directory for the results and config files')
+    args = parser.parse_args()
+
+    if args.images or args.replay:
+        frames = recorded_frames(args.images) if args.images \
+            else replay_frames(args.replay)
+        if not frames:
+            parser.error(f'No frames found in {args.images or args.replay}')
+        corpus = recorded_corpus(frames[:args.frames], ARUCO_DICT,
+                                 ARUCO_DETECTER_PARAMETERS,
+                                 ECORE_COLOR_RANGES, ECORE_OPTIONS)
+        source = args.images or args.replay
+    else:
+        corpus = synthetic_corpus(args.frames, ARUCO_DICT,
+                                  ECORE_COLOR_RANGES, args.markers,
+                                  args.cores)
+        source = 'synthetic'
+
+    grids = {'aruco': ARUCO_GRID, 'ecore': ECORE_GRID}
+    if args.grid:
+        with open(args.grid) as grid_file:
+            grids.update(json.load(grid_file))
+
+    results = {}
+    detectors = args.detectors.split(',')
+    if 'aruco' in detectors:
+        results['aruco'] = sweep_aruco(corpus, ARUCO_DICT,
+                                       ARUCO_DETECTER_PARAMETERS,
+                                       grids['aruco'])
+    if 'ecore' in detectors:
+        results['ecore'] = sweep_ecore(corpus, ECORE_COLOR_RANGES,
+                                       grids['ecore'])
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    summary = {'source': source, 'frames': len(corpus), 'detectors': {}}
+    for detector, detector_results in results.items():
+        front = pareto_front(detector_results)
+        paths = []
+        for index, result in enumerate(front):
+            path = os.path.join(args.output_dir,
+                                f'{detector}-pareto-{index}.json')
+            save_config(path, result, ARUCO_DETECTER_PARAMETERS)
+            paths.append(path)
+            metrics = result['metrics']
+            error = metrics['position_error_px']
+            print(f'{path}: recall {metrics["recall"]:.3f} '
+                  f'error {"-" if error is None else f"{error:.2f}px"} '
+                  f'p50 {metrics["p50_ms"]:.1f}ms {result["settings"]}')
+        summary['detectors'][detector] = {
+            'results': detector_results,
+            'pareto_configs': paths,
+        }
+
+    with open(os.path.join(args.output_dir, 'summary.json'), 'w') \
+            as summary_file:
+        json.dump(summary, summary_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
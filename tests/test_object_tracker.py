@@ -0,0 +1,51 @@
+import numpy as np
+from utils.aruco_utils import MARKER_DTYPE
+from utils.object_tracker import LOAD_WINDOW, DetectionTracker
+
+
+COLOR_RANGES = [('Positive', np.zeros(3), np.zeros(3))]
+
+
+def make_markers(positions):
+    markers = np.zeros(len(positions), dtype=MARKER_DTYPE)
+    markers['id'] = np.arange(len(positions))
+    markers['position'] = np.reshape(positions, (-1, 2))
+    return markers
+
+
+def test_markers_only_update_before_first_core_detection():
+    tracker = DetectionTracker(COLOR_RANGES, core_detect_interval=3)
+
+    markers, core_tracks = tracker.update(make_markers([[10, 20]]),
+                                          timestamp=1.0)
+
+    assert markers['id'].tolist() == [0]
+    assert len(core_tracks['Positive']) == 0
+    # The cores have still not been detected so the next frame needs it
+    assert tracker.need_core_detection()
+
+
+def test_core_detection_interval():
+    tracker = DetectionTracker(COLOR_RANGES, core_detect_interval=3)
+    tracker.update(make_markers([]), {'Positive': [[5, 5]]}, timestamp=1.0)
+
+    needed = []
+    for frame in range(4):
+        needed.append(tracker.need_core_detection())
+        tracker.update(make_markers([]), timestamp=1.1 + frame * 0.1)
+    assert needed == [False, False, True, True]
+
+
+def test_core_detection_interval_follows_the_load():
+    tracker = DetectionTracker(COLOR_RANGES, core_detect_interval=2,
+                               max_core_detect_interval=3)
+
+    # Every other frame dropped
+    for frame in range(2 * LOAD_WINDOW):
+        tracker.record_load(frame % 2)
+    assert tracker.core_detect_interval == 3
+
+    # Back to the configured interval once nothing is dropped
+    for frame in range(2 * LOAD_WINDOW):
+        tracker.record_load(0)
+    assert tracker.core_detect_interval == 2
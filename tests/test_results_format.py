@@ -0,0 +1,110 @@
+import os
+import numpy as np
+import pytest
+from utils.aruco_utils import MARKER_DTYPE
+from utils.results_format import (
+    HEADER_DTYPE, MAX_CORES, RECORD_CORE_DTYPE, RECORD_MARKER_DTYPE,
+    RecordWriter, SharedResultsSlot, cores_by_class, unpack_record)
+
+
+CLASS_NAMES = ['Positive', 'Negative']
+SLOT_NAME = f'ai-simple-test-results-{os.getpid()}'
+
+
+def make_markers(count):
+    markers = np.zeros(count, dtype=MARKER_DTYPE)
+    markers['id'] = np.arange(count)
+    markers['position'] = np.arange(2 * count).reshape(-1, 2)
+    markers['rotation'][:, 2] = 90.0
+    return markers
+
+
+@pytest.fixture
+def slot():
+    slot = SharedResultsSlot.create(SLOT_NAME)
+    yield slot
+    slot.close()
+
+
+def test_record_layout():
+    # Other languages read the records at these fixed offsets
+    assert HEADER_DTYPE.itemsize == 36
+    assert RECORD_MARKER_DTYPE.itemsize == 24
+    assert RECORD_CORE_DTYPE.itemsize == 12
+
+
+def test_round_trip():
+    writer = RecordWriter(CLASS_NAMES)
+    cores = {'Positive': [[1.5, 2.5], [3.5, 4.5]], 'Negative': [[5, 6]]}
+
+    record = unpack_record(writer.pack(7, 10.25, 10.5, make_markers(3),
+                                       cores))
+
+    assert (record.sequence, record.timestamp, record.publish_time) == \
+        (7, 10.25, 10.5)
+    assert record.markers['id'].tolist() == [0, 1, 2]
+    assert record.markers['position'].tolist() == [[0, 1], [2, 3], [4, 5]]
+    assert record.markers['rotation'][:, 2].tolist() == [90.0] * 3
+    by_class = cores_by_class(record.cores, CLASS_NAMES)
+    assert by_class['Positive'].tolist() == cores['Positive']
+    assert by_class['Negative'].tolist() == cores['Negative']
+    assert not record.truncated
+    assert writer.truncated_count == 0
+
+
+def test_empty_record():
+    record = unpack_record(RecordWriter(CLASS_NAMES).pack(1, 0.0, 0.0))
+
+    assert len(record.markers) == 0 and len(record.cores) == 0
+    assert not record.truncated
+
+
+def test_too_many_cores_are_truncated():
+    writer = RecordWriter(CLASS_NAMES)
+    cores = {'Positive': np.ones((MAX_CORES - 1, 2)),
+             'Negative': np.full((5, 2), 2.0)}
+
+    record = unpack_record(writer.pack(1, 0.0, 0.0, make_markers(1), cores))
+
+    assert record.truncated
+    assert writer.truncated_count == 1
+    assert len(record.cores) == MAX_CORES
+    assert len(cores_by_class(record.cores, CLASS_NAMES)['Negative']) == 1
+    # The next record fits again
+    assert not unpack_record(writer.pack(2, 0.0, 0.0)).truncated
+
+
+def test_rejects_other_data():
+    with pytest.raises(ValueError):
+        unpack_record(b'\0' * HEADER_DTYPE.itemsize)
+    record = bytes(RecordWriter(CLASS_NAMES).pack(1, 0.0, 0.0,
+                                                  make_markers(2)))
+    with pytest.raises(ValueError):
+        unpack_record(record[:-1])
+
+
+def test_slot_write_and_read(slot):
+    writer = RecordWriter(CLASS_NAMES)
+    assert slot.read() is None
+
+    slot.write(writer.pack(1, 0.0, 0.0, make_markers(1)))
+    first_version, record = slot.read()
+    assert unpack_record(record).sequence == 1
+
+    reader = SharedResultsSlot.attach(SLOT_NAME)
+    try:
+        slot.write(writer.pack(2, 0.0, 0.0))
+        version, record = reader.read()
+        assert version > first_version
+        assert unpack_record(record).sequence == 2
+    finally:
+        reader.close()
+
+
+def test_slot_read_waits_for_the_write_to_finish(slot):
+    slot.write(RecordWriter(CLASS_NAMES).pack(1, 0.0, 0.0))
+    # An odd version means that the publisher is writing the record
+    slot._header['version'] += 1
+
+    with pytest.raises(RuntimeError):
+        slot.read()
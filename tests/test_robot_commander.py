@@ -0,0 +1,105 @@
+import errno
+import socket
+import pytest
+from utils.latency import GLASS_TO_COMMAND, LatencyStats
+from utils.robot_commander import RobotCommander
+
+
+@pytest.fixture
+def robot():
+    """
+    UDP socket standing in for a robot running the ai-robot-udp firmware
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(1.0)
+    yield sock
+    sock.close()
+
+
+@pytest.fixture
+def commander(robot):
+    commander = RobotCommander(max_send_rate_hz=10,
+                               latency_stats=LatencyStats())
+    commander.add_robot('robot', *robot.getsockname())
+    yield commander
+    commander.close()
+
+
+def test_sends_the_latest_command(robot, commander):
+    commander.set_speeds('robot', 20, 30)
+    commander.set_speeds('robot', 50, -50)
+
+    assert commander.flush(now=100.0) == 1
+    assert robot.recv(64) == b'50;-50'
+    assert commander.stats() == {'sent': 1, 'dropped': 1, 'failed': 0,
+                                 'pending': 0}
+
+
+def test_rate_limit(robot, commander):
+    commander.set_speeds('robot', 10, 10)
+    commander.flush(now=100.0)
+    robot.recv(64)
+
+    # Within 1 / max_send_rate_hz of the last send the command waits
+    commander.set_speeds('robot', 20, 20)
+    assert commander.flush(now=100.05) == 0
+    assert commander.stats()['pending'] == 1
+    # and is replaced by a newer one
+    commander.set_speeds('robot', 30, 30)
+    assert commander.flush(now=100.2) == 1
+    assert robot.recv(64) == b'30;30'
+    assert commander.stats() == {'sent': 2, 'dropped': 1, 'failed': 0,
+                                 'pending': 0}
+
+
+def test_glass_to_command_latency(robot):
+    stats = LatencyStats()
+    commander = RobotCommander(latency_stats=stats)
+    commander.add_robot('robot', *robot.getsockname())
+    commander.set_speeds('robot', 10, 10, timestamp=0.0)
+    commander.flush()
+    commander.close()
+
+    assert stats.summary()[GLASS_TO_COMMAND]['count'] == 1
+
+
+class FullSocket():
+    """
+    Non-blocking socket whose send buffer is always full
+    """
+    def sendto(self, data, address):
+        raise BlockingIOError()
+
+    def close(self):
+        pass
+
+
+def test_full_socket_buffer_counts_failed(commander, monkeypatch):
+    commander._sock.close()
+    monkeypatch.setattr(commander, '_sock', FullSocket())
+
+    commander.set_speeds('robot', 10, 10)
+    assert commander.flush(now=100.0) == 0
+    commander.stop_all()
+    assert commander.stats() == {'sent': 0, 'dropped': 0, 'failed': 2,
+                                 'pending': 0}
+
+
+class UnreachableSocket(FullSocket):
+    """
+    Socket whose robot network is down
+    """
+    def sendto(self, data, address):
+        raise OSError(errno.EHOSTUNREACH, 'No route to host')
+
+
+def test_unreachable_robot_counts_failed(commander, monkeypatch):
+    commander._sock.close()
+    monkeypatch.setattr(commander, '_sock', UnreachableSocket())
+
+    commander.set_speeds('robot', 10, 10)
+    assert commander.flush(now=100.0) == 0
+    commander.stop_all()
+    assert commander.stats() == {'sent': 0, 'dropped': 0, 'failed': 2,
+                                 'pending': 0}
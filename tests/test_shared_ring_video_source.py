@@ -0,0 +1,79 @@
+import os
+import signal
+import subprocess
+import sys
+from multiprocessing import shared_memory
+import numpy as np
+import pytest
+from utils.capture_daemon import ConsumerTable, consumers_name
+from utils.frame_info import FrameInfo
+from utils.shared_frame_ring import SharedFrameRing
+from utils.shared_ring_video_source import SharedRingVideoSource
+
+FRAME_SHAPE = (4, 6, 3)
+
+# Stands in for run_capture_daemon.py: creates the ring, publishes one
+# frame and then waits to be killed
+DAEMON = f'''
+import sys, time
+import numpy as np
+from utils.capture_daemon import ConsumerTable
+from utils.frame_info import FrameInfo
+from utils.shared_frame_ring import SharedFrameRing
+ring = SharedFrameRing.create({FRAME_SHAPE}, 4, name=sys.argv[1])
+consumers = ConsumerTable.create(sys.argv[1])
+ring.write(np.ones({FRAME_SHAPE}, dtype=np.uint8),
+           FrameInfo(1, time.monotonic()))
+print('ready', flush=True)
+time.sleep(60)
+'''
+
+
+@pytest.fixture
+def ring_name():
+    return f'ai-simple-test-{os.getpid()}'
+
+
+def test_ends_when_the_daemon_closes_the_ring(ring_name):
+    ring = SharedFrameRing.create(FRAME_SHAPE, 4, name=ring_name)
+    consumers = ConsumerTable.create(ring_name)
+    source = SharedRingVideoSource(ring_name)
+    try:
+        ring.write(np.ones(FRAME_SHAPE, dtype=np.uint8), FrameInfo(1, 0.0))
+        assert source.wait_for_new_frame(timeout=1.0)
+        image, info = source.latest_frame()
+        assert info.sequence == 1 and image.sum() == image.size
+        assert not source.ended
+
+        consumers.close()
+        ring.close()
+        assert not source.wait_for_new_frame(timeout=5.0)
+        assert source.ended
+    finally:
+        source.stop()
+
+
+def test_ends_when_the_daemon_is_killed(ring_name):
+    daemon = subprocess.Popen(
+        [sys.executable, '-c', DAEMON, ring_name], stdout=subprocess.PIPE,
+        text=True, cwd=os.path.dirname(os.path.dirname(__file__)))
+    try:
+        assert daemon.stdout.readline().strip() == 'ready'
+        source = SharedRingVideoSource(ring_name)
+        assert source.wait_for_new_frame(timeout=1.0)
+        source.latest_frame()
+
+        daemon.send_signal(signal.SIGKILL)
+        daemon.wait()
+        assert not source.wait_for_new_frame(timeout=5.0)
+        assert source.ended
+        source.stop()
+    finally:
+        daemon.kill()
+        daemon.wait()
+        # A killed daemon leaves its shared memory behind
+        for name in (ring_name, consumers_name(ring_name)):
+            try:
+                shared_memory.SharedMemory(name=name).unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,178 @@
+import numpy as np
+import cv2
+from utils.aruco_utils import MARKER_DTYPE
+
+
+# Aruco marker ids at the corners of the arena and their positions in
+# arena units, e.g. meters from the first corner
+DEFAULT_CORNER_MARKERS = {
+    46: (0.0, 0.0),
+    47: (1.0, 0.0),
+    48: (1.0, 1.0),
+    49: (0.0, 1.0),
+}
+# Recompute the homography when a corner marker has moved more than this
+# many pixels from where it was when the homography was computed
+DRIFT_THRESHOLD = 2.0
+# Length in pixels of the heading vector that is mapped with the position
+# to get the heading in the arena
+HEADING_LENGTH = 20.0
+
+
+class ArenaMapper():
+    """
+    Maps pixel coordinates to arena coordinates with a homography estimated
+    from the aruco markers at the arena corners.
+
+    The homography is cached and only recomputed when the corner markers
+    drift more than the threshold, e.g. when the camera is bumped. All the
+    robot positions, robot headings and core positions of a frame are
+    mapped with one cv2.perspectiveTransform call.
+    """
+    def __init__(self, corner_markers=None, drift_threshold=DRIFT_THRESHOLD,
+                 heading_length=HEADING_LENGTH):
+        """
+        Args:
+            corner_markers (dictionary, optional): Corner marker id to its
+                (x, y) position in the arena. At least four are needed.
+            drift_threshold (float): Pixels a corner marker may move before
+                the homography is recomputed
+            heading_length (float): Length of the heading vector in pixels
+        """
+        corner_markers = corner_markers or DEFAULT_CORNER_MARKERS
+        if len(corner_markers) < 4:
+            raise ValueError(f'At least four corner markers are needed, '
+                             f'got {len(corner_markers)}')
+        self._corner_ids = np.array(sorted(corner_markers), dtype=np.int32)
+        self._arena_points = np.array(
+            [corner_markers[marker_id] for marker_id in self._corner_ids],
+            dtype=np.float32)
+        self._drift_threshold = drift_threshold
+        self._heading_length = heading_length
+
+        self.homography = None
+        self._inverse_homography = None
+        # Pixel positions of the corners used for the current homography
+        self._pixel_points = None
+        self.recomputes = 0
+
+    @property
+    def ready(self):
+        return self.homography is not None
+
+    def update(self, markers):
+        """
+        Check the corner markers of a frame and recompute the homography if
+        they have drifted. Frames where any corner marker is not visible
+        keep the cached homography.
+
+        Args:
+            markers (numpy structured array of MARKER_DTYPE): Markers of
+                the frame in pixel coordinates
+
+        Returns:
+            bool: True if the homography was recomputed
+        """
+        found = np.isin(self._corner_ids, markers['id'])
+        if not found.all():
+            return False
+
+        order = np.argsort(markers['id'], kind='stable')
+        indexes = order[np.searchsorted(markers['id'], self._corner_ids,
+                                        sorter=order)]
+        pixel_points = markers['position'][indexes]
+
+        if self._pixel_points is not None:
+            drift = np.hypot(*(pixel_points - self._pixel_points).T)
+            if drift.max() <= self._drift_threshold:
+                return False
+
+        homography, _ = cv2.findHomography(pixel_points, self._arena_points)
+        if homography is None:
+            return False
+        self.homography = homography
+        self._inverse_homography = np.linalg.inv(homography)
+        self._pixel_points = pixel_points
+        self.recomputes += 1
+        return True
+
+    def pixel_to_arena(self, points):
+        """
+        Args:
+            points (numpy array (..., 2)): Pixel coordinates
+
+        Returns:
+            numpy array (..., 2) float32: Arena coordinates
+        """
+        return self._transform(points, self.homography)
+
+    def arena_to_pixel(self, points):
+        """
+        Args:
+            points (numpy array (..., 2)): Arena coordinates
+
+        Returns:
+            numpy array (..., 2) float32: Pixel coordinates
+        """
+        return self._transform(points, self._inverse_homography)
+
+    def map_detections(self, markers, cores):
+        """
+        Map the markers and the energy cores of a frame to the arena with
+        one perspectiveTransform call. The corner markers are left out of
+        the markers.
+
+        Args:
+            markers (numpy structured array of MARKER_DTYPE): Markers in
+                pixel coordinates. rotation[2] is the heading in degrees.
+            cores (dictionary): Core centers (N, 2) in pixel coordinates
+                by color class
+
+        Returns:
+            (numpy structured array of MARKER_DTYPE, dictionary): The
+                markers with arena positions and the heading in rotation[2]
+                turned to arena degrees, and the cores in arena
+                coordinates. None if the homography is not known yet.
+        """
+        if not self.ready:
+            return None
+
+        markers = markers[~np.isin(markers['id'], self._corner_ids)]
+        core_arrays = [np.asarray(points, dtype=np.float32).reshape(-1, 2)
+                       for points in cores.values()]
+        heading = np.radians(markers['rotation'][:, 2])
+        heading_points = markers['position'] + self._heading_length * \
+            np.stack([np.cos(heading), np.sin(heading)], axis=1)
+
+        mapped = self.pixel_to_arena(np.concatenate(
+            [markers['position'], heading_points] + core_arrays))
+
+        count = len(markers)
+        arena_markers = np.empty(count, dtype=MARKER_DTYPE)
+        arena_markers['id'] = markers['id']
+        arena_markers['position'] = mapped[:count]
+        arena_markers['rotation'] = markers['rotation']
+        offsets = mapped[count:2 * count] - mapped[:count]
+        arena_markers['rotation'][:, 2] = np.degrees(
+            np.arctan2(offsets[:, 1], offsets[:, 0]))
+
+        arena_cores = {}
+        start = 2 * count
+        for name, points in zip(cores, core_arrays):
+            arena_cores[name] = mapped[start:start + len(points)]
+            start += len(points)
+        return arena_markers, arena_cores
+
+    def stats(self):
+        return {'recomputes': self.recomputes}
+
+    @staticmethod
+    def _transform(points, homography):
+        if homography is None:
+            raise RuntimeError('The arena corners have not been seen yet')
+        points = np.asarray(points, dtype=np.float32)
+        if not points.size:
+            return points.reshape(points.shape)
+        mapped = cv2.perspectiveTransform(points.reshape(-1, 1, 2),
+                                          homography)
+        return mapped.reshape(points.shape)
@@ -0,0 +1,211 @@
+import numpy as np
+import cv2
+
+
+# Pixels the polygon derived from the corner markers is grown by, so that
+# the corner markers themselves and the cores next to them stay inside it
+MARKER_MARGIN = 80
+# Recompute the polygon when a corner marker has moved more than this
+# many pixels, like ArenaMapper does with its homography
+DRIFT_THRESHOLD = 2.0
+# Forget the polygon derived from the corner markers after this many
+# frames without all of them, so the whole frame is searched again. A
+# corner marker that has moved out of the polygon is not detected at all.
+LOST_FRAMES = 10
+
+
+class ArenaRegion():
+    """
+    Polygon of the playfield in the frame. apply crops a frame to the
+    bounding rectangle of the polygon and blacks out the pixels outside
+    the polygon, so the detection processes only the playfield and finds
+    no false objects in the walls or the audience. The results of the
+    cropped frame are translated back to frame coordinates with the offset
+    apply returns, see offset_corners and
+    ecore_utils.offset_center_points.
+
+    The polygon is set by hand or derived from the aruco markers at the
+    arena corners. Until the corner markers have been seen the whole frame
+    is processed, and it is processed again when they have been missing
+    for lost_frames frames, e.g. after the camera or the arena was moved.
+    """
+    def __init__(self, polygon=None, corner_ids=None, margin=MARKER_MARGIN,
+                 drift_threshold=DRIFT_THRESHOLD, lost_frames=LOST_FRAMES):
+        """
+        Args:
+            polygon ([[x, y]], optional): Corners of the playfield in
+                pixels
+            corner_ids ([int], optional): Aruco ids of the corner markers
+                to derive the polygon from with update
+            margin (float): Pixels the polygon from the corner markers is
+                grown by
+            drift_threshold (float): Pixels a corner marker may move before
+                the polygon is recomputed
+            lost_frames (int): Frames without all the corner markers
+                before the polygon derived from them is reset
+        """
+        self.polygon = None
+        self._corner_ids = list(corner_ids) if corner_ids else []
+        self._margin = margin
+        self._drift_threshold = drift_threshold
+        self._lost_frames = lost_frames
+        self._corner_centers = None
+        self._missing_frames = 0
+        # Mask of the bounding rectangle for the frame shape it was made for
+        self._mask = None
+        self._mask_frame_shape = None
+        self._rect = None
+        if polygon is not None:
+            self.set_polygon(polygon)
+
+    @property
+    def ready(self):
+        return self.polygon is not None
+
+    def set_polygon(self, polygon):
+        polygon = np.asarray(polygon, dtype=np.float32).reshape(-1, 2)
+        if len(polygon) < 3:
+            raise ValueError(f'The arena polygon needs at least 3 corners, '
+                             f'got: {len(polygon)}')
+        self.polygon = polygon
+        self._mask = None
+
+    def reset(self):
+        """
+        Forget the polygon derived from the corner markers and process the
+        whole frame until they are seen again
+        """
+        self.polygon = None
+        self._mask = None
+        self._corner_centers = None
+        self._missing_frames = 0
+
+    def update(self, corners, ids):
+        """
+        Derive the polygon from the corner markers of a frame. Frames
+        where any corner marker is not visible keep the current polygon
+        until lost_frames such frames in a row reset it.
+
+        Args:
+            corners, ids: Marker corners and ids from aruco.detectMarkers
+                in frame coordinates
+
+        Returns:
+            bool: True if the polygon was recomputed
+        """
+        if not self._corner_ids:
+            return False
+        centers = {} if ids is None else \
+            {int(marker_id): marker_corners.reshape(4, 2).mean(axis=0)
+             for marker_id, marker_corners in zip(ids.ravel(), corners)}
+        if any(marker_id not in centers for marker_id in self._corner_ids):
+            self._missing_frames += 1
+            if self.polygon is not None and \
+                    self._missing_frames >= self._lost_frames:
+                self.reset()
+            return False
+        self._missing_frames = 0
+        points = np.array([centers[marker_id]
+                           for marker_id in self._corner_ids])
+        if self._corner_centers is not None and np.max(np.linalg.norm(
+                points - self._corner_centers, axis=1)) <= \
+                self._drift_threshold:
+            return False
+        self._corner_centers = points
+
+        hull = cv2.convexHull(points.astype(np.float32)).reshape(-1, 2)
+        directions = hull - hull.mean(axis=0)
+        directions /= np.maximum(
+            np.linalg.norm(directions, axis=1, keepdims=True), 1e-9)
+        # Moving the corners of a rectangle diagonally by margin * sqrt(2)
+        # moves its edges out by the margin
+        self.set_polygon(hull + directions * self._margin * np.sqrt(2))
+        return True
+
+    def rect(self, frame_shape):
+        """
+        Returns:
+            (int, int, int, int): left, top, right and bottom of the
+                bounding rectangle of the polygon clipped to the frame
+        """
+        x, y, width, height = cv2.boundingRect(
+            np.round(self.polygon).astype(np.int32))
+        return (max(0, x), max(0, y),
+                min(frame_shape[1], x + width),
+                min(frame_shape[0], y + height))
+
+    def apply(self, frame, arena=None):
+        """
+        Crop a frame to the bounding rectangle of the polygon and black out
+        the pixels outside the polygon
+
+        Args:
+            frame (numpy array): BGR or gray image
+            arena (BufferArena, optional): Arena for the cropped image
+
+        Returns:
+            (numpy array, (int, int)): The cropped image and the x and y
+                offset of the crop in the frame. The frame itself and a
+                zero offset if the polygon is not known yet.
+        """
+        if self.polygon is None:
+            return frame, (0, 0)
+        if self._mask is None or self._mask_frame_shape != frame.shape:
+            self._make_mask(frame.shape)
+        left, top, right, bottom = self._rect
+        if right <= left or bottom <= top:
+            # The polygon is outside the frame
+            return frame, (0, 0)
+
+        crop = frame[top:bottom, left:right]
+        out = None if arena is None else arena.like('arena_region', crop)
+        return cv2.bitwise_and(crop, self._mask, dst=out), (left, top)
+
+    def _make_mask(self, frame_shape):
+        left, top, right, bottom = self.rect(frame_shape)
+        self._rect = (left, top, right, bottom)
+        self._mask_frame_shape = frame_shape
+        self._mask = np.zeros((max(0, bottom - top), max(0, right - left)) +
+                              tuple(frame_shape[2:]), dtype=np.uint8)
+        polygon = np.round(self.polygon - (left, top)).astype(np.int32)
+        cv2.fillPoly(self._mask, [polygon], (255, 255, 255))
+
+
+def offset_corners(corners, offset):
+    """
+    Translate marker corners from aruco.detectMarkers of a cropped image
+    back to frame coordinates
+
+    Args:
+        corners: Marker corners or rejected points
+        offset ((int, int)): Offset from ArenaRegion.apply
+    """
+    if not any(offset):
+        return corners
+    shift = np.array(offset, dtype=np.float32)
+    return tuple(marker_corners + shift for marker_corners in corners)
+
+
+def make_arena_region(setting, corner_ids=None):
+    """
+    Make the arena region of the ARENA_REGION setting of the scripts
+
+    Args:
+        setting: None for no region, 'markers' to derive the region from
+            the corner markers or a list of the [x, y] polygon corners
+        corner_ids ([int], optional): Aruco ids of the corner markers
+
+    Returns:
+        ArenaRegion or None
+    """
+    if setting is None:
+        return None
+    if isinstance(setting, str):
+        if setting != 'markers':
+            raise ValueError(f"Unknown arena region, got: {setting}, but "
+                             f"expected 'markers' or a polygon")
+        if not corner_ids:
+            raise ValueError('The arena region needs the corner marker ids '
+                             'to be derived from the markers')
+        return ArenaRegion(corner_ids=corner_ids)
+    return ArenaRegion(polygon=setting)
@@ -0,0 +1,199 @@
+import time
+import numpy as np
+from cv2 import aruco
+
+
+# Run a full frame detection at least every this many frames to find
+# markers that have come into the view
+FULL_SWEEP_INTERVAL = 10
+# Padding around the last known marker corners as a fraction of the
+# marker size and in pixels. The markers move only a few pixels between
+# frames so the padding mostly makes room for the marker's quiet zone.
+ROI_PADDING_RATE = 0.75
+ROI_PADDING_PIXELS = 16
+
+
+class TrackingArucoDetector():
+    """
+    Detects aruco markers only in regions around the last known marker
+    positions and falls back to a full frame detection every
+    full_sweep_interval frames or when a tracked marker is lost.
+    """
+    def __init__(self,
+                 dictionary,
+                 parameters,
+                 full_sweep_interval=FULL_SWEEP_INTERVAL,
+                 roi_padding_rate=ROI_PADDING_RATE,
+                 roi_padding_pixels=ROI_PADDING_PIXELS):
+        self._dictionary = dictionary
+        self._parameters = parameters
+        self._full_sweep_interval = full_sweep_interval
+        self._roi_padding_rate = roi_padding_rate
+        self._roi_padding_pixels = roi_padding_pixels
+
+        # Last known corners of the tracked markers, key is the marker id
+        self._tracked = {}
+        self._frames_since_sweep = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self._frames = 0
+        self._full_sweeps = 0
+        self._roi_frames = 0
+        self._roi_markers_searched = 0
+        self._roi_markers_found = 0
+        self._full_sweep_seconds = 0.0
+        self._roi_seconds = 0.0
+
+    def stats(self):
+        """
+        Get the detection statistics since the last reset_stats
+
+        Returns : dictionary
+            frames : Number of processed frames
+            full_sweeps : Number of full frame detections
+            roi_frames : Number of frames handled only with region
+                detections
+            roi_hit_rate : Fraction of tracked markers found again from
+                their regions
+            full_sweep_ms : Average time of a full frame detection
+            roi_ms : Average time of a region detection frame
+            frame_ms : Average time per frame
+        """
+        def average_ms(seconds, count):
+            return 1000 * seconds / count if count else 0.0
+
+        return {
+            'frames': self._frames,
+            'full_sweeps': self._full_sweeps,
+            'roi_frames': self._roi_frames,
+            'roi_hit_rate': (self._roi_markers_found /
+                             self._roi_markers_searched
+                             if self._roi_markers_searched else 0.0),
+            'full_sweep_ms': average_ms(self._full_sweep_seconds,
+                                        self._full_sweeps),
+            'roi_ms': average_ms(self._roi_seconds, self._roi_frames),
+            'frame_ms': average_ms(
+                self._full_sweep_seconds + self._roi_seconds, self._frames),
+        }
+
+    def detect(self, image):
+        """
+        Detect the aruco markers from the image
+
+        Args:
+            image (numpy array): Image to detect the markers from
+
+        Returns:
+            Same as aruco.detectMarkers: corners, ids and rejected image
+            points. Rejected points are reported only from full frame
+            detections.
+        """
+        self._frames += 1
+        self._frames_since_sweep += 1
+
+        if self._tracked and \
+                self._frames_since_sweep < self._full_sweep_interval:
+            start = time.perf_counter()
+            corners, ids = self._detect_in_regions(image)
+            if ids is not None:
+                self._roi_seconds += time.perf_counter() - start
+                self._roi_frames += 1
+                self._track(corners, ids)
+                return corners, ids, []
+            # A marker was lost so the time goes to the full sweep
+            self._full_sweep_seconds += time.perf_counter() - start
+
+        start = time.perf_counter()
+        corners, ids, rejected = aruco.detectMarkers(
+            image, self._dictionary, parameters=self._parameters)
+        self._full_sweep_seconds += time.perf_counter() - start
+        self._full_sweeps += 1
+        self._frames_since_sweep = 0
+        self._track(corners, ids)
+        return corners, ids, rejected
+
+    def _track(self, corners, ids):
+        self._tracked = {}
+        if ids is None:
+            return
+        for marker_id, marker_corners in zip(ids[:, 0], corners):
+            self._tracked[int(marker_id)] = marker_corners
+
+    def _detect_in_regions(self, image):
+        """
+        Detect the markers from the padded regions around the tracked
+        markers.
+
+        Returns:
+            corners and ids in full frame coordinates or None and None if
+            some of the tracked markers were not found
+        """
+        height, width = image.shape[:2]
+        found = {}
+        for left, top, right, bottom in self._regions(width, height):
+            region_corners, region_ids, _ = aruco.detectMarkers(
+                image[top:bottom, left:right],
+                self._dictionary,
+                parameters=self._parameters)
+            if region_ids is None:
+                continue
+            offset = np.array([left, top], dtype=np.float32)
+            for marker_id, marker_corners in zip(region_ids[:, 0],
+                                                 region_corners):
+                found.setdefault(int(marker_id), marker_corners + offset)
+
+        searched = len(self._tracked)
+        hits = sum(1 for marker_id in self._tracked if marker_id in found)
+        self._roi_markers_searched += searched
+        self._roi_markers_found += hits
+        if hits < searched:
+            return None, None
+
+        ids = np.array(list(found.keys()), dtype=np.int32).reshape(-1, 1)
+        return tuple(found.values()), ids
+
+    def _regions(self, width, height):
+        """
+        Get the padded bounding rectangles of the tracked markers with
+        overlapping rectangles merged.
+
+        Returns:
+            [(left, top, right, bottom)]
+        """
+        rects = []
+        for marker_corners in self._tracked.values():
+            points = marker_corners.reshape(-1, 2)
+            low = points.min(axis=0)
+            high = points.max(axis=0)
+            padding = self._roi_padding_rate * (high - low).max() + \
+                self._roi_padding_pixels
+            rects.append([
+                max(0, int(low[0] - padding)),
+                max(0, int(low[1] - padding)),
+                min(width, int(high[0] + padding) + 1),
+                min(height, int(high[1] + padding) + 1),
+            ])
+        return _merge_rects(rects)
+
+
+def _merge_rects(rects):
+    """
+    Merge overlapping rectangles until none of them overlap
+    """
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(rects)):
+            for j in range(i + 1, len(rects)):
+                a, b = rects[i], rects[j]
+                if a[0] < b[2] and b[0] < a[2] and \
+                        a[1] < b[3] and b[1] < a[3]:
+                    rects[i] = [min(a[0], b[0]), min(a[1], b[1]),
+                                max(a[2], b[2]), max(a[3], b[3])]
+                    del rects[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return rects
@@ -1,19 +1,112 @@
-import math
 import numpy as np
 import cv2
+from cv2 import aruco
+from utils.arena_region import offset_corners
+from utils.latency import stage
+
+
+# Structured array layout returned by aruco_poses_to_arrays
+MARKER_DTYPE = np.dtype([
+    ('id', np.int32),
+    ('position', np.float32, (2,)),
+    ('rotation', np.float32, (3,)),
+])
+
+
+def image_to_gray(image, arena=None):
+    """
+    Convert the image to grayscale for aruco.detectMarkers. Passing a gray
+    image to detectMarkers skips its own conversion, and with an arena the
+    gray image is written to a reused buffer.
+
+    Args:
+        image (numpy array): BGR image
+        arena (BufferArena, optional): Arena for the output buffer
+
+    Returns:
+        numpy array: Gray image
+    """
+    dst = None if arena is None else arena.get('gray', image.shape[:2])
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=dst)
+
+
+def detect_markers(image, dictionary, parameters, arena=None, timer=None,
+                   region=None):
+    """
+    Detect the aruco markers from a BGR image
+
+    Args:
+        image (numpy array): BGR image
+        dictionary: Aruco dictionary
+        parameters: aruco.DetectorParameters
+        arena (BufferArena, optional): Arena for the gray image
+        timer (LatencyStats, optional): Time the gray conversion and the
+            detection as stages
+        region (ArenaRegion, optional): Detect only inside the arena. The
+            corners are still in frame coordinates.
+
+    Returns:
+        The corners, ids and rejected points from aruco.detectMarkers
+    """
+    offset = (0, 0)
+    if region is not None:
+        with stage(timer, 'arena_region'):
+            image, offset = region.apply(image, arena)
+    with stage(timer, 'gray'):
+        gray = image_to_gray(image, arena)
+    with stage(timer, 'detect_markers'):
+        corners, ids, rejected = aruco.detectMarkers(gray, dictionary,
+                                                     parameters=parameters)
+    return (offset_corners(corners, offset), ids,
+            offset_corners(rejected, offset))
+
+
+def detector_parameters_to_dict(parameters):
+    """
+    Get the values of aruco detector parameters as a dictionary so that
+    they can be sent to other processes or saved to a file
+
+    Args:
+        parameters: aruco.DetectorParameters
+
+    Returns:
+        dictionary: Parameter name to value
+    """
+    values = {}
+    for name in dir(parameters):
+        if name.startswith('_'):
+            continue
+        value = getattr(parameters, name)
+        if isinstance(value, (bool, int, float)):
+            values[name] = value
+    return values
+
+
+def detector_parameters_from_dict(values):
+    """
+    Create aruco detector parameters from a dictionary made with
+    detector_parameters_to_dict. Missing values keep their defaults.
+    """
+    parameters = aruco.DetectorParameters_create()
+    for name, value in values.items():
+        setattr(parameters, name, value)
+    return parameters
 
 
 def aruco_poses_to_transforms(
         detected_ids,
         corners,
         rvecs,
-        only_z_rot=True):
+        only_z_rot=True,
+        timer=None):
     """
     Calculates rotation matrix to euler angles
     The result is the same as MATLAB except the order
     of the euler angles ( x and z are swapped ).
     https://www.learnopencv.com/rotation-matrix-to-euler-angles/
 
+    This is a thin adapter on top of aruco_poses_to_arrays.
+
     Args:
         detected_ids ([int]): Detected aruco marker ids
         corners (?): List of Detected aruco marker corner's
@@ -32,69 +125,117 @@ def aruco_poses_to_transforms(
     """
     robot_trans_dict = {}
 
-    if detected_ids is None or corners is None or rvecs is None:
-        return robot_trans_dict
-
-    for id, corner_list, rvec in zip(detected_ids, corners, rvecs):
-        robot_trans_dict[id.item()] = {}
-        center = np.mean(corner_list[0], axis=0, dtype=np.float32)
-        dst, jacobian = cv2.Rodrigues(rvec[0])
-        euler_angles = _rotation_matrix_to_euler_angles(dst)
-        robot_trans_dict[id.item()]['position'] = center
-        if only_z_rot:
-            robot_trans_dict[id.item()]['rotation'] = \
-                np.array([euler_angles[2]])
-        else:
-            robot_trans_dict[id.item()]['rotation'] = euler_angles
+    markers = aruco_poses_to_arrays(detected_ids, corners, rvecs, timer)
+    for marker in markers:
+        rotation = marker['rotation']
+        robot_trans_dict[marker['id'].item()] = {
+            'position': marker['position'],
+            'rotation': rotation[2:] if only_z_rot else rotation,
+        }
 
     return robot_trans_dict
 
-def _is_rotation_matrix(matrix):
+
+def aruco_poses_to_arrays(detected_ids, corners, rvecs, timer=None):
     """
-    Checks if a matrix is a valid rotation matrix.
-    https://www.learnopencv.com/rotation-matrix-to-euler-angles/
+    Calculates the centers and euler angles of all the detected markers
+    at once with vectorized NumPy.
 
     Args:
-        matrix (?): OpenCV matrix
+        detected_ids (numpy array (N, 1)): Detected aruco marker ids
+        corners ([numpy array (1, 4, 2)]): Detected aruco marker corners
+                    from aruco.detectMarkers
+        rvecs (numpy array (N, 1, 3)): Rotation vectors from
+                    aruco.estimatePoseSingleMarkers
+        timer (LatencyStats, optional): Time the conversion as a stage
 
     Returns:
-        boolean: Is the input matrix rotation matrix
+        numpy structured array (N,) of MARKER_DTYPE with fields
+            id : int
+            position : [x, y] in pixel coordinates
+            rotation : [rot_x, rot_y, rot_z] from -180 to 180 degrees
     """
-    r_t = np.transpose(matrix)
-    should_be_identity = np.dot(r_t, matrix)
-    identity = np.identity(3, dtype=matrix.dtype)
-    n = np.linalg.norm(identity - should_be_identity)
-    return n < 1e-6
+    if detected_ids is None or corners is None or rvecs is None or \
+            len(detected_ids) == 0:
+        return np.empty(0, dtype=MARKER_DTYPE)
 
-def _rotation_matrix_to_euler_angles(rotation_matrix):
+    with stage(timer, 'poses'):
+        markers = np.empty(len(detected_ids), dtype=MARKER_DTYPE)
+        markers['id'] = np.reshape(detected_ids, -1)
+        markers['position'] = corners_to_centers(corners)
+        markers['rotation'] = _rotation_matrices_to_euler_angles(
+            _rvecs_to_rotation_matrices(rvecs))
+    return markers
+
+
+def corners_to_centers(corners):
     """
-    Calculates rotation matrix to euler angles
+    Calculates the center points of the markers
+
+    Args:
+        corners ([numpy array (1, 4, 2)]): Aruco marker corners
+                    from aruco.detectMarkers
+
+    Returns:
+        numpy array (N, 2) float32: x and y of the marker centers
+    """
+    corner_array = np.reshape(np.asarray(corners, dtype=np.float32),
+                              (-1, 4, 2))
+    return np.mean(corner_array, axis=1, dtype=np.float32)
+
+
+def _rvecs_to_rotation_matrices(rvecs):
+    """
+    Converts rotation vectors to rotation matrices with the Rodrigues
+    formula. Same result as calling cv2.Rodrigues for each vector.
+
+    Args:
+        rvecs (numpy array (N, 1, 3)): Rotation vectors
+
+    Returns:
+        numpy array (N, 3, 3) float64: Rotation matrices
+    """
+    rvecs = np.reshape(np.asarray(rvecs, dtype=np.float64), (-1, 3))
+    theta = np.linalg.norm(rvecs, axis=1)
+    # Axis is irrelevant for zero rotation so avoid dividing by zero
+    axis = rvecs / np.where(theta < 1e-12, 1.0, theta)[:, np.newaxis]
+
+    cos = np.cos(theta)[:, np.newaxis, np.newaxis]
+    sin = np.sin(theta)[:, np.newaxis, np.newaxis]
+
+    x, y, z = axis[:, 0], axis[:, 1], axis[:, 2]
+    zeros = np.zeros_like(x)
+    cross = np.stack([
+        np.stack([zeros, -z, y], axis=1),
+        np.stack([z, zeros, -x], axis=1),
+        np.stack([-y, x, zeros], axis=1),
+    ], axis=1)
+    outer = axis[:, :, np.newaxis] * axis[:, np.newaxis, :]
+
+    return cos * np.identity(3) + (1 - cos) * outer + sin * cross
+
+
+def _rotation_matrices_to_euler_angles(rotation_matrices):
+    """
+    Calculates rotation matrices to euler angles
     The result is the same as MATLAB except the order
     of the euler angles ( x and z are swapped ).
     https://www.learnopencv.com/rotation-matrix-to-euler-angles/
 
     Args:
-        rotation_matrix (int): Rotation matrix to transform
+        rotation_matrices (numpy array (N, 3, 3)): Rotation matrices
 
     Returns:
-        numpy array [3]: x, y and z euler rotations
+        numpy array (N, 3) float32: x, y and z euler rotations in degrees
     """
-    assert _is_rotation_matrix(rotation_matrix)
-    sy = math.sqrt(
-        rotation_matrix[0, 0] * rotation_matrix[0, 0] +
-        rotation_matrix[1, 0] * rotation_matrix[1, 0])
+    r = rotation_matrices
+    sy = np.hypot(r[:, 0, 0], r[:, 1, 0])
     singular = sy < 1e-6
-    if not singular:
-        x = math.atan2(rotation_matrix[2, 1], rotation_matrix[2, 2])
-        y = math.atan2(-rotation_matrix[2, 0], sy)
-        z = math.atan2(rotation_matrix[1, 0], rotation_matrix[0, 0])
-    else:
-        x = math.atan2(-rotation_matrix[1, 2], rotation_matrix[1, 1])
-        y = math.atan2(-rotation_matrix[2, 0], sy)
-        z = 0
-
-    return np.array([
-            math.degrees(x),
-            math.degrees(y),
-            math.degrees(z)],
-        dtype=np.float32)
+
+    x = np.where(singular,
+                 np.arctan2(-r[:, 1, 2], r[:, 1, 1]),
+                 np.arctan2(r[:, 2, 1], r[:, 2, 2]))
+    y = np.arctan2(-r[:, 2, 0], sy)
+    z = np.where(singular, 0.0, np.arctan2(r[:, 1, 0], r[:, 0, 0]))
+
+    return np.degrees(np.stack([x, y, z], axis=1)).astype(np.float32)
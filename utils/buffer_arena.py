@@ -0,0 +1,43 @@
+import numpy as np
+
+
+class BufferArena():
+    """
+    Preallocated output buffers for the per-frame image pipeline.
+
+    The pipeline functions take an optional arena and pass its buffers to
+    the OpenCV functions as dst-arguments, so after the first frame the
+    pipeline makes no new large allocations. Each pipeline (and thread)
+    needs its own arena since the buffers are reused on every frame.
+    """
+    def __init__(self):
+        self._buffers = {}
+        # Number of buffers allocated. Stays constant in steady state.
+        self.allocations = 0
+
+    def get(self, name, shape, dtype=np.uint8):
+        """
+        Get the buffer of the given name. A new buffer is allocated only
+        if there is none yet or its shape or type has changed.
+
+        Args:
+            name (str): Name of the buffer, unique within the pipeline
+            shape (tuple): Shape of the buffer
+            dtype: numpy data type of the buffer
+
+        Returns:
+            numpy array: Buffer with undefined content
+        """
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != tuple(shape) or \
+                buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            self._buffers[name] = buffer
+            self.allocations += 1
+        return buffer
+
+    def like(self, name, image):
+        return self.get(name, image.shape, image.dtype)
+
+    def nbytes(self):
+        return sum(buffer.nbytes for buffer in self._buffers.values())
@@ -0,0 +1,239 @@
+import json
+import os
+import numpy as np
+import cv2
+
+
+DEFAULT_CALIBRATION_FILE = 'rpi-camera-calib-params.json'
+# Derived data is cached next to the calibration file with this suffix
+SIDECAR_SUFFIX = '.cache.npz'
+# Bump when the contents of the sidecar file change
+SIDECAR_VERSION = 1
+
+# Calibrations already loaded in this process by absolute file path
+_CALIBRATIONS = {}
+
+
+def load_calibration(path=DEFAULT_CALIBRATION_FILE):
+    """
+    Load the camera calibration once per process. Later calls with the same
+    file return the same CameraCalibration object unless the file has
+    changed.
+
+    Args:
+        path (str): Calibration json file with 'mtx' and 'dist'
+
+    Returns:
+        CameraCalibration
+    """
+    path = os.path.abspath(path)
+    mtime = os.path.getmtime(path)
+    calibration = _CALIBRATIONS.get(path)
+    if calibration is None or calibration.mtime != mtime:
+        calibration = CameraCalibration.from_file(path)
+        _CALIBRATIONS[path] = calibration
+    return calibration
+
+
+class CameraCalibration():
+    """
+    Camera matrix and distortion coefficients with the data derived from
+    them. The derived data is computed once and cached in a binary sidecar
+    file next to the calibration file so it is not recomputed on startup.
+
+    The detectors undistort only the points they find instead of remapping
+    whole frames. undistort_points maps distorted pixel coordinates to the
+    pixel coordinates of an ideal pinhole camera with the same camera
+    matrix.
+    """
+    def __init__(self, mtx, dist, path=None, mtime=None):
+        self.mtx = np.asarray(mtx, dtype=np.float64).reshape(3, 3)
+        self.dist = np.asarray(dist, dtype=np.float64).ravel()
+        # Distortion coefficients for points that are already undistorted
+        self.zero_dist = np.zeros_like(self.dist)
+        self.path = path
+        self.mtime = mtime
+        self._derived = None
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as json_file:
+            calib_params = json.load(json_file)
+        return cls(calib_params['mtx'], calib_params['dist'],
+                   path=path, mtime=os.path.getmtime(path))
+
+    @property
+    def sidecar_path(self):
+        if self.path is None:
+            return None
+        return self.path + SIDECAR_SUFFIX
+
+    @property
+    def inverse_mtx(self):
+        return self._get_derived()['inverse_mtx']
+
+    def undistort_maps(self, image_size):
+        """
+        Get the maps for cv2.remap to undistort whole frames, e.g. for
+        showing them. The detectors do not need these.
+
+        Args:
+            image_size ((int, int)): Width and height of the frames
+
+        Returns:
+            (numpy array, numpy array): map1 and map2 for cv2.remap
+        """
+        width, height = image_size
+        derived = self._get_derived()
+        key = f'map_{width}x{height}'
+        if key + '_1' not in derived:
+            map1, map2 = cv2.initUndistortRectifyMap(
+                self.mtx, self.dist, None, self.mtx, (width, height),
+                cv2.CV_16SC2)
+            derived[key + '_1'] = map1
+            derived[key + '_2'] = map2
+            self._save_sidecar(derived)
+        return derived[key + '_1'], derived[key + '_2']
+
+    def undistort_points(self, points):
+        """
+        Undistort pixel coordinates with one cv2.undistortPoints call
+
+        Args:
+            points (numpy array (..., 2)): Distorted pixel coordinates
+
+        Returns:
+            numpy array (..., 2): Undistorted pixel coordinates of the same
+                shape. float32 like the detector outputs.
+        """
+        points = np.asarray(points, dtype=np.float32)
+        if not points.size:
+            return points.reshape(points.shape)
+        undistorted = cv2.undistortPoints(
+            points.reshape(-1, 1, 2), self.mtx, self.dist, P=self.mtx)
+        return undistorted.reshape(points.shape)
+
+    def normalize_points(self, points):
+        """
+        Map undistorted pixel coordinates to normalized image coordinates
+        with the inverse camera matrix
+
+        Args:
+            points (numpy array (..., 2)): Undistorted pixel coordinates
+
+        Returns:
+            numpy array (..., 2): Normalized image coordinates x/z, y/z
+        """
+        points = np.asarray(points, dtype=np.float64)
+        inverse_mtx = self.inverse_mtx
+        return points @ inverse_mtx[:2, :2].T + inverse_mtx[:2, 2]
+
+    def undistort_corners(self, corners):
+        """
+        Undistort the marker corners from aruco.detectMarkers with one
+        call for all the markers
+
+        Args:
+            corners ([numpy array (1, 4, 2)]): Marker corners
+
+        Returns:
+            [numpy array (1, 4, 2)]: Undistorted marker corners
+        """
+        if not len(corners):
+            return corners
+        undistorted = self.undistort_points(np.concatenate(corners))
+        return list(undistorted[:, np.newaxis])
+
+    def undistort_center_points(self, center_points):
+        """
+        Undistort the energy core centers of all the color classes with
+        one call
+
+        Args:
+            center_points (dictionary): Output of
+                image_to_center_points_multi, center point lists or blob
+                arrays by color class
+
+        Returns:
+            dictionary: The same keys with numpy arrays (N, 2) of
+                undistorted centers, or for blob arrays copies with the
+                BLOB_X and BLOB_Y columns undistorted
+        """
+        arrays = {}
+        for name, points in center_points.items():
+            points = np.asarray(points, dtype=np.float32)
+            # An empty list of center points, empty blob arrays keep their
+            # columns
+            arrays[name] = points if points.ndim == 2 \
+                else points.reshape(0, 2)
+        if not arrays:
+            return arrays
+        undistorted = self.undistort_points(np.concatenate(
+            [points[:, :2] for points in arrays.values()]))
+
+        start = 0
+        for name, points in arrays.items():
+            points = points.copy()
+            points[:, :2] = undistorted[start:start + len(points)]
+            start += len(points)
+            arrays[name] = points
+        return arrays
+
+    def estimate_poses(self, corners, marker_size):
+        """
+        Undistort the marker corners and estimate the marker poses from
+        them. The pose estimation then runs without the distortion model,
+        which is faster with the 14 coefficient model.
+
+        Args:
+            corners ([numpy array (1, 4, 2)]): Distorted marker corners
+            marker_size (float): Size of the markers
+
+        Returns:
+            (corners, rvecs, tvecs): The undistorted corners and the output
+                of aruco.estimatePoseSingleMarkers
+        """
+        corners = self.undistort_corners(corners)
+        rvecs, tvecs, _ = cv2.aruco.estimatePoseSingleMarkers(
+            corners, marker_size, self.mtx, self.zero_dist)
+        return corners, rvecs, tvecs
+
+    def _get_derived(self):
+        if self._derived is None:
+            self._derived = self._load_sidecar()
+        if self._derived is None:
+            self._derived = {
+                'inverse_mtx': np.linalg.inv(self.mtx),
+            }
+            self._save_sidecar(self._derived)
+        return self._derived
+
+    def _load_sidecar(self):
+        sidecar_path = self.sidecar_path
+        if sidecar_path is None or not os.path.exists(sidecar_path):
+            return None
+        try:
+            with np.load(sidecar_path) as sidecar:
+                derived = dict(sidecar)
+        except (OSError, ValueError):
+            return None
+        # The sidecar is stale if the calibration has changed since
+        if (derived.pop('version', None) != SIDECAR_VERSION or
+                not np.array_equal(derived.pop('mtx', None), self.mtx) or
+                not np.array_equal(derived.pop('dist', None), self.dist)):
+            return None
+        return derived
+
+    def _save_sidecar(self, derived):
+        sidecar_path = self.sidecar_path
+        if sidecar_path is None:
+            return
+        temp_path = sidecar_path + '.tmp'
+        try:
+            with open(temp_path, 'wb') as sidecar:
+                np.savez(sidecar, version=SIDECAR_VERSION, mtx=self.mtx,
+                         dist=self.dist, **derived)
+            os.replace(temp_path, sidecar_path)
+        except OSError as error:
+            # The cache is only an optimization
+            print(f'Could not write the calibration cache: {error}')
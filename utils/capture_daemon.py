@@ -0,0 +1,226 @@
+import fcntl
+import os
+import tempfile
+import time
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+import cv2
+from utils.ffmpeg_video_source import URL
+from utils.frame_info import FrameInfo
+from utils.shared_frame_ring import SharedFrameRing
+
+
+# Name of the shared memory ring the daemon writes and the consumers read
+RING_NAME = 'ai-simple-frames'
+RING_SLOTS = 8
+MAX_CONSUMERS = 16
+# Seconds between the checks for consumers that have exited
+CONSUMER_CHECK_INTERVAL = 1.0
+
+CONSUMER_DTYPE = np.dtype([
+    # Process id of the consumer, 0 for a free entry
+    ('pid', '<i8'),
+    # Sequence number of the frame the consumer read last
+    ('sequence', '<i8'),
+    # Frames the consumer held that the daemon has overwritten
+    ('overruns', '<i8'),
+])
+
+
+def consumers_name(ring_name):
+    return f'{ring_name}-consumers'
+
+
+class ConsumerTable():
+    """
+    Table of the consumers of a ring in shared memory. Each consumer owns
+    one entry and writes the sequence number of the frame it reads to it,
+    so the daemon can see how far behind each consumer is without the
+    consumers ever talking to it.
+    """
+    def __init__(self, shm, owner):
+        self._shm = shm
+        self._owner = owner
+        self.entries = np.ndarray(MAX_CONSUMERS, dtype=CONSUMER_DTYPE,
+                                  buffer=shm.buf)
+        self._lock_path = os.path.join(tempfile.gettempdir(),
+                                       f'{shm.name.lstrip("/")}.lock')
+
+    @classmethod
+    def create(cls, ring_name):
+        shm = shared_memory.SharedMemory(
+            name=consumers_name(ring_name), create=True,
+            size=MAX_CONSUMERS * CONSUMER_DTYPE.itemsize)
+        table = cls(shm, owner=True)
+        table.entries[:] = 0
+        return table
+
+    @classmethod
+    def attach(cls, ring_name):
+        shm = shared_memory.SharedMemory(name=consumers_name(ring_name))
+        # Only the daemon may remove the shared memory, see
+        # SharedFrameRing.attach
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, owner=False)
+
+    def register(self):
+        """
+        Claim a free entry for this process
+
+        Returns:
+            int: Index of the entry
+        """
+        # Consumers may start at the same time so claiming is serialized
+        # with a file lock. The daemon never takes it.
+        with open(self._lock_path, 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            free = np.flatnonzero(self.entries['pid'] == 0)
+            if not len(free):
+                raise RuntimeError(f'All {MAX_CONSUMERS} consumer entries '
+                                   f'are in use')
+            index = int(free[0])
+            self.entries[index] = (os.getpid(), 0, 0)
+        return index
+
+    def unregister(self, index):
+        self.entries[index]['pid'] = 0
+
+    def close(self):
+        self.entries = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+class CaptureDaemon():
+    """
+    Decodes a stream once into a shared memory ring so that several local
+    processes, e.g. the aruco and the energy core detection, can read the
+    same frames. The frames are decoded straight into the ring slots and
+    the consumers read them in place with SharedRingVideoSource.
+
+    The daemon never waits for the consumers. A consumer that is more
+    than slots - 1 frames behind has the frame it holds overwritten; the
+    daemon counts these overruns per consumer and reports when a consumer
+    starts lagging.
+    """
+    def __init__(self, url=URL, ring_name=RING_NAME, slots=RING_SLOTS,
+                 max_fps=None):
+        """
+        Args:
+            url (str): Stream, video file or camera for cv2.VideoCapture
+            ring_name (str): Name of the shared memory ring
+            slots (int): Frames in the ring
+            max_fps (float, optional): Limit the frame rate, e.g. to play
+                a video file at its recorded pace
+        """
+        self._url = url
+        self._frame_interval = 1 / max_fps if max_fps else 0
+        self._ring_name = ring_name
+        self._slots = slots
+        self._ring = None
+        self._consumers = None
+        self._running = False
+        # Per consumer entry the held sequence already counted as overrun
+        self._overrun_sequences = np.zeros(MAX_CONSUMERS, dtype=np.int64)
+
+    def run(self):
+        cap = cv2.VideoCapture(self._url)
+        ret, frame = cap.read()
+        if not ret:
+            raise RuntimeError(f'Could not read a frame from {self._url}')
+
+        self._ring = SharedFrameRing.create(frame.shape, self._slots,
+                                            name=self._ring_name)
+        self._consumers = ConsumerTable.create(self._ring_name)
+        print(f'Serving {frame.shape[1]}x{frame.shape[0]} frames from '
+              f'{self._url} in ring "{self._ring_name}" with '
+              f'{self._slots} slots')
+
+        sequence = 1
+        np.copyto(self._ring.frame_buffer(sequence), frame)
+        published = time.monotonic()
+        self._ring.publish(FrameInfo(sequence, published, published))
+        last_consumer_check = time.monotonic()
+
+        self._running = True
+        try:
+            while self._running:
+                self._check_lag(sequence)
+                if self._frame_interval:
+                    time.sleep(max(0.0, published + self._frame_interval -
+                                   time.monotonic()))
+                sequence += 1
+                image = self._ring.frame_buffer(sequence)
+                if not cap.grab():
+                    break
+                timestamp = time.monotonic()
+                ret, frame = cap.retrieve(image)
+                if not ret:
+                    break
+                if frame is not image:
+                    # The capture allocated a new array instead of
+                    # decoding straight into the slot
+                    np.copyto(image, frame)
+                published = time.monotonic()
+                self._ring.publish(FrameInfo(sequence, timestamp, published))
+
+                if time.monotonic() - last_consumer_check > \
+                        CONSUMER_CHECK_INTERVAL:
+                    self._remove_exited_consumers()
+                    last_consumer_check = time.monotonic()
+        finally:
+            cap.release()
+            self.close()
+
+    def stop(self):
+        self._running = False
+
+    def consumer_stats(self):
+        """
+        Returns : dictionary
+            key : pid of the consumer
+            value : dictionary with lag in frames and overruns
+        """
+        latest = self._ring.latest_sequence
+        return {int(entry['pid']): {
+                    'lag': latest - int(entry['sequence']),
+                    'overruns': int(entry['overruns'])}
+                for entry in self._consumers.entries if entry['pid']}
+
+    def close(self):
+        if self._consumers is not None:
+            self._consumers.close()
+            self._consumers = None
+        if self._ring is not None:
+            self._ring.close()
+            self._ring = None
+
+    def _check_lag(self, latest):
+        """
+        Count an overrun for each consumer whose frame the next write
+        overwrites
+        """
+        entries = self._consumers.entries
+        held = entries['sequence']
+        overwritten = (entries['pid'] != 0) & (held > 0) & \
+            (latest - held >= self._slots - 1) & \
+            (held != self._overrun_sequences)
+        if not overwritten.any():
+            return
+        for index in np.flatnonzero(overwritten):
+            if not entries[index]['overruns']:
+                print(f'Consumer {entries[index]["pid"]} is lagging '
+                      f'{latest - held[index]} frames behind')
+        entries['overruns'][overwritten] += 1
+        self._overrun_sequences[overwritten] = held[overwritten]
+
+    def _remove_exited_consumers(self):
+        entries = self._consumers.entries
+        for index in np.flatnonzero(entries['pid']):
+            try:
+                os.kill(int(entries[index]['pid']), 0)
+            except ProcessLookupError:
+                print(f'Consumer {entries[index]["pid"]} has exited')
+                entries[index] = 0
+                self._overrun_sequences[index] = 0
@@ -1,15 +1,41 @@
 import numpy as np
 import cv2
 import imutils
+from utils.latency import stage
 
 
 ITERATIONS = 2
 MIN_AREA_TO_DETECT = 1000
+# One bit per color class in the label image, so a uint8 label image
+# can hold at most eight classes.
+MAX_COLOR_CLASSES = 8
 
+# Column indexes of the blob arrays returned by find_blobs
+BLOB_X = 0
+BLOB_Y = 1
+BLOB_AREA = 2
+BLOB_LEFT = 3
+BLOB_TOP = 4
+BLOB_WIDTH = 5
+BLOB_HEIGHT = 6
+BLOB_COLUMNS = 7
 
-def blur_and_hsv(image):
-    blurred_frame = cv2.GaussianBlur(image, (5, 5), 0)
-    hsv_image = cv2.cvtColor(blurred_frame, cv2.COLOR_BGR2HSV)
+
+def _buffer(arena, name, shape, dtype=np.uint8):
+    """
+    Get an output buffer from the arena or None to let OpenCV allocate
+    """
+    if arena is None:
+        return None
+    return arena.get(name, shape, dtype)
+
+
+def blur_and_hsv(image, arena=None):
+    blurred_frame = cv2.GaussianBlur(
+        image, (5, 5), 0, dst=_buffer(arena, 'blurred', image.shape))
+    hsv_image = cv2.cvtColor(
+        blurred_frame, cv2.COLOR_BGR2HSV,
+        dst=_buffer(arena, 'hsv', image.shape))
     return hsv_image
 
 
@@ -17,36 +43,245 @@ def image_to_center_points(
         orig_image,
         low_color,
         high_color,
-        debug_name=False):
-    hsv_image = blur_and_hsv(orig_image)
-    ecore_image, ecore_mask = find_ecores_by_color(
-        hsv_image, orig_image, low_color, high_color)
-    ecore_coordinates = find_center_points(
-        ecore_mask, MIN_AREA_TO_DETECT)
-
-    # Show ball mask to see in detail the ball detection
+        debug_name=False,
+        arena=None,
+        timer=None,
+        min_area=MIN_AREA_TO_DETECT,
+        iterations=ITERATIONS,
+        region=None):
+    offset = (0, 0)
+    if region is not None:
+        with stage(timer, 'arena_region'):
+            orig_image, offset = region.apply(orig_image, arena)
+    with stage(timer, 'blur_hsv'):
+        hsv_image = blur_and_hsv(orig_image, arena)
+    with stage(timer, 'mask'):
+        ecore_mask = find_ecore_mask(hsv_image, low_color, high_color, arena,
+                                     iterations)
+    with stage(timer, 'center_points'):
+        ecore_coordinates = find_center_points(ecore_mask, min_area)
+
+    # Show ball mask to see in detail the ball detection. The masked
+    # image is only needed for this so it is not made otherwise.
     if debug_name:
+        ecore_image = cv2.bitwise_and(orig_image, orig_image,
+                                      mask=ecore_mask)
         cv2.imshow(f'{debug_name}_mask', ecore_mask)
         cv2.imshow(f'{debug_name}_image', ecore_image)
         cv2.waitKey(1)
 
-    return ecore_coordinates
+    return _offset_points(ecore_coordinates, offset)
+
+
+def image_to_center_points_multi(
+        orig_image,
+        color_ranges,
+        debug=False,
+        as_blobs=False,
+        arena=None,
+        timer=None,
+        min_area=MIN_AREA_TO_DETECT,
+        iterations=ITERATIONS,
+        region=None):
+    """
+    Find the center points of objects of several color classes with one
+    blur and one HSV conversion per frame.
+
+    All classes are labeled in a single pass with a per-channel lookup
+    table (see build_color_lut) so the cost of the labeling stays flat
+    when more color classes are added.
+
+    Args:
+        orig_image (numpy array): BGR image
+        color_ranges ([(str, low_color, high_color)]): Name and low and
+            high HSV values for each color class
+        debug (bool): Show the mask of each color class
+        as_blobs (bool): Return the blob arrays from find_blobs instead
+            of lists of center points
+        arena (BufferArena, optional): Reuse the output buffers of the
+            arena instead of allocating new images
+        timer (LatencyStats, optional): Time the stages of the pipeline
+        min_area (int): Smallest object area in pixels
+        iterations (int): Erode and dilate iterations that clean up the
+            masks
+        region (ArenaRegion, optional): Process only the arena. The
+            center points are still in frame coordinates.
+
+    Returns : dictionary
+        key : name of the color class : str
+        value : [[x, y]] center points of the found objects or
+                numpy array (N, BLOB_COLUMNS) if as_blobs is set
+    """
+    lut = build_color_lut(color_ranges)
+    offset = (0, 0)
+    if region is not None:
+        with stage(timer, 'arena_region'):
+            orig_image, offset = region.apply(orig_image, arena)
+    with stage(timer, 'blur_hsv'):
+        hsv_image = blur_and_hsv(orig_image, arena)
+    with stage(timer, 'label_colors'):
+        label_image = label_colors(hsv_image, lut, arena)
+
+    ecore_coordinates = {}
+    for bit, (name, _, _) in enumerate(color_ranges):
+        with stage(timer, 'mask'):
+            ecore_mask = label_to_mask(label_image, bit, arena, iterations)
+        with stage(timer, 'center_points'):
+            if as_blobs:
+                ecore_coordinates[name] = find_blobs(ecore_mask, min_area,
+                                                     arena)
+            else:
+                ecore_coordinates[name] = find_center_points(ecore_mask,
+                                                             min_area)
+        if debug:
+            cv2.imshow(f'{name}_mask', ecore_mask)
+
+    if debug:
+        cv2.waitKey(1)
+
+    return offset_center_points(ecore_coordinates, offset)
+
+
+def offset_center_points(ecore_coordinates, offset):
+    """
+    Translate the center points or blobs of each color class found from a
+    cropped image back to frame coordinates
+
+    Args:
+        ecore_coordinates (dictionary): From image_to_center_points_multi
+        offset ((int, int)): Offset from ArenaRegion.apply
+    """
+    if not any(offset):
+        return ecore_coordinates
+    return {name: _offset_points(points, offset)
+            for name, points in ecore_coordinates.items()}
+
+
+def _offset_points(points, offset):
+    if not any(offset):
+        return points
+    if isinstance(points, np.ndarray):
+        blobs = points.copy()
+        blobs[:, [BLOB_X, BLOB_LEFT]] += offset[0]
+        blobs[:, [BLOB_Y, BLOB_TOP]] += offset[1]
+        return blobs
+    return [[x + offset[0], y + offset[1]] for x, y in points]
+
+
+_LUT_CACHE = {}
+
+
+def build_color_lut(color_ranges):
+    """
+    Build a lookup table that maps each H, S and V channel value to
+    a bit mask of the color classes whose range contains that value.
+
+    Since the color ranges are boxes in the HSV-colorspace a pixel belongs
+    to a class when the bit of the class is set in all three channels.
+    The tables are cached by the color ranges so they are built only once.
+
+    Args:
+        color_ranges ([(str, low_color, high_color)]): Name and low and
+            high HSV values for each color class
+
+    Returns:
+        numpy array (256, 1, 3) uint8: Lookup table for cv2.LUT
+    """
+    if len(color_ranges) > MAX_COLOR_CLASSES:
+        raise ValueError(f'At most {MAX_COLOR_CLASSES} color classes are '
+                         f'supported, got: {len(color_ranges)}')
+
+    key = tuple((name, tuple(np.ravel(low)), tuple(np.ravel(high)))
+                for name, low, high in color_ranges)
+    lut = _LUT_CACHE.get(key)
+    if lut is not None:
+        return lut
+
+    values = np.arange(256, dtype=np.float32)
+    lut = np.zeros((256, 1, 3), dtype=np.uint8)
+    for bit, (_, low_color, high_color) in enumerate(color_ranges):
+        for channel in range(3):
+            # Same inclusive bounds as cv2.inRange
+            in_range = (values >= low_color[channel]) & \
+                (values <= high_color[channel])
+            lut[in_range, 0, channel] |= np.uint8(1 << bit)
+
+    _LUT_CACHE[key] = lut
+    return lut
+
+
+def label_colors(hsv_image, lut, arena=None):
+    """
+    Label every pixel of an HSV image with a bit mask of the color
+    classes it belongs to.
+
+    Args:
+        hsv_image (numpy array): HSV image
+        lut (numpy array): Lookup table from build_color_lut
+        arena (BufferArena, optional): Arena for the output buffers
+
+    Returns:
+        numpy array uint8: Label image with one bit per color class
+    """
+    channel_bits = cv2.LUT(hsv_image, lut,
+                           dst=_buffer(arena, 'channel_bits',
+                                       hsv_image.shape))
+    label_image = _buffer(arena, 'labels', hsv_image.shape[:2])
+    # NumPy can AND the interleaved channels without splitting them
+    label_image = np.bitwise_and(channel_bits[:, :, 0],
+                                 channel_bits[:, :, 1],
+                                 out=label_image)
+    return np.bitwise_and(label_image, channel_bits[:, :, 2],
+                          out=label_image)
+
+
+def label_to_mask(label_image, bit, arena=None, iterations=ITERATIONS):
+    """
+    Get the cleaned up mask of one color class from a label image.
+    """
+    class_bits = cv2.bitwise_and(
+        label_image, 1 << bit,
+        dst=_buffer(arena, 'class_bits', label_image.shape))
+    color_mask = cv2.compare(class_bits, 0, cv2.CMP_GT,
+                             dst=_buffer(arena, 'mask', label_image.shape))
+    return _erode_and_dilate(color_mask, arena, iterations)
 
 
 def find_ecores_by_color(
         hsv_image,
         orig_image,
         low_color,
-        high_color):
+        high_color,
+        arena=None):
     """
     """
-    color_mask = cv2.inRange(hsv_image, low_color, high_color)
-    color_mask = cv2.erode(color_mask, None, iterations=ITERATIONS)
-    color_mask = cv2.dilate(color_mask, None, iterations=ITERATIONS)
-    color_image = cv2.bitwise_and(orig_image, orig_image, mask=color_mask)
+    color_mask = find_ecore_mask(hsv_image, low_color, high_color, arena)
+    color_image = cv2.bitwise_and(
+        orig_image, orig_image, mask=color_mask,
+        dst=_buffer(arena, 'color_image', orig_image.shape))
     return color_image, color_mask
 
 
+def find_ecore_mask(hsv_image, low_color, high_color, arena=None,
+                    iterations=ITERATIONS):
+    """
+    Get the cleaned up mask of the pixels within the color range
+    """
+    color_mask = cv2.inRange(hsv_image, low_color, high_color,
+                             dst=_buffer(arena, 'mask', hsv_image.shape[:2]))
+    return _erode_and_dilate(color_mask, arena, iterations)
+
+
+def _erode_and_dilate(color_mask, arena=None, iterations=ITERATIONS):
+    eroded = cv2.erode(color_mask, None,
+                       dst=_buffer(arena, 'eroded', color_mask.shape),
+                       iterations=iterations)
+    # The mask buffer is free again so the result goes back to it
+    return cv2.dilate(eroded, None,
+                      dst=None if arena is None else color_mask,
+                      iterations=iterations)
+
+
 def find_center_points(color_mask, min_ball_area_to_detect):
     """
     """
@@ -70,3 +305,45 @@ def find_center_points(color_mask, min_ball_area_to_detect):
         center_points.append([center_x, center_y])
 
     return center_points
+
+
+def find_blobs(color_mask, min_ball_area_to_detect, arena=None):
+    """
+    Find the blobs of a mask with connected components instead of
+    contours. The area filtering and centroids are computed with NumPy
+    for all the blobs at once.
+
+    Note that the area is the pixel count of the blob, so it is a bit
+    smaller than the contour area used by find_center_points when the
+    blob has holes in it.
+
+    Args:
+        color_mask (numpy array): Binary mask of one color class
+        min_ball_area_to_detect (int): Smallest blob area in pixels
+        arena (BufferArena, optional): Arena for the label image
+
+    Returns:
+        numpy array (N, BLOB_COLUMNS) float32: One row per blob with the
+            columns BLOB_X, BLOB_Y, BLOB_AREA, BLOB_LEFT, BLOB_TOP,
+            BLOB_WIDTH and BLOB_HEIGHT
+    """
+    _, _, stats, centroids = cv2.connectedComponentsWithStats(
+        color_mask,
+        labels=_buffer(arena, 'components', color_mask.shape, np.int32),
+        connectivity=8,
+        ltype=cv2.CV_32S)
+
+    # Label 0 is the background
+    stats = stats[1:]
+    centroids = centroids[1:]
+    keep = stats[:, cv2.CC_STAT_AREA] >= min_ball_area_to_detect
+
+    blobs = np.empty((np.count_nonzero(keep), BLOB_COLUMNS),
+                     dtype=np.float32)
+    blobs[:, BLOB_X:BLOB_Y + 1] = centroids[keep]
+    blobs[:, BLOB_AREA] = stats[keep, cv2.CC_STAT_AREA]
+    blobs[:, BLOB_LEFT] = stats[keep, cv2.CC_STAT_LEFT]
+    blobs[:, BLOB_TOP] = stats[keep, cv2.CC_STAT_TOP]
+    blobs[:, BLOB_WIDTH] = stats[keep, cv2.CC_STAT_WIDTH]
+    blobs[:, BLOB_HEIGHT] = stats[keep, cv2.CC_STAT_HEIGHT]
+    return blobs
@@ -3,9 +3,10 @@
 import traceback
 import cv2
 import numpy as np
-from multiprocessing import Process, Lock, Array
+from multiprocessing import Process, Lock, Condition, RawArray
 import ctypes
 import time
+from utils.frame_info import FrameInfo
 
 
 URL = 'rtp://224.1.1.1:5200/'
@@ -14,18 +15,40 @@ IMAGE_WIDTH = 1232
 COLOR_CHANNELS = 3
 
 
+# Number of frame buffers in the shared memory. With three buffers the
+# capture process always has a free buffer to decode into while the
+# reader holds one and another one is the latest complete frame.
+FRAME_BUFFERS = 3
+# Indexes to the shared state array
+_LATEST_BUFFER = 0
+_READER_BUFFER = 1
+
+
 class FFMpegVideoSource():
     def __init__(self):
         image_size = (IMAGE_WIDTH, IMAGE_HEIGHT, COLOR_CHANNELS)
         arr_size = IMAGE_WIDTH * IMAGE_HEIGHT * COLOR_CHANNELS
-        self._shared_arr = Array(ctypes.c_uint8, arr_size)
-        self._image_outside_thread = np.frombuffer(self._shared_arr.get_obj(),
-                                                   dtype=np.uint8)
-        self._image_outside_thread = np.reshape(self._image_outside_thread,
-                                                image_size)
+        self._shared_arr = RawArray(ctypes.c_uint8, FRAME_BUFFERS * arr_size)
+        self._buffer_sequences = RawArray(ctypes.c_int64, FRAME_BUFFERS)
+        self._buffer_timestamps = RawArray(ctypes.c_double, FRAME_BUFFERS)
+        self._buffer_decode_times = RawArray(ctypes.c_double, FRAME_BUFFERS)
+        self._state = RawArray(ctypes.c_int64, [-1, -1])
+        # The lock only guards the small state arrays above, never a
+        # frame copy, so reader and writer never wait for each other long
+        self._new_frame = Condition(Lock())
+        self._images_outside_thread = _buffers_as_images(self._shared_arr,
+                                                         image_size)
+        self._last_sequence = 0
 
         self._p = Process(target=self._run,
-                          args=(self._shared_arr, image_size, URL))
+                          args=(self._shared_arr,
+                                self._buffer_sequences,
+                                self._buffer_timestamps,
+                                self._buffer_decode_times,
+                                self._state,
+                                self._new_frame,
+                                image_size,
+                                URL))
         self._p.daemon = True
         self._p.start()
 
@@ -42,14 +65,51 @@ class FFMpegVideoSource():
     def _resize(self, image, width, height):
         return cv2.resize(image, (width, height))
 
-    def frame(self):
+    def frame(self, copy=True, out=None):
         """
         Get Frame
+        Args:
+            copy (bool): Return a copy of the frame. If false a read-only
+                view to the shared memory is returned. The view stays
+                valid until the next call to frame or latest_frame.
+            out (numpy.array, optional): Copy the frame to this array
+                instead of allocating a new one
         Returns : numpy.array(int8)
-            Image as a numpy array
+            Image as a numpy array or None if no frame has been captured
+        """
+        image, _ = self.latest_frame(copy, out)
+        return image
+
+    def latest_frame(self, copy=True, out=None):
+        """
+        Get the latest frame and its sequence number and capture time
+        Args:
+            copy (bool): See frame
+        Returns : tuple
+            numpy.array(int8) : Image or None if no frame is available
+            FrameInfo : Sequence number and timestamp or None
         """
-        with self._shared_arr.get_lock():
-            return np.copy(self._image_outside_thread)
+        with self._new_frame:
+            latest = self._state[_LATEST_BUFFER]
+            if latest < 0:
+                return None, None
+            # The capture process does not write to the buffer the reader
+            # holds so it can be read outside the lock
+            self._state[_READER_BUFFER] = latest
+            info = FrameInfo(self._buffer_sequences[latest],
+                             self._buffer_timestamps[latest],
+                             self._buffer_decode_times[latest])
+
+        self._last_sequence = info.sequence
+        image = self._images_outside_thread[latest]
+        if out is not None:
+            np.copyto(out, image)
+            return out, info
+        if copy:
+            return np.copy(image), info
+        view = image.view()
+        view.flags.writeable = False
+        return view, info
 
     def frame_available(self):
         """
@@ -57,39 +117,93 @@ class FFMpegVideoSource():
         Returns : boolean
             true if frame is available otherwise false
         """
-        with self._shared_arr.get_lock():
-            available = not isinstance(self._image_outside_thread,
-                                       type(None))
+        with self._new_frame:
+            available = self._state[_LATEST_BUFFER] >= 0
         return available
 
+    def wait_for_new_frame(self, timeout=None):
+        """
+        Wait until a frame newer than the last one returned by frame or
+        latest_frame has been captured
+        Args:
+            timeout (float): Seconds to wait or None to wait forever
+        Returns : boolean
+            true if a new frame is available otherwise false
+        """
+        with self._new_frame:
+            return self._new_frame.wait_for(
+                lambda: self._latest_sequence() > self._last_sequence,
+                timeout)
+
+    def _latest_sequence(self):
+        latest = self._state[_LATEST_BUFFER]
+        if latest < 0:
+            return 0
+        return self._buffer_sequences[latest]
+
     def stop(self):
         self._p.terminate()
 
-    def _run(self, shared_array, image_size, url):
+    @staticmethod
+    def _run(shared_array, buffer_sequences, buffer_timestamps,
+             buffer_decode_times, state, new_frame, image_size, url):
         """
-        Get frame to update _frame
+        Decode frames from the stream into a free frame buffer and
+        publish it as the latest frame
         """
         try:
-            image_inside_thread = np.frombuffer(shared_array.get_obj(),
-                                                dtype=np.uint8)
-            image_inside_thread = np.reshape(image_inside_thread,
-                                             image_size)
+            images_inside_thread = _buffers_as_images(shared_array,
+                                                      image_size)
+            sequence = 0
+            free_buffer = 0
 
             cap = cv2.VideoCapture(url)
             while True:
-                ret, frame = cap.read()
-                if not ret:
+                image = images_inside_thread[free_buffer]
+                # grab blocks until the next frame has been received and
+                # decompressed, retrieve converts it to BGR into the buffer
+                if not cap.grab():
                     break
-                if frame is None:
+                timestamp = time.monotonic()
+                ret, frame = cap.retrieve(image)
+                if not ret or frame is None:
                     print(f'No image from {url}')
                     continue
-                with shared_array.get_lock():
-                    image_inside_thread[:] = frame
+                if frame is not image:
+                    # The capture allocated a new array instead of
+                    # decoding straight into the buffer
+                    image[:] = frame
+                decode_time = time.monotonic()
+
+                sequence += 1
+                with new_frame:
+                    buffer_sequences[free_buffer] = sequence
+                    buffer_timestamps[free_buffer] = timestamp
+                    buffer_decode_times[free_buffer] = decode_time
+                    state[_LATEST_BUFFER] = free_buffer
+                    new_frame.notify_all()
+                    free_buffer = _free_buffer(state)
 
         except Exception as error:
             print(f'Got unexpected exception in "main" Message: {error}')
 
 
+def _buffers_as_images(shared_array, image_size):
+    images = np.frombuffer(shared_array, dtype=np.uint8)
+    return np.reshape(images, (FRAME_BUFFERS,) + image_size)
+
+
+def _free_buffer(state):
+    """
+    Get a buffer that is neither the latest frame nor held by the reader
+    """
+    for index in range(FRAME_BUFFERS):
+        if index != state[_LATEST_BUFFER] and \
+                index != state[_READER_BUFFER]:
+            return index
+    raise RuntimeError('No free frame buffer')
+
+
 # Test this script by running "python -m utils.ffmpeg_video_source" at the
 # project root
 if __name__ == '__main__':
@@ -99,7 +213,7 @@ if __name__ == '__main__':
     try:
         while True:
             # Wait for the next frame
-            if not video.frame_available():
+            if not video.wait_for_new_frame(timeout=1.0):
                 print("Frame not available")
                 continue
 
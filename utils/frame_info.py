@@ -0,0 +1,15 @@
+from collections import namedtuple
+
+
+# Metadata of a frame returned by the video sources
+#   sequence : int
+#       Running number of the frame from the source starting from 1.
+#       A frame with the same sequence number is the same image.
+#   timestamp : float
+#       time.monotonic() seconds when the frame was captured, or as close
+#       to it as the source can tell, e.g. when its data was received
+#   decode_time : float or None
+#       time.monotonic() seconds when the frame was decoded and ready to
+#       be read. None if the source does not know it.
+FrameInfo = namedtuple('FrameInfo', ['sequence', 'timestamp', 'decode_time'],
+                       defaults=(None,))
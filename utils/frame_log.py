@@ -0,0 +1,134 @@
+import os
+import numpy as np
+from utils.frame_info import FrameInfo
+
+
+# A frame log is a raw file of fixed size frames after a header and an
+# index file next to it with the sequence number and capture timestamp
+# of each frame. Frames are read through a memory map so reading a frame
+# does not copy it and seeking to any frame is a simple offset.
+MAGIC = b'AIFRAMES'
+VERSION = 1
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('height', '<u4'),
+    ('width', '<u4'),
+    ('channels', '<u4'),
+    ('reserved', 'V40'),
+])
+INDEX_DTYPE = np.dtype([
+    ('sequence', '<i8'),
+    ('timestamp', '<f8'),
+])
+INDEX_SUFFIX = '.idx'
+
+
+class FrameLogWriter():
+    """
+    Appends frames and their FrameInfo to a frame log file
+    """
+    def __init__(self, path, frame_shape):
+        self._path = path
+        self._frame_shape = tuple(frame_shape)
+        height, width, channels = self._frame_shape
+
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header['magic'] = MAGIC
+        header['version'] = VERSION
+        header['height'] = height
+        header['width'] = width
+        header['channels'] = channels
+
+        self._data_file = open(path, 'wb')
+        self._data_file.write(header.tobytes())
+        self._index_file = open(path + INDEX_SUFFIX, 'wb')
+        self._index_record = np.zeros(1, dtype=INDEX_DTYPE)
+        self.frame_count = 0
+
+    def append(self, frame, info):
+        """
+        Append a frame to the log
+
+        Args:
+            frame (numpy array): Image with the shape given to the writer
+            info (FrameInfo): Sequence number and timestamp of the frame
+        """
+        if frame.shape != self._frame_shape or frame.dtype != np.uint8:
+            raise ValueError(f'Expected an uint8 frame of shape '
+                             f'{self._frame_shape}, got: {frame.dtype} '
+                             f'{frame.shape}')
+        self._data_file.write(memoryview(np.ascontiguousarray(frame)))
+        self._index_record['sequence'] = info.sequence
+        self._index_record['timestamp'] = info.timestamp
+        self._index_file.write(self._index_record.tobytes())
+        self.frame_count += 1
+
+    def flush(self):
+        self._data_file.flush()
+        self._index_file.flush()
+
+    def close(self):
+        self._data_file.close()
+        self._index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class FrameLog():
+    """
+    Memory mapped read access to a frame log file
+    """
+    def __init__(self, path):
+        header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+        if len(header) != 1 or header['magic'][0] != MAGIC:
+            raise ValueError(f'{path} is not a frame log file')
+        if header['version'][0] != VERSION:
+            raise ValueError(f'Unsupported frame log version '
+                             f'{header["version"][0]} in {path}')
+
+        self.frame_shape = (int(header['height'][0]),
+                            int(header['width'][0]),
+                            int(header['channels'][0]))
+        frame_size = int(np.prod(self.frame_shape))
+        data_size = os.path.getsize(path) - HEADER_DTYPE.itemsize
+
+        index = np.fromfile(path + INDEX_SUFFIX, dtype=INDEX_DTYPE)
+        # A frame may have been written without its index record if the
+        # recorder was killed, so trust only frames that are in both
+        count = min(len(index), data_size // frame_size)
+        self._index = index[:count]
+        self._frames = np.memmap(path, dtype=np.uint8, mode='r',
+                                 offset=HEADER_DTYPE.itemsize,
+                                 shape=(count,) + self.frame_shape) \
+            if count else np.empty((0,) + self.frame_shape, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self._index)
+
+    @property
+    def timestamps(self):
+        return self._index['timestamp']
+
+    def frame(self, index):
+        """
+        Get a read-only view to a frame without copying it
+        """
+        return self._frames[index]
+
+    def info(self, index):
+        record = self._index[index]
+        return FrameInfo(int(record['sequence']), float(record['timestamp']))
+
+    def index_at_time(self, seconds):
+        """
+        Get the index of the last frame captured at most the given number
+        of seconds after the first frame
+        """
+        target = self.timestamps[0] + seconds
+        index = np.searchsorted(self.timestamps, target, side='right') - 1
+        return max(0, int(index))
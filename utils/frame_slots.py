@@ -0,0 +1,114 @@
+import threading
+import numpy as np
+from utils.frame_info import FrameInfo
+
+
+# Number of frame slots. With three slots the capture thread always has
+# a free slot while the reader holds one and another one is the latest.
+FRAME_SLOTS = 3
+
+
+class FrameSlots():
+    """
+    Hands the frames of a capture thread over to a reader without copying
+    them in between. The capture thread writes each frame to the image of
+    free_slot and then publishes it. The reader gets the latest published
+    frame and holds its slot until its next read, so the capture thread
+    never writes to a frame that is being read.
+
+    Used by the video sources whose frames are captured in a thread of the
+    same process, see WebcamVideoSource, GStreamerVideoSource and
+    SimulatorVideoSource.
+    """
+    def __init__(self, slot_count=FRAME_SLOTS):
+        # The capture thread may replace the image of the free slot, e.g.
+        # when the frame size changes
+        self.images = [None] * slot_count
+        self._infos = [None] * slot_count
+        self._latest_slot = -1
+        self._reader_slot = -1
+        self.free_slot = 0
+        self._sequence = 0
+        self._last_sequence = 0
+        # Held while the slots are handed over
+        self.lock = threading.Condition()
+
+    def publish(self, timestamp, decode_time=None):
+        """
+        Make the frame written to free_slot the latest frame and move
+        free_slot to a slot that is neither the latest nor held by the
+        reader. Called from the capture thread.
+
+        Args:
+            timestamp (float): time.monotonic() capture time of the frame
+            decode_time (float, optional): time.monotonic() time when the
+                frame was decoded
+        """
+        with self.lock:
+            self._sequence += 1
+            self._infos[self.free_slot] = FrameInfo(
+                self._sequence, timestamp, decode_time)
+            self._latest_slot = self.free_slot
+            self.free_slot = self._next_free_slot()
+            self.lock.notify_all()
+
+    def latest_frame(self, copy=True, out=None):
+        """
+        Get the latest frame and its sequence number and capture time
+        Args:
+            copy (bool): Return a copy of the frame. If false a read-only
+                view is returned. The view stays valid until the next call.
+            out (numpy.array, optional): Copy the frame to this array
+                instead of allocating a new one
+        Returns : tuple
+            numpy.array(int8) : Image or None if no frame is available
+            FrameInfo : Sequence number and timestamp or None
+        """
+        with self.lock:
+            latest = self._latest_slot
+            if latest < 0:
+                return None, None
+            # The capture thread does not write to the slot the reader
+            # holds so it can be read outside the lock
+            self._reader_slot = latest
+            image = self.images[latest]
+            info = self._infos[latest]
+
+        self._last_sequence = info.sequence
+        if out is not None:
+            np.copyto(out, image)
+            return out, info
+        if copy:
+            return np.copy(image), info
+        view = image.view()
+        view.flags.writeable = False
+        return view, info
+
+    def frame_available(self):
+        """
+        Check if frame is available
+        Returns : boolean
+            true if frame is available otherwise false
+        """
+        with self.lock:
+            available = self._latest_slot >= 0
+        return available
+
+    def wait_for_new_frame(self, timeout=None):
+        """
+        Wait until a frame newer than the last one returned by
+        latest_frame has been published
+        Args:
+            timeout (float): Seconds to wait or None to wait forever
+        Returns : boolean
+            true if a new frame is available otherwise false
+        """
+        with self.lock:
+            return self.lock.wait_for(
+                lambda: self._sequence > self._last_sequence, timeout)
+
+    def _next_free_slot(self):
+        for slot in range(len(self.images)):
+            if slot != self._latest_slot and slot != self._reader_slot:
+                return slot
+        raise RuntimeError('No free frame slot')
@@ -1,9 +1,10 @@
 #!/usr/bin/env python
 
+import time
 import cv2
 import gi
 import numpy as np
-from multiprocessing import Lock
+from utils.frame_slots import FrameSlots
 
 gi.require_version('Gst', '1.0')
 from gi.repository import Gst
@@ -15,15 +16,36 @@ STREAM_PORT = "5200"
 IMAGE_HEIGHT = 1232
 IMAGE_WIDTH = 1232
 
+# Pipeline to test the video source without a camera
+VIDEOTESTSRC_CONFIG = \
+    [
+        f'videotestsrc is-live=true ! video/x-raw,width={IMAGE_WIDTH},'
+        f'height={IMAGE_HEIGHT},framerate=30/1',
+        '! videoconvert ! video/x-raw,format=(string)BGR',
+        '! appsink emit-signals=true sync=false drop=true'
+    ]
+
 
 class GStreamerVideoSource():
-    def __init__(self):
+    def __init__(self, config=None, zero_copy=False):
+        """
+        Args:
+            config (list, optional): Gstreamer pipeline description list.
+                Defaults to receiving the JPEG RTP stream, use
+                VIDEOTESTSRC_CONFIG to test without a camera.
+            zero_copy (bool): Keep the Gstreamer buffers mapped and serve
+                them as numpy views instead of copying them into
+                preallocated frames
+        """
         Gst.init(None)
 
         self._width = IMAGE_WIDTH
         self._height = IMAGE_HEIGHT
-        self._frame = None
-        self._mutex = Lock()
+        self._zero_copy = zero_copy
+        # Each slot holds an image and in zero copy mode also the mapped
+        # Gstreamer buffer the image is a view to
+        self._slots = FrameSlots()
+        self._slot_mappings = [None] * len(self._slots.images)
 
         # See https://github.com/robot-uprising-hq/ai-video-streamer/blob/master/docs/Testing-AI-Video-Streamer.md
         # to see different ways to send the video stream from the
@@ -49,7 +71,7 @@ class GStreamerVideoSource():
         self.video_pipe = None
         self.video_sink = None
 
-        self._run()
+        self._run(config)
 
     def _start_gst(self, config=None):
         """ Start gstreamer pipeline and sink
@@ -77,23 +99,53 @@ class GStreamerVideoSource():
         self.video_sink = self.video_pipe.get_by_name('appsink0')
 
     @staticmethod
-    def _gst_to_opencv(sample):
-        """Transform byte array into np array
+    def _sample_shape(sample):
+        structure = sample.get_caps().get_structure(0)
+        return (structure.get_value('height'),
+                structure.get_value('width'),
+                3)
+
+    def _store_sample(self, sample, slot):
+        """Put the sample to the given slot without allocating a frame
         Args:
-            sample (TYPE): Description
-        Returns:
-            TYPE: Description
+            sample (Gst.Sample): Sample from the appsink
+            slot (int): Slot that is not used by the reader
         """
         buf = sample.get_buffer()
-        caps = sample.get_caps()
-        array = np.ndarray(
-            (
-                caps.get_structure(0).get_value('height'),
-                caps.get_structure(0).get_value('width'),
-                3
-            ),
-            buffer=buf.extract_dup(0, buf.get_size()), dtype=np.uint8)
-        return array
+        shape = self._sample_shape(sample)
+        self._release_slot(slot)
+
+        ok, map_info = buf.map(Gst.MapFlags.READ)
+        if not ok:
+            raise RuntimeError('Could not map Gstreamer buffer')
+        mapped = np.ndarray(shape, buffer=map_info.data, dtype=np.uint8)
+
+        if self._zero_copy and isinstance(map_info.data, memoryview):
+            self._slots.images[slot] = mapped
+            self._slot_mappings[slot] = (buf, map_info)
+            return
+        if self._zero_copy:
+            # Older PyGObject versions give the data as a copy in bytes
+            # instead of a view to the mapped memory, so a view to it
+            # would not be zero copy. Copy to the slot like without it.
+            print('Gstreamer buffer data is not a memoryview, '
+                  'copying the frames')
+            self._zero_copy = False
+
+        image = self._slots.images[slot]
+        if image is None or image.shape != shape:
+            image = np.empty(shape, dtype=np.uint8)
+            self._slots.images[slot] = image
+        np.copyto(image, mapped)
+        buf.unmap(map_info)
+
+    def _release_slot(self, slot):
+        mapping = self._slot_mappings[slot]
+        if mapping is not None:
+            buf, map_info = mapping
+            self._slots.images[slot] = None
+            self._slot_mappings[slot] = None
+            buf.unmap(map_info)
 
     def _crop_center(self, image, cropped_width, cropped_height):
         height, width, _ = image.shape
@@ -108,55 +160,112 @@ class GStreamerVideoSource():
     def _resize(self, image, new_width, new_height):
         return cv2.resize(image, (new_width, new_height))
 
-    def frame(self):
+    def frame(self, copy=True, out=None):
         """ Get Frame
+        Args:
+            copy (bool): Return a copy of the frame. If false a read-only
+                view is returned. The view stays valid until the next call
+                to frame or latest_frame.
+            out (numpy.array, optional): Copy the frame to this array
+                instead of allocating a new one
         Returns:
-            iterable: bool and image frame, cap.read() output
+            numpy.array: image or None if no frame has been received
+        """
+        image, _ = self.latest_frame(copy, out)
+        return image
+
+    def latest_frame(self, copy=True, out=None):
+        """ Get the latest frame and its sequence number and capture time,
+        see FrameSlots.latest_frame
         """
-        with self._mutex:
-            new_frame = self._frame
-        return new_frame
+        return self._slots.latest_frame(copy, out)
 
     def frame_available(self):
         """Check if frame is available
         Returns:
             bool: true if frame is available
         """
-        with self._mutex:
-            available = type(self._frame) != type(None)
-        return available
+        return self._slots.frame_available()
+
+    def wait_for_new_frame(self, timeout=None):
+        """Wait until a frame newer than the last one returned by frame or
+        latest_frame has been received
+        Args:
+            timeout (float): Seconds to wait or None to wait forever
+        Returns:
+            bool: true if a new frame is available
+        """
+        return self._slots.wait_for_new_frame(timeout)
 
-    def _run(self):
+    def stop(self):
+        if self.video_pipe is not None:
+            self.video_pipe.set_state(Gst.State.NULL)
+        with self._slots.lock:
+            for slot in range(len(self._slot_mappings)):
+                self._release_slot(slot)
+
+    def _run(self, config=None):
         """ Get frame to update _frame
         """
+        if not config:
+            config = \
+                [
+                    self.video_source,
+                    self.video_codec,
+                    self.video_decode,
+                    self.video_sink_conf
+                ]
 
-        self._start_gst(
-            [
-                self.video_source,
-                self.video_codec,
-                self.video_decode,
-                self.video_sink_conf
-            ])
+        self._start_gst(config)
 
         self.video_sink.connect('new-sample', self._callback)
 
+    def _capture_time(self, sample):
+        """
+        Get the time.monotonic() time when the source element received the
+        frame from the buffer's presentation timestamp
+
+        Returns:
+            float: Capture time or None if the buffer has no timestamp
+        """
+        buf = sample.get_buffer()
+        if buf.pts == Gst.CLOCK_TIME_NONE:
+            return None
+        running_time = sample.get_segment().to_running_time(
+            Gst.Format.TIME, buf.pts)
+        if running_time == Gst.CLOCK_TIME_NONE:
+            return None
+        # The pipeline clock of a live pipeline is the monotonic system
+        # clock, the same clock as time.monotonic() uses
+        return (self.video_pipe.get_base_time() + running_time) / Gst.SECOND
+
     def _callback(self, sink):
         sample = sink.emit('pull-sample')
-        new_frame = self._gst_to_opencv(sample)
-        with self._mutex:
-            self._frame = new_frame
-
+        decode_time = time.monotonic()
+        timestamp = self._capture_time(sample)
+        if timestamp is None or timestamp > decode_time:
+            # Not a live source or not on the same clock
+            timestamp = decode_time
+        self._store_sample(sample, self._slots.free_slot)
+        self._slots.publish(timestamp, decode_time)
         return Gst.FlowReturn.OK
 
 
+# Test this script without a camera by running
+# "python -m utils.gstreamer_video_source test" at the project root
 if __name__ == '__main__':
+    import sys
+
     # Create the video object
     # Add port= if is necessary to use a different one
-    video = GStreamerVideoSource()
+    if 'test' in sys.argv[1:]:
+        video = GStreamerVideoSource(VIDEOTESTSRC_CONFIG)
+    else:
+        video = GStreamerVideoSource()
 
     while True:
         # Wait for the next frame
-        if not video.frame_available():
+        if not video.wait_for_new_frame(timeout=1.0):
             continue
 
         frame = video.frame()
@@ -0,0 +1,252 @@
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+
+# Upper bounds of the histogram buckets in seconds, 20 buckets per decade
+# from 10 microseconds to 100 seconds
+BUCKET_BOUNDS = np.logspace(-5, 2, 141)
+PERCENTILES = (50, 90, 99)
+STATS_INTERVAL = 10.0
+METRICS_PORT = 9100
+
+# Name of the histogram of the time from the frame capture to sending a
+# robot command based on the frame
+GLASS_TO_COMMAND = 'glass_to_command'
+# The pipeline stage histograms are named with this prefix
+STAGE_PREFIX = 'stage.'
+
+
+class LatencyHistogram():
+    """
+    Histogram of latencies with logarithmic buckets. Recording is cheap
+    and the memory use stays constant however many values are recorded.
+    The percentiles are accurate to the bucket width, about 12 %.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # The last bucket counts the values above the largest bound
+            self._counts = np.zeros(len(BUCKET_BOUNDS) + 1, dtype=np.int64)
+            self._count = 0
+            self._sum = 0.0
+            self._max = 0.0
+
+    def record(self, seconds):
+        index = np.searchsorted(BUCKET_BOUNDS, seconds)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._sum += seconds
+            self._max = max(self._max, seconds)
+
+    def summary(self):
+        """
+        Returns : dictionary
+            count : Number of recorded values
+            mean_ms, max_ms : Mean and maximum in milliseconds
+            p50_ms, p90_ms, p99_ms : Percentiles in milliseconds
+        """
+        with self._lock:
+            counts = self._counts.copy()
+            count, total, maximum = self._count, self._sum, self._max
+
+        summary = {
+            'count': count,
+            'mean_ms': 1000 * total / count if count else 0.0,
+            'max_ms': 1000 * maximum,
+        }
+        cumulative = np.cumsum(counts)
+        for percentile in PERCENTILES:
+            if not count:
+                value = 0.0
+            else:
+                index = np.searchsorted(cumulative, count * percentile / 100)
+                # Values above the largest bound are reported as the max
+                value = BUCKET_BOUNDS[index] \
+                    if index < len(BUCKET_BOUNDS) else maximum
+                value = min(value, maximum)
+            summary[f'p{percentile}_ms'] = 1000 * value
+        return summary
+
+
+class LatencyStats():
+    """
+    Named latency histograms of a process. Pass it as the timer to the
+    pipeline functions that take one to time their stages, and record
+    other latencies such as the glass-to-command time with record.
+    """
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(name,
+                                                        LatencyHistogram())
+        return histogram
+
+    def record(self, name, seconds):
+        self.histogram(name).record(seconds)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time the code in a with-block as the stage of the given name
+        """
+        histogram = self.histogram(STAGE_PREFIX + name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            histogram.record(time.perf_counter() - start)
+
+    def summary(self):
+        """
+        Returns : dictionary
+            key : histogram name
+            value : LatencyHistogram.summary
+        """
+        with self._lock:
+            histograms = dict(self._histograms)
+        return {name: histogram.summary()
+                for name, histogram in sorted(histograms.items())}
+
+    def reset(self):
+        with self._lock:
+            histograms = list(self._histograms.values())
+        for histogram in histograms:
+            histogram.reset()
+
+    def stats_lines(self):
+        """
+        Format the summary as one line per histogram for logs
+        """
+        return [f'{name}: n={summary["count"]} '
+                f'p50={summary["p50_ms"]:.1f}ms '
+                f'p90={summary["p90_ms"]:.1f}ms '
+                f'p99={summary["p99_ms"]:.1f}ms '
+                f'max={summary["max_ms"]:.1f}ms'
+                for name, summary in self.summary().items()]
+
+
+def stage(timer, name):
+    """
+    Context manager that times a pipeline stage with the timer, or does
+    nothing if the timer is None. Used by the pipeline functions with a
+    timer argument.
+    """
+    if timer is None:
+        return nullcontext()
+    return timer.stage(name)
+
+
+_latency_stats = None
+
+
+def get_latency_stats():
+    """
+    Get the process wide latency stats
+    """
+    global _latency_stats
+    if _latency_stats is None:
+        _latency_stats = LatencyStats()
+    return _latency_stats
+
+
+class StatsReporter():
+    """
+    Prints the latency stats lines periodically from a background thread
+    """
+    def __init__(self, stats=None, interval=STATS_INTERVAL, reset=False):
+        """
+        Args:
+            stats (LatencyStats, optional): The process wide stats by
+                default
+            interval (float): Seconds between the reports
+            reset (bool): Reset the histograms after each report so that
+                each report covers only its interval
+        """
+        self._stats = stats or get_latency_stats()
+        self._interval = interval
+        self._reset = reset
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            for line in self._stats.stats_lines():
+                print(f'Latency {line}')
+            if self._reset:
+                self._stats.reset()
+
+
+class MetricsServer():
+    """
+    Serves the latency stats over HTTP for monitoring. /metrics is in the
+    Prometheus text format and /metrics.json is the summary as JSON.
+    """
+    def __init__(self, stats=None, port=METRICS_PORT, host='127.0.0.1'):
+        self._stats = stats or get_latency_stats()
+        self._server = ThreadingHTTPServer((host, port),
+                                           self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def prometheus_text(self):
+        lines = ['# TYPE latency_seconds summary']
+        for name, summary in self._stats.summary().items():
+            for percentile in PERCENTILES:
+                lines.append(
+                    f'latency_seconds{{name="{name}",'
+                    f'quantile="{percentile / 100}"}} '
+                    f'{summary[f"p{percentile}_ms"] / 1000:.6f}')
+            lines.append(f'latency_seconds_sum{{name="{name}"}} '
+                         f'{summary["mean_ms"] * summary["count"] / 1000:.6f}')
+            lines.append(f'latency_seconds_count{{name="{name}"}} '
+                         f'{summary["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def _handler_class(self):
+        server = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body = server.prometheus_text().encode()
+                    content_type = 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body = json.dumps(server._stats.summary()).encode()
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return MetricsHandler
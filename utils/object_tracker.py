@@ -0,0 +1,352 @@
+import time
+import numpy as np
+from utils.aruco_utils import MARKER_DTYPE
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    # The greedy assignment is used without scipy
+    linear_sum_assignment = None
+
+
+# Layout of the track arrays returned by MultiObjectTracker
+TRACK_DTYPE = np.dtype([
+    ('track_id', np.int32),
+    ('position', np.float32, (2,)),
+    ('velocity', np.float32, (2,)),
+    # Detections since the track was started
+    ('hits', np.int32),
+    # Updates since the track was last detected
+    ('missed', np.int32),
+])
+
+# Detections further than this many pixels from a track's predicted
+# position are not assigned to it
+MAX_DISTANCE = 60.0
+# Drop a track after this many updates without a detection
+MAX_MISSED = 5
+# Standard deviation of the acceleration in pixels/s^2 and of the
+# detected positions in pixels
+ACCELERATION_STD = 400.0
+MEASUREMENT_STD = 2.0
+# Standard deviation of the velocity of a new track in pixels/s
+INITIAL_VELOCITY_STD = 300.0
+
+# DetectionTracker adjusts the core detection interval to the load after
+# every this many processed frames. It is raised when more than
+# MAX_DROP_RATE of the frames were dropped and lowered when none were.
+LOAD_WINDOW = 30
+MAX_DROP_RATE = 0.25
+
+# Kalman state is [x, y, vx, vy] and only the position is measured
+_MEASUREMENT_MATRIX = np.hstack([np.identity(2), np.zeros((2, 2))])
+
+
+def assign(cost, max_cost):
+    """
+    Assign detections to tracks so that the total cost is smallest. Uses
+    scipy's linear_sum_assignment when scipy is installed and a greedy
+    cheapest-pair-first assignment otherwise.
+
+    Args:
+        cost (numpy array (T, D)): Cost of assigning detection d to track t
+        max_cost (float): Pairs that cost more are never assigned
+
+    Returns:
+        (numpy array (M,), numpy array (M,)): Track and detection indexes
+            of the assigned pairs
+    """
+    if not cost.size:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+
+    if linear_sum_assignment is not None:
+        # Gated pairs get a cost no real assignment can reach
+        gated = np.where(cost > max_cost, max_cost * cost.size + 1, cost)
+        rows, cols = linear_sum_assignment(gated)
+        keep = cost[rows, cols] <= max_cost
+        return rows[keep], cols[keep]
+
+    rows, cols = np.nonzero(cost <= max_cost)
+    order = np.argsort(cost[rows, cols], kind='stable')
+    used_rows = np.zeros(cost.shape[0], dtype=bool)
+    used_cols = np.zeros(cost.shape[1], dtype=bool)
+    assigned = []
+    for index in order:
+        row, col = rows[index], cols[index]
+        if used_rows[row] or used_cols[col]:
+            continue
+        used_rows[row] = used_cols[col] = True
+        assigned.append(index)
+    assigned = np.array(assigned, dtype=np.intp)
+    return rows[assigned], cols[assigned]
+
+
+class MultiObjectTracker():
+    """
+    Tracks points from frame to frame with a constant velocity Kalman
+    filter per track. All the tracks are stored in arrays and predicted
+    and updated together.
+
+    Detections without a known identity, like the energy cores, are
+    assigned to the tracks by distance from the predicted positions.
+    Detections with an identity, like the aruco markers, can be given
+    their ids to use them as the track ids instead.
+    """
+    def __init__(self,
+                 max_distance=MAX_DISTANCE,
+                 max_missed=MAX_MISSED,
+                 acceleration_std=ACCELERATION_STD,
+                 measurement_std=MEASUREMENT_STD,
+                 initial_velocity_std=INITIAL_VELOCITY_STD):
+        self._max_distance = max_distance
+        self._max_missed = max_missed
+        self._acceleration_variance = acceleration_std ** 2
+        self._measurement_covariance = measurement_std ** 2 * np.identity(2)
+        self._initial_covariance = np.diag([
+            measurement_std ** 2, measurement_std ** 2,
+            initial_velocity_std ** 2, initial_velocity_std ** 2])
+
+        self._ids = np.empty(0, dtype=np.int32)
+        self._states = np.empty((0, 4))
+        self._covariances = np.empty((0, 4, 4))
+        self._hits = np.empty(0, dtype=np.int32)
+        self._missed = np.empty(0, dtype=np.int32)
+        self._next_id = 0
+        self._timestamp = None
+
+    def __len__(self):
+        return len(self._ids)
+
+    def predict(self, timestamp=None):
+        """
+        Move the tracks to their predicted positions at the timestamp
+        without a detection
+
+        Args:
+            timestamp (float, optional): time.monotonic() time of the
+                frame, now by default
+
+        Returns:
+            numpy array of TRACK_DTYPE: The tracks
+        """
+        self._predict(timestamp)
+        return self.tracks()
+
+    def update(self, points, timestamp=None, ids=None):
+        """
+        Predict the tracks to the timestamp and correct them with the
+        detections of the frame. Unassigned detections start new tracks
+        and tracks that have missed too many updates are dropped.
+
+        Args:
+            points (numpy array (D, 2)): Detected positions
+            timestamp (float, optional): time.monotonic() time of the
+                frame, now by default
+            ids (numpy array (D,), optional): Identities of the detections.
+                Detections are then matched to the tracks by id.
+
+        Returns:
+            numpy array of TRACK_DTYPE: The tracks
+        """
+        self._predict(timestamp)
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+        if ids is None:
+            offsets = (self._states[:, np.newaxis, :2] -
+                       points[np.newaxis, :, :])
+            cost = np.hypot(offsets[..., 0], offsets[..., 1])
+            track_indexes, point_indexes = assign(cost, self._max_distance)
+        else:
+            ids = np.asarray(ids, dtype=np.int32).reshape(-1)
+            track_indexes, point_indexes = np.nonzero(
+                self._ids[:, np.newaxis] == ids[np.newaxis, :])
+
+        self._correct(track_indexes, points[point_indexes])
+        self._missed += 1
+        self._missed[track_indexes] = 0
+        self._hits[track_indexes] += 1
+
+        unassigned = np.ones(len(points), dtype=bool)
+        unassigned[point_indexes] = False
+        if ids is None:
+            new_ids = np.arange(self._next_id,
+                                self._next_id + np.count_nonzero(unassigned),
+                                dtype=np.int32)
+            self._next_id += len(new_ids)
+        else:
+            new_ids = ids[unassigned]
+        self._add_tracks(new_ids, points[unassigned])
+
+        keep = self._missed <= self._max_missed
+        self._ids = self._ids[keep]
+        self._states = self._states[keep]
+        self._covariances = self._covariances[keep]
+        self._hits = self._hits[keep]
+        self._missed = self._missed[keep]
+        return self.tracks()
+
+    def tracks(self):
+        tracks = np.empty(len(self._ids), dtype=TRACK_DTYPE)
+        tracks['track_id'] = self._ids
+        tracks['position'] = self._states[:, :2]
+        tracks['velocity'] = self._states[:, 2:]
+        tracks['hits'] = self._hits
+        tracks['missed'] = self._missed
+        return tracks
+
+    def _predict(self, timestamp):
+        if timestamp is None:
+            timestamp = time.monotonic()
+        dt = 0.0 if self._timestamp is None else timestamp - self._timestamp
+        self._timestamp = timestamp
+        if dt <= 0 or not len(self._ids):
+            return
+
+        transition = np.identity(4)
+        transition[0, 2] = transition[1, 3] = dt
+        # Process noise of a random acceleration for each axis
+        noise = np.zeros((4, 4))
+        noise[[0, 1], [0, 1]] = dt ** 4 / 4
+        noise[[0, 1], [2, 3]] = noise[[2, 3], [0, 1]] = dt ** 3 / 2
+        noise[[2, 3], [2, 3]] = dt ** 2
+        noise *= self._acceleration_variance
+
+        self._states = self._states @ transition.T
+        self._covariances = \
+            transition @ self._covariances @ transition.T + noise
+
+    def _correct(self, indexes, points):
+        if not len(indexes):
+            return
+        covariances = self._covariances[indexes]
+        innovations = points - self._states[indexes, :2]
+        # With the position measured directly H P H^T is the top left
+        # block and P H^T the left columns of P
+        innovation_covariances = \
+            covariances[:, :2, :2] + self._measurement_covariance
+        gains = covariances[:, :, :2] @ np.linalg.inv(innovation_covariances)
+
+        self._states[indexes] += np.einsum('nij,nj->ni', gains, innovations)
+        self._covariances[indexes] = covariances - \
+            gains @ _MEASUREMENT_MATRIX @ covariances
+
+    def _add_tracks(self, ids, points):
+        count = len(ids)
+        self._ids = np.concatenate([self._ids, ids])
+        self._states = np.concatenate(
+            [self._states, np.hstack([points, np.zeros((count, 2))])])
+        self._covariances = np.concatenate(
+            [self._covariances, np.repeat(
+                self._initial_covariance[np.newaxis], count, axis=0)])
+        self._hits = np.concatenate(
+            [self._hits, np.ones(count, dtype=np.int32)])
+        self._missed = np.concatenate(
+            [self._missed, np.zeros(count, dtype=np.int32)])
+
+
+class DetectionTracker():
+    """
+    Tracks the robots' aruco markers and the energy cores of each color
+    class. The core segmentation is only run every core_detect_interval
+    frames, and on the other frames the cores are predicted from their
+    tracks, so smoothed positions are still published on every frame.
+
+    The detection itself is done by the caller, see make_detector, which
+    asks need_core_detection on each frame.
+    """
+    def __init__(self, color_ranges, core_detect_interval=1,
+                 max_core_detect_interval=None, **tracker_args):
+        """
+        Args:
+            color_ranges ([(str, low_color, high_color)]): Energy core
+                colors
+            core_detect_interval (int): Run the core detection on every
+                this many frames
+            max_core_detect_interval (int, optional): Let record_load
+                raise the interval up to this when the loop drops frames.
+                By default the interval is fixed.
+            tracker_args: Arguments for each MultiObjectTracker
+        """
+        self.core_detect_interval = core_detect_interval
+        self._min_core_detect_interval = core_detect_interval
+        self.max_core_detect_interval = \
+            max_core_detect_interval or core_detect_interval
+        self._window_frames = 0
+        self._window_dropped = 0
+        self._marker_tracker = MultiObjectTracker(**tracker_args)
+        self._core_trackers = {name: MultiObjectTracker(**tracker_args)
+                               for name, _, _ in color_ranges}
+        self._frames_since_core_detection = None
+
+    def need_core_detection(self):
+        return (self._frames_since_core_detection is None or
+                self._frames_since_core_detection + 1 >=
+                self.core_detect_interval)
+
+    def record_load(self, frames_dropped):
+        """
+        Adjust core_detect_interval to the load. Called once per processed
+        frame with the frames dropped before it, see SensePlanActLoop.
+
+        After every LOAD_WINDOW frames the interval is raised by one, up
+        to max_core_detect_interval, if more than MAX_DROP_RATE of the
+        frames were dropped, and lowered by one, down to the interval
+        given to the constructor, if none were.
+        """
+        self._window_frames += 1
+        self._window_dropped += frames_dropped
+        if self._window_frames < LOAD_WINDOW:
+            return
+        drop_rate = self._window_dropped / \
+            (self._window_frames + self._window_dropped)
+        if drop_rate > MAX_DROP_RATE:
+            self.core_detect_interval = min(self.core_detect_interval + 1,
+                                            self.max_core_detect_interval)
+        elif not self._window_dropped:
+            self.core_detect_interval = max(self.core_detect_interval - 1,
+                                            self._min_core_detect_interval)
+        self._window_frames = 0
+        self._window_dropped = 0
+
+    def update(self, markers, cores=None, timestamp=None):
+        """
+        Update the tracks with the detections of a frame
+
+        Args:
+            markers (numpy structured array of MARKER_DTYPE): Detected
+                markers of the frame
+            cores (dictionary, optional): Detected core centers by color
+                class. None predicts the cores without a detection.
+            timestamp (float, optional): time.monotonic() time of the
+                frame, now by default
+
+        Returns:
+            (numpy array of MARKER_DTYPE, dictionary): The markers with
+                smoothed positions and the core tracks by color class
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+
+        tracks = self._marker_tracker.update(
+            markers['position'], timestamp, ids=markers['id'])
+        # Only the markers seen on this frame are returned since their
+        # rotation is known
+        smoothed = np.empty(len(markers), dtype=MARKER_DTYPE)
+        smoothed['id'] = markers['id']
+        smoothed['rotation'] = markers['rotation']
+        order = np.argsort(tracks['track_id'])
+        smoothed['position'] = tracks['position'][order[np.searchsorted(
+            tracks['track_id'], markers['id'], sorter=order)]]
+
+        if cores is None:
+            # Until the first core detection every frame needs one
+            if self._frames_since_core_detection is not None:
+                self._frames_since_core_detection += 1
+            core_tracks = {name: tracker.predict(timestamp)
+                           for name, tracker in self._core_trackers.items()}
+        else:
+            self._frames_since_core_detection = 0
+            core_tracks = {name: tracker.update(cores.get(name, []),
+                                                timestamp)
+                           for name, tracker in self._core_trackers.items()}
+        return smoothed, core_tracks
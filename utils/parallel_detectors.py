@@ -0,0 +1,178 @@
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait
+import numpy as np
+from cv2 import aruco
+from utils.aruco_utils import (
+    aruco_poses_to_arrays, detector_parameters_from_dict,
+    detector_parameters_to_dict, image_to_gray)
+from utils.buffer_arena import BufferArena
+from utils.calibration import load_calibration
+from utils.ecore_utils import image_to_center_points_multi
+from utils.frame_info import FrameInfo
+from utils.shared_frame_ring import SharedFrameRing
+
+
+RING_SLOTS = 4
+
+# State of a worker process, set by _init_worker
+_worker = {}
+
+
+def detector_config(dictionary_id, parameters, mtx, dist, marker_size,
+                    color_ranges, calibration_file=None):
+    """
+    Collect the detector settings to a picklable dictionary for the
+    worker processes
+
+    Args:
+        dictionary_id (int): Aruco dictionary id e.g. aruco.DICT_4X4_50
+        parameters: aruco.DetectorParameters
+        mtx, dist (numpy array): Camera matrix and distortion coefficients
+        marker_size (float): Size of the markers for the pose estimation
+        color_ranges ([(str, low_color, high_color)]): Energy core colors
+        calibration_file (str, optional): Undistort the marker corners and
+            the core centers with this calibration. The workers load it
+            once from the file and its cache.
+    """
+    return {
+        'dictionary_id': dictionary_id,
+        'parameters': detector_parameters_to_dict(parameters),
+        'mtx': np.asarray(mtx),
+        'dist': np.asarray(dist),
+        'marker_size': marker_size,
+        'color_ranges': [(name, np.asarray(low), np.asarray(high))
+                         for name, low, high in color_ranges],
+        'calibration_file': calibration_file,
+    }
+
+
+def _init_worker(ring_name, config):
+    _worker['ring'] = SharedFrameRing.attach(ring_name, child=True)
+    _worker['config'] = config
+    _worker['dictionary'] = aruco.Dictionary_get(config['dictionary_id'])
+    _worker['parameters'] = detector_parameters_from_dict(
+        config['parameters'])
+    _worker['arena'] = BufferArena()
+    _worker['calibration'] = load_calibration(config['calibration_file']) \
+        if config['calibration_file'] else None
+
+
+def _detect_markers(frame_id):
+    frame = _worker['ring'].read(frame_id)
+    if frame is None:
+        return None
+    config = _worker['config']
+    corners, detected_ids, _ = aruco.detectMarkers(
+        image_to_gray(frame, _worker['arena']),
+        _worker['dictionary'],
+        parameters=_worker['parameters'])
+    calibration = _worker['calibration']
+    if calibration is not None:
+        corners, rvecs, _ = calibration.estimate_poses(
+            corners, config['marker_size'])
+    else:
+        rvecs, _, _ = aruco.estimatePoseSingleMarkers(
+            corners, config['marker_size'], config['mtx'], config['dist'])
+    return aruco_poses_to_arrays(detected_ids, corners, rvecs)
+
+
+def _detect_cores(frame_id):
+    frame = _worker['ring'].read(frame_id)
+    if frame is None:
+        return None
+    cores = image_to_center_points_multi(
+        frame, _worker['config']['color_ranges'], arena=_worker['arena'])
+    if _worker['calibration'] is not None:
+        cores = _worker['calibration'].undistort_center_points(cores)
+    return cores
+
+
+# Detection tasks run for each frame. Add new independent detectors here.
+TASKS = OrderedDict([
+    ('markers', _detect_markers),
+    ('cores', _detect_cores),
+])
+
+
+class ParallelDetectionPipeline():
+    """
+    Copies each frame once to a shared memory ring and runs the marker
+    and the energy core detection of the frame concurrently in a pool of
+    worker processes. The results are merged per frame sequence number.
+
+    Frames are pipelined: several frames can be in flight at once. A
+    frame waits in submit until the frame that used its ring slot before
+    has been processed, so a slot is never overwritten while a worker
+    reads it.
+    """
+    def __init__(self, frame_shape, config, workers=None, slots=RING_SLOTS):
+        self._ring = SharedFrameRing.create(frame_shape, slots)
+        self._pool = ProcessPoolExecutor(
+            max_workers=workers or os.cpu_count(),
+            initializer=_init_worker,
+            initargs=(self._ring.name, config))
+        # The ring is addressed with consecutive frame ids since the
+        # sequence numbers of the source may have gaps
+        self._next_frame_id = 1
+        # Frame id to (FrameInfo, {task name: future}) in the order the
+        # frames were submitted
+        self._in_flight = OrderedDict()
+
+    def submit(self, frame, info):
+        """
+        Start detecting a frame. Blocks if the frame's ring slot is still
+        being read by the workers.
+
+        Args:
+            frame (numpy array): Image of the ring's frame shape
+            info (FrameInfo): Sequence number and timestamp of the frame
+        """
+        frame_id = self._next_frame_id
+        self._next_frame_id += 1
+        for old_frame_id, (_, futures) in self._in_flight.items():
+            if old_frame_id > frame_id - self._ring.slots:
+                break
+            wait(futures.values())
+
+        self._ring.write(frame, FrameInfo(frame_id, info.timestamp,
+                                          info.decode_time))
+        self._in_flight[frame_id] = (info, {
+            name: self._pool.submit(task, frame_id)
+            for name, task in TASKS.items()
+        })
+
+    @property
+    def frames_in_flight(self):
+        return len(self._in_flight)
+
+    def collect(self, block=False):
+        """
+        Get the results of the frames whose every task is done, oldest
+        first
+
+        Args:
+            block (bool): Wait until at least one frame is done if any are
+                in flight
+
+        Returns:
+            [(FrameInfo, dictionary)]: The detections of each done frame.
+                The dictionary has the result of each task in TASKS.
+        """
+        if block and self._in_flight:
+            _, oldest_futures = next(iter(self._in_flight.values()))
+            wait(oldest_futures.values())
+
+        done = []
+        while self._in_flight:
+            frame_id, (info, futures) = next(iter(self._in_flight.items()))
+            if not all(future.done() for future in futures.values()):
+                break
+            del self._in_flight[frame_id]
+            done.append((info, {name: future.result()
+                                for name, future in futures.items()}))
+        return done
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+        self._ring.close()
@@ -0,0 +1,371 @@
+import itertools
+import json
+import time
+import numpy as np
+import cv2
+from cv2 import aruco
+from utils.aruco_utils import (
+    detect_markers, detector_parameters_from_dict,
+    detector_parameters_to_dict)
+from utils.buffer_arena import BufferArena
+from utils.ecore_utils import (
+    ITERATIONS, MIN_AREA_TO_DETECT, image_to_center_points_multi)
+from utils.object_tracker import assign
+from utils.synthetic_arena import random_arena, render_arena
+
+
+# Values of the aruco detector parameters to sweep. The parameters that
+# are not listed keep the values of the base parameters.
+ARUCO_GRID = {
+    'cornerRefinementMethod': [aruco.CORNER_REFINE_NONE,
+                               aruco.CORNER_REFINE_SUBPIX],
+    'cornerRefinementWinSize': [3, 5],
+    # Each adaptive threshold window size is a full thresholding and
+    # contour search of the frame, so the step sets the number of passes
+    'adaptiveThreshWinSizeStep': [4, 10, 20],
+    'minMarkerPerimeterRate': [0.01, 0.03],
+    'perspectiveRemovePixelPerCell': [2, 4],
+}
+ECORE_GRID = {
+    'iterations': [1, 2, 3],
+    'min_area': [250, 500, 1000, 2000],
+}
+# A detection further than this many pixels from the true position is
+# not counted as found
+MATCH_DISTANCE = 10.0
+# Marker sizes of the synthetic arenas in pixels, to see how small
+# markers each setting still finds
+SYNTHETIC_MARKER_SIZES = (40, 60, 80)
+# Standard deviation of the noise added to the synthetic frames
+SYNTHETIC_NOISE = 6.0
+WARMUP_FRAMES = 2
+CONFIG_VERSION = 1
+
+
+def grid_settings(grid):
+    """
+    Get every combination of the values of a grid
+
+    Args:
+        grid (dictionary): Parameter name to the list of its values
+
+    Returns:
+        [dictionary]: Parameter name to value for each combination
+    """
+    names = list(grid.keys())
+    return [dict(zip(names, values))
+            for values in itertools.product(*(grid[name] for name in names))]
+
+
+def synthetic_corpus(count, dictionary, color_ranges, marker_count,
+                     cores_per_class, noise=SYNTHETIC_NOISE, seed=0):
+    """
+    Render arenas with known marker and core positions. The frames are
+    blurred and noise is added so that the settings differ in recall.
+
+    Returns:
+        [(numpy array, dictionary)]: Frame and its truth, see
+            detections_to_truth
+    """
+    rng = np.random.default_rng(seed)
+    corpus = []
+    for index in range(count):
+        marker_size = SYNTHETIC_MARKER_SIZES[index %
+                                             len(SYNTHETIC_MARKER_SIZES)]
+        markers, cores = random_arena(rng, marker_count, color_ranges,
+                                      cores_per_class,
+                                      marker_size=marker_size)
+        frame = render_arena(markers, cores, dictionary,
+                             marker_size=marker_size)
+        frame = cv2.GaussianBlur(frame, (3, 3), 0)
+        if noise:
+            frame = np.clip(frame + rng.normal(0, noise, frame.shape),
+                            0, 255).astype(np.uint8)
+        # render_arena places the marker edges on pixel edges, so in the
+        # pixel center coordinates of the detections the markers are half
+        # a pixel up and left. The cores are drawn at whole pixels.
+        truth = {
+            'markers': {marker_id: np.array([x, y]) - 0.5
+                        for marker_id, x, y, _ in markers},
+            'cores': {name: np.round(np.array(points, dtype=np.float64)
+                                     .reshape(-1, 2))
+                      for name, (points, _) in cores.items()},
+        }
+        corpus.append((frame, truth))
+    return corpus
+
+
+def detections_to_truth(corners, ids, cores):
+    """
+    Use detections as the truth of a recorded frame
+
+    Returns:
+        dictionary
+            markers : marker id to its center [x, y]
+            cores : color class name to numpy array (N, 2) of centers
+    """
+    markers = {}
+    if ids is not None:
+        for marker_id, marker_corners in zip(ids.ravel(), corners):
+            markers[int(marker_id)] = \
+                marker_corners.reshape(4, 2).mean(axis=0)
+    return {
+        'markers': markers,
+        'cores': {name: np.array(points, dtype=np.float64).reshape(-1, 2)
+                  for name, points in cores.items()},
+    }
+
+
+def recorded_corpus(frames, dictionary, parameters, color_ranges,
+                    ecore_options=None):
+    """
+    Pair recorded frames with the detections of the given parameters as
+    their truth, so the recall and position error of the other settings
+    are relative to those parameters
+
+    Args:
+        ecore_options (dictionary, optional): Energy core settings of the
+            truth, e.g. from load_ecore_config, the defaults if not given
+    """
+    corpus = []
+    for frame in frames:
+        corners, ids, _ = detect_markers(frame, dictionary, parameters)
+        cores = image_to_center_points_multi(frame, color_ranges,
+                                             **(ecore_options or {}))
+        corpus.append((frame, detections_to_truth(corners, ids, cores)))
+    return corpus
+
+
+def match_points(truth, detected, max_distance=MATCH_DISTANCE):
+    """
+    Match detected points to the true points
+
+    Returns:
+        (int, [float]): Number of detections that match no true point and
+            the distances of the matched pairs
+    """
+    if not len(truth) or not len(detected):
+        return len(detected), []
+    distances = np.linalg.norm(truth[:, None, :] - detected[None, :, :],
+                               axis=2)
+    rows, cols = assign(distances, max_distance)
+    return len(detected) - len(rows), distances[rows, cols].tolist()
+
+
+def evaluate(corpus, detect):
+    """
+    Run a detection function over the corpus
+
+    Args:
+        corpus: Frames and their truth from synthetic_corpus or
+            recorded_corpus
+        detect (function): Called with a frame, returns the detected
+            points in the format of the truth, only the keys it detects
+
+    Returns : dictionary
+        recall : Fraction of the true objects found
+        position_error_px : Mean distance of the found objects from their
+            true positions, None if nothing was found
+        false_positives : Detections per frame that match nothing
+        mean_ms, p50_ms, p90_ms : Detection time per frame
+    """
+    for frame, _ in corpus[:WARMUP_FRAMES]:
+        detect(frame)
+
+    total = 0
+    false_positives = 0
+    distances = []
+    seconds = []
+    for frame, truth in corpus:
+        start = time.perf_counter()
+        detected = detect(frame)
+        seconds.append(time.perf_counter() - start)
+
+        for kind, detected_points in detected.items():
+            count, unmatched, matched = _score(truth[kind], detected_points,
+                                               by_id=kind == 'markers')
+            total += count
+            false_positives += unmatched
+            distances.extend(matched)
+
+    milliseconds = 1000 * np.asarray(seconds)
+    return {
+        'recall': len(distances) / total if total else 1.0,
+        'position_error_px': float(np.mean(distances)) if distances
+        else None,
+        'false_positives': false_positives / len(corpus),
+        'mean_ms': float(np.mean(milliseconds)),
+        'p50_ms': float(np.percentile(milliseconds, 50)),
+        'p90_ms': float(np.percentile(milliseconds, 90)),
+    }
+
+
+def _score(truth, detected, by_id):
+    """
+    Score the detections of one kind of a frame
+
+    Args:
+        truth (dictionary): Marker id to its center, or color class name
+            to the core centers
+        detected (dictionary): Same for the detections
+        by_id (bool): Match the detections by their marker id
+
+    Returns:
+        (int, int, [float]): Number of true objects, detections that
+            match nothing and the distances of the matched pairs
+    """
+    if by_id:
+        unmatched = 0
+        matched = []
+        for marker_id, point in detected.items():
+            true_point = truth.get(marker_id)
+            distance = np.inf if true_point is None \
+                else float(np.linalg.norm(point - true_point))
+            if distance > MATCH_DISTANCE:
+                unmatched += 1
+            else:
+                matched.append(distance)
+        return len(truth), unmatched, matched
+
+    count = 0
+    unmatched = 0
+    matched = []
+    for name, true_points in truth.items():
+        class_unmatched, class_matched = match_points(
+            true_points, detected.get(name, np.empty((0, 2))))
+        count += len(true_points)
+        unmatched += class_unmatched
+        matched.extend(class_matched)
+    return count, unmatched, matched
+
+
+def sweep_aruco(corpus, dictionary, base_parameters, grid=ARUCO_GRID):
+    """
+    Evaluate the marker detection with each setting of the grid
+
+    Returns:
+        [dictionary]: detector, settings and metrics of each setting
+    """
+    base_values = detector_parameters_to_dict(base_parameters)
+    arena = BufferArena()
+    results = []
+    for settings in grid_settings(grid):
+        parameters = detector_parameters_from_dict({**base_values,
+                                                    **settings})
+
+        def detect(frame):
+            corners, ids, _ = detect_markers(frame, dictionary, parameters,
+                                             arena)
+            return {'markers': detections_to_truth(corners, ids,
+                                                   {})['markers']}
+        results.append({
+            'detector': 'aruco',
+            'settings': settings,
+            'metrics': evaluate(corpus, detect),
+        })
+    return results
+
+
+def sweep_ecore(corpus, color_ranges, grid=ECORE_GRID):
+    """
+    Evaluate the energy core detection with each setting of the grid
+
+    Returns:
+        [dictionary]: detector, settings and metrics of each setting
+    """
+    arena = BufferArena()
+    results = []
+    for settings in grid_settings(grid):
+        def detect(frame):
+            cores = image_to_center_points_multi(frame, color_ranges,
+                                                 arena=arena, **settings)
+            return {'cores': {name: np.array(points, dtype=np.float64)
+                              .reshape(-1, 2)
+                              for name, points in cores.items()}}
+        results.append({
+            'detector': 'ecore',
+            'settings': settings,
+            'metrics': evaluate(corpus, detect),
+        })
+    return results
+
+
+def pareto_front(results):
+    """
+    Find the settings that no other setting beats in all of recall,
+    position error and median latency
+
+    Returns:
+        [dictionary]: The Pareto-optimal results, fastest first
+    """
+    def objectives(result):
+        metrics = result['metrics']
+        error = metrics['position_error_px']
+        # Smaller is better in each objective
+        return np.array([-metrics['recall'],
+                         np.inf if error is None else error,
+                         metrics['p50_ms']])
+
+    values = [objectives(result) for result in results]
+    front = []
+    for index, value in enumerate(values):
+        dominated = any(np.all(other <= value) and np.any(other < value)
+                        for other in values)
+        if not dominated:
+            front.append(results[index])
+    return sorted(front, key=lambda result: result['metrics']['p50_ms'])
+
+
+def save_config(path, result, base_parameters=None):
+    """
+    Save a sweep result as a config file for load_aruco_config or
+    load_ecore_config. The aruco configs hold all the detector parameters,
+    the base parameters overridden with the swept ones.
+    """
+    settings = result['settings']
+    if result['detector'] == 'aruco':
+        settings = {**detector_parameters_to_dict(base_parameters),
+                    **settings}
+    with open(path, 'w') as config_file:
+        json.dump({
+            'version': CONFIG_VERSION,
+            'detector': result['detector'],
+            'settings': settings,
+            'metrics': result['metrics'],
+        }, config_file, indent=2)
+
+
+def _load_config(path, detector):
+    with open(path) as config_file:
+        config = json.load(config_file)
+    if config.get('detector') != detector:
+        raise ValueError(f'{path} is not an {detector} config, got: '
+                         f'{config.get("detector")}')
+    return config['settings']
+
+
+def load_aruco_config(path):
+    """
+    Load the aruco detector parameters of a config file from
+    sweep_detector_params.py
+
+    Returns:
+        aruco.DetectorParameters
+    """
+    return detector_parameters_from_dict(_load_config(path, 'aruco'))
+
+
+def load_ecore_config(path):
+    """
+    Load the energy core detection settings of a config file from
+    sweep_detector_params.py
+
+    Returns:
+        dictionary: min_area and iterations keyword arguments for
+            image_to_center_points_multi
+    """
+    settings = _load_config(path, 'ecore')
+    return {
+        'min_area': settings.get('min_area', MIN_AREA_TO_DETECT),
+        'iterations': settings.get('iterations', ITERATIONS),
+    }
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import cv2
+import numpy as np
+
+
+PREVIEW_PORT = 8080
+PREVIEW_FPS = 5
+PREVIEW_SCALE = 0.5
+JPEG_QUALITY = 70
+BOUNDARY = 'preview-frame'
+
+
+class PreviewServer():
+    """
+    Serves downscaled and annotated preview images as a MJPEG stream over
+    HTTP at a low fixed rate. Open http://localhost:<port>/ in a browser.
+
+    The detection loop only hands the frame and its detections over with
+    publish. Downscaling, drawing and JPEG encoding happen in a background
+    thread so the preview never throttles the detection.
+    """
+    def __init__(self,
+                 port=PREVIEW_PORT,
+                 fps=PREVIEW_FPS,
+                 scale=PREVIEW_SCALE,
+                 host='127.0.0.1'):
+        self._interval = 1.0 / fps
+        self._scale = scale
+        self._last_publish = 0.0
+        self._pending = None
+        self._jpeg = None
+        self._jpeg_number = 0
+        self._condition = threading.Condition()
+        self._running = True
+
+        self._encoder = threading.Thread(target=self._encode_loop,
+                                         daemon=True)
+        self._encoder.start()
+
+        self._server = ThreadingHTTPServer((host, port),
+                                           self._handler_class())
+        self._server.daemon_threads = True
+        self._server_thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True)
+        self._server_thread.start()
+
+    def publish(self, frame, annotate=None):
+        """
+        Offer a frame for the preview. Frames offered faster than the
+        preview rate are ignored. The encoder thread gets a copy of the
+        frame, so the caller may draw on the frame or reuse its buffer
+        right away. Only the frames taken for the preview are copied.
+
+        Args:
+            frame (numpy array): BGR image
+            annotate (function, optional): Called from the encoder thread
+                with the downscaled image and the scale to draw the
+                detections on it
+        """
+        now = time.monotonic()
+        if now - self._last_publish < self._interval:
+            return
+        self._last_publish = now
+        with self._condition:
+            self._pending = (np.copy(frame), annotate)
+            self._condition.notify_all()
+
+    def stop(self):
+        self._running = False
+        with self._condition:
+            self._condition.notify_all()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _encode_loop(self):
+        while self._running:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._pending is not None or not self._running)
+                if not self._running:
+                    return
+                frame, annotate = self._pending
+                self._pending = None
+
+            image = cv2.resize(frame, None, fx=self._scale, fy=self._scale,
+                               interpolation=cv2.INTER_AREA)
+            if annotate is not None:
+                annotate(image, self._scale)
+            ok, jpeg = cv2.imencode('.jpg', image,
+                                    [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+            if not ok:
+                continue
+
+            with self._condition:
+                self._jpeg = jpeg.tobytes()
+                self._jpeg_number += 1
+                self._condition.notify_all()
+
+    def _next_jpeg(self, last_number):
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._jpeg_number > last_number or
+                not self._running)
+            return self._jpeg, self._jpeg_number
+
+    def _handler_class(self):
+        preview = self
+
+        class PreviewHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 f'multipart/x-mixed-replace; '
+                                 f'boundary={BOUNDARY}')
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+
+                number = 0
+                try:
+                    while preview._running:
+                        jpeg, number = preview._next_jpeg(number)
+                        if jpeg is None:
+                            continue
+                        self.wfile.write(
+                            f'--{BOUNDARY}\r\n'
+                            f'Content-Type: image/jpeg\r\n'
+                            f'Content-Length: {len(jpeg)}\r\n\r\n'
+                            .encode())
+                        self.wfile.write(jpeg)
+                        self.wfile.write(b'\r\n')
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return PreviewHandler
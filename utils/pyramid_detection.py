@@ -0,0 +1,230 @@
+import time
+import numpy as np
+import cv2
+from cv2 import aruco
+from utils.ecore_utils import (
+    MIN_AREA_TO_DETECT, ITERATIONS, BLOB_LEFT, BLOB_TOP, BLOB_WIDTH,
+    BLOB_HEIGHT, blur_and_hsv, build_color_lut, label_colors, label_to_mask,
+    find_blobs, image_to_center_points_multi)
+from utils.aruco_utils import image_to_gray
+
+
+# Scale of the downscaled detection frame. 0.5 makes a 1232x1232 frame
+# 616x616 which is a quarter of the pixels.
+PYRAMID_SCALE = 0.5
+# Padding in full resolution pixels around a core's candidate box
+REFINE_PADDING = 8
+
+
+def downscale(image, scale, arena=None, name='downscaled'):
+    dst = None
+    if arena is not None:
+        height, width = image.shape[:2]
+        dst = arena.get(name, (round(height * scale), round(width * scale)) +
+                        image.shape[2:])
+    return cv2.resize(image, None, dst=dst, fx=scale, fy=scale,
+                      interpolation=cv2.INTER_AREA)
+
+
+def _to_full_resolution(points, scale):
+    # Pixel centers are at +0.5 so scale around them
+    return (points + 0.5) / scale - 0.5
+
+
+def detect_markers_pyramid(image, dictionary, parameters,
+                           scale=PYRAMID_SCALE, arena=None):
+    """
+    Detect aruco markers from a downscaled image and refine the corners
+    with subpixel accuracy from the full resolution image.
+
+    Args:
+        image (numpy array): Full resolution BGR image
+        dictionary: Aruco dictionary
+        parameters: Aruco detector parameters. The corner refinement
+            window size, max iterations and min accuracy are used for the
+            full resolution refinement.
+        scale (float): Scale of the detection image
+        arena (BufferArena, optional): Arena for the image buffers
+
+    Returns:
+        Same as aruco.detectMarkers: corners, ids and rejected image
+        points in full resolution coordinates
+    """
+    gray = image_to_gray(image, arena)
+    corners, ids, rejected = aruco.detectMarkers(
+        downscale(gray, scale, arena, 'downscaled_gray'),
+        dictionary,
+        parameters=parameters)
+    rejected = [_to_full_resolution(points, scale) for points in rejected]
+    if ids is None:
+        return corners, ids, rejected
+
+    points = _to_full_resolution(
+        np.concatenate(corners).reshape(-1, 1, 2), scale).astype(np.float32)
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT,
+                parameters.cornerRefinementMaxIterations,
+                parameters.cornerRefinementMinAccuracy)
+    win_size = parameters.cornerRefinementWinSize
+    cv2.cornerSubPix(gray, points, (win_size, win_size), (-1, -1), criteria)
+
+    corners = tuple(points.reshape(-1, 1, 4, 2))
+    return corners, ids, rejected
+
+
+def image_to_center_points_pyramid(orig_image, color_ranges,
+                                   scale=PYRAMID_SCALE, arena=None,
+                                   min_area=MIN_AREA_TO_DETECT,
+                                   iterations=ITERATIONS):
+    """
+    Find the objects of several color classes from a downscaled image and
+    refine their centers from the full resolution image inside the
+    candidate boxes only.
+
+    Args:
+        orig_image (numpy array): Full resolution BGR image
+        color_ranges ([(str, low_color, high_color)]): Name and low and
+            high HSV values for each color class
+        scale (float): Scale of the detection image
+        arena (BufferArena, optional): Arena for the downscaled image
+            buffers
+        min_area (int): Smallest object area in full resolution pixels
+        iterations (int): Erode and dilate iterations that clean up the
+            masks
+
+    Returns : dictionary
+        key : name of the color class : str
+        value : [[x, y]] center points in full resolution coordinates
+    """
+    lut = build_color_lut(color_ranges)
+    small_image = downscale(orig_image, scale, arena)
+    label_image = label_colors(blur_and_hsv(small_image, arena), lut, arena)
+    height, width = orig_image.shape[:2]
+
+    center_points = {}
+    for bit, (name, low_color, high_color) in enumerate(color_ranges):
+        # Erosion and dilation shrink with the image too so the smallest
+        # accepted area gets a bit more slack than scale squared
+        blobs = find_blobs(label_to_mask(label_image, bit, arena,
+                                         iterations),
+                           min_area * scale * scale * 0.8,
+                           arena)
+        points = []
+        for blob in blobs:
+            left = max(0, int(blob[BLOB_LEFT] / scale) - REFINE_PADDING)
+            top = max(0, int(blob[BLOB_TOP] / scale) - REFINE_PADDING)
+            right = min(width, int((blob[BLOB_LEFT] + blob[BLOB_WIDTH]) /
+                                   scale) + REFINE_PADDING)
+            bottom = min(height, int((blob[BLOB_TOP] + blob[BLOB_HEIGHT]) /
+                                     scale) + REFINE_PADDING)
+            center = _refine_center(orig_image[top:bottom, left:right],
+                                    low_color, high_color, min_area,
+                                    iterations)
+            if center is not None:
+                points.append([center[0] + left, center[1] + top])
+        center_points[name] = points
+
+    return center_points
+
+
+def _refine_center(image, low_color, high_color,
+                   min_area=MIN_AREA_TO_DETECT, iterations=ITERATIONS):
+    """
+    Get the centroid of the largest blob of the color in a small image
+    """
+    color_mask = cv2.inRange(blur_and_hsv(image), low_color, high_color)
+    color_mask = cv2.erode(color_mask, None, iterations=iterations)
+    color_mask = cv2.dilate(color_mask, None, iterations=iterations)
+    count, _, stats, centroids = cv2.connectedComponentsWithStats(color_mask)
+    if count < 2:
+        return None
+    largest = 1 + np.argmax(stats[1:, cv2.CC_STAT_AREA])
+    if stats[largest, cv2.CC_STAT_AREA] < min_area:
+        return None
+    return centroids[largest]
+
+
+def pyramid_accuracy_report(image, dictionary, parameters, color_ranges,
+                            scale=PYRAMID_SCALE):
+    """
+    Compare the pyramid detection to the full resolution detection.
+
+    Returns : dictionary
+        markers_baseline, markers_pyramid : Number of markers found
+        marker_corner_error_mean, marker_corner_error_max : Corner
+            distance in pixels for the markers found by both
+        cores_baseline, cores_pyramid : Number of cores found
+        core_center_error_mean, core_center_error_max : Distance in pixels
+            from each baseline core to the nearest pyramid core
+        baseline_ms, pyramid_ms : Time used by the detections
+    """
+    start = time.perf_counter()
+    base_corners, base_ids, _ = aruco.detectMarkers(
+        image, dictionary, parameters=parameters)
+    base_cores = image_to_center_points_multi(image, color_ranges)
+    baseline_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    corners, ids, _ = detect_markers_pyramid(image, dictionary, parameters,
+                                             scale)
+    cores = image_to_center_points_pyramid(image, color_ranges, scale)
+    pyramid_seconds = time.perf_counter() - start
+
+    corner_errors = []
+    if base_ids is not None and ids is not None:
+        found = dict(zip(ids[:, 0], corners))
+        for marker_id, base_marker_corners in zip(base_ids[:, 0],
+                                                  base_corners):
+            if marker_id in found:
+                corner_errors.append(np.linalg.norm(
+                    found[marker_id] - base_marker_corners, axis=-1).ravel())
+    corner_errors = np.concatenate(corner_errors) if corner_errors \
+        else np.empty(0)
+
+    core_errors = []
+    for name, base_points in base_cores.items():
+        if base_points and cores[name]:
+            distances = np.linalg.norm(
+                np.array(base_points, dtype=np.float64)[:, np.newaxis] -
+                np.array(cores[name])[np.newaxis], axis=-1)
+            core_errors.append(distances.min(axis=1))
+    core_errors = np.concatenate(core_errors) if core_errors \
+        else np.empty(0)
+
+    def mean_and_max(errors):
+        if not len(errors):
+            return 0.0, 0.0
+        return float(np.mean(errors)), float(np.max(errors))
+
+    corner_mean, corner_max = mean_and_max(corner_errors)
+    core_mean, core_max = mean_and_max(core_errors)
+    return {
+        'markers_baseline': 0 if base_ids is None else len(base_ids),
+        'markers_pyramid': 0 if ids is None else len(ids),
+        'marker_corner_error_mean': corner_mean,
+        'marker_corner_error_max': corner_max,
+        'cores_baseline': sum(len(points) for points in base_cores.values()),
+        'cores_pyramid': sum(len(points) for points in cores.values()),
+        'core_center_error_mean': core_mean,
+        'core_center_error_max': core_max,
+        'baseline_ms': 1000 * baseline_seconds,
+        'pyramid_ms': 1000 * pyramid_seconds,
+    }
+
+
+# Test the accuracy on an image by running
+# "python -m utils.pyramid_detection image.png" at the project root
+if __name__ == '__main__':
+    import sys
+    from detect_aruco_markers_from_image import \
+        ARUCO_DICT, ARUCO_DETECTER_PARAMETERS
+    from detect_energy_cores_from_image import ECORE_COLOR_RANGES
+
+    for report_scale in (0.5, 0.25):
+        report = pyramid_accuracy_report(cv2.imread(sys.argv[1]),
+                                         ARUCO_DICT,
+                                         ARUCO_DETECTER_PARAMETERS,
+                                         ECORE_COLOR_RANGES,
+                                         report_scale)
+        print(f'=== Scale {report_scale}')
+        for key, value in report.items():
+            print(f'{key}: {value}')
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+
+import threading
+import time
+import cv2
+import numpy as np
+from utils.frame_info import FrameInfo
+from utils.frame_log import FrameLog, FrameLogWriter
+
+
+class ReplayVideoSource():
+    """
+    Replays a frame log recorded with RecordingVideoSource.
+
+    At full speed every frame of the log is served once, as fast as the
+    frames are read. At real-time pace the frame served is the one whose
+    recorded capture time matches the time since the replay started, so
+    frames are skipped if the reader is slow like with a live camera.
+
+    The timestamp of the served frames is when the replay made the frame
+    available, so latencies measured from it are comparable with live
+    sources.
+    """
+    def __init__(self, path, realtime=False, loop=False):
+        self._log = FrameLog(path)
+        if not len(self._log):
+            raise ValueError(f'No frames in {path}')
+        self._realtime = realtime
+        self._loop = loop
+        self._last_index = -1
+        self._sequence = 0
+        self.seek(0)
+
+    def __len__(self):
+        return len(self._log)
+
+    def seek(self, index):
+        """
+        Continue the replay from the given frame index
+        """
+        self._last_index = index - 1
+        self._start_time = time.monotonic() - self._offset(index)
+
+    def frame(self, copy=True, out=None):
+        """
+        Get Frame
+        Args:
+            copy (bool): Return a copy of the frame. If false a read-only
+                view to the memory mapped log is returned.
+            out (numpy.array, optional): Copy the frame to this array
+                instead of allocating a new one
+        Returns : numpy.array(int8)
+            Image as a numpy array or None if the replay has ended
+        """
+        image, _ = self.latest_frame(copy, out)
+        return image
+
+    def latest_frame(self, copy=True, out=None):
+        """
+        Get the current frame and its sequence number and replay time
+        Args:
+            copy (bool): See frame
+        Returns : tuple
+            numpy.array(int8) : Image or None if the replay has ended
+            FrameInfo : Sequence number and timestamp or None
+        """
+        index = self._current_index()
+        if index is None:
+            return None, None
+        if index != self._last_index:
+            # Skipped frames advance the sequence number like with a live
+            # source so the reader can tell frames were dropped
+            self._sequence += max(1, index - self._last_index)
+            self._last_index = index
+
+        image = self._log.frame(index)
+        if out is not None:
+            np.copyto(out, image)
+            image = out
+        elif copy:
+            image = np.copy(image)
+        if self._realtime:
+            timestamp = self._start_time + self._offset(index)
+        else:
+            timestamp = time.monotonic()
+        return image, FrameInfo(self._sequence, timestamp)
+
+    def frame_available(self):
+        return self._current_index() is not None
+
+    @property
+    def ended(self):
+        """
+        True when the last frame of a replay that does not loop has been
+        served. Camera sources have no ended attribute and never end.
+        """
+        return not self._loop and self._last_index >= len(self._log) - 1
+
+    def wait_for_new_frame(self, timeout=None):
+        """
+        Wait until a frame newer than the last one returned by frame or
+        latest_frame is available
+        Args:
+            timeout (float): Seconds to wait or None to wait forever
+        Returns : boolean
+            true if a new frame is available otherwise false
+        """
+        next_index = self._last_index + 1
+        if next_index >= len(self._log):
+            if not self._loop:
+                return False
+            self.seek(0)
+            return True
+        if not self._realtime:
+            return True
+
+        wait = self._start_time + self._offset(next_index) - time.monotonic()
+        if timeout is not None and wait > timeout:
+            time.sleep(timeout)
+            return False
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+    def stop(self):
+        pass
+
+    def _offset(self, index):
+        return self._log.timestamps[index] - self._log.timestamps[0]
+
+    def _current_index(self):
+        """
+        Get the index of the frame to serve or None if the replay has
+        ended
+        """
+        if not self._realtime:
+            next_index = self._last_index + 1
+            if next_index < len(self._log):
+                return next_index
+            if not self._loop:
+                return None
+            self.seek(0)
+            return 0
+
+        index = self._log.index_at_time(time.monotonic() - self._start_time)
+        if index == len(self._log) - 1 and self._last_index == index:
+            # The last frame has been served
+            if not self._loop:
+                return None
+            self.seek(0)
+            return 0
+        return index
+
+
+class RecordingVideoSource():
+    """
+    Wraps a video source and appends every frame read through it to a
+    frame log with its sequence number and timestamp. The frames recorded
+    are exactly the frames the detection got from the source.
+    """
+    def __init__(self, source, path):
+        self._source = source
+        self._path = path
+        self._writer = None
+        self._last_sequence = 0
+        self._lock = threading.Lock()
+
+    def frame(self, copy=True, out=None):
+        image, _ = self.latest_frame(copy, out)
+        return image
+
+    def latest_frame(self, copy=True, out=None):
+        image, info = self._source.latest_frame(copy, out)
+        if info is not None and info.sequence != self._last_sequence:
+            self._last_sequence = info.sequence
+            with self._lock:
+                if self._writer is None:
+                    self._writer = FrameLogWriter(self._path, image.shape)
+                self._writer.append(image, info)
+        return image, info
+
+    def frame_available(self):
+        return self._source.frame_available()
+
+    @property
+    def ended(self):
+        return getattr(self._source, 'ended', False)
+
+    def wait_for_new_frame(self, timeout=None):
+        return self._source.wait_for_new_frame(timeout)
+
+    def stop(self):
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+        self._source.stop()
+
+
+# Replay a frame log at real-time pace by running
+# "python -m utils.replay_video_source recording.frames" at the project root
+if __name__ == '__main__':
+    import sys
+
+    video = ReplayVideoSource(sys.argv[1], realtime=True)
+
+    try:
+        while video.wait_for_new_frame(timeout=1.0):
+            frame = video.frame()
+            if frame is None:
+                break
+            cv2.imshow('frame', frame)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    except KeyboardInterrupt:
+        print("Closing")
+    finally:
+        video.stop()
+        print("Exiting")
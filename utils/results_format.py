@@ -0,0 +1,269 @@
+import time
+from collections import namedtuple
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+
+# Binary record of the detections of one frame. A record is the header
+# followed by marker_count markers and core_count cores, all little endian
+# with no padding between them, so other languages can read it with
+# fixed offsets.
+RECORD_MAGIC = 0x52534941  # b'AISR'
+RECORD_VERSION = 1
+HEADER_DTYPE = np.dtype([
+    ('magic', '<u4'),
+    ('version', '<u2'),
+    ('marker_count', '<u2'),
+    ('core_count', '<u2'),
+    # RECORD_TRUNCATED when the frame had more detections than fit
+    ('flags', '<u2'),
+    # FrameInfo.sequence and timestamp of the frame
+    ('sequence', '<i8'),
+    ('timestamp', '<f8'),
+    # time.monotonic() seconds when the record was published
+    ('publish_time', '<f8'),
+])
+# Same fields as aruco_utils.MARKER_DTYPE
+RECORD_MARKER_DTYPE = np.dtype([
+    ('id', '<i4'),
+    ('position', '<f4', (2,)),
+    ('rotation', '<f4', (3,)),
+])
+RECORD_CORE_DTYPE = np.dtype([
+    # Index of the color class in the class names of the publisher
+    ('class_index', '<u2'),
+    ('reserved', '<u2'),
+    ('position', '<f4', (2,)),
+])
+MAX_MARKERS = 64
+MAX_CORES = 128
+# Flag of a record that holds only the first MAX_MARKERS markers and
+# MAX_CORES cores of the frame
+RECORD_TRUNCATED = 1
+MAX_RECORD_SIZE = HEADER_DTYPE.itemsize + \
+    MAX_MARKERS * RECORD_MARKER_DTYPE.itemsize + \
+    MAX_CORES * RECORD_CORE_DTYPE.itemsize
+
+# Header of the shared memory slot that holds the latest record
+SLOT_HEADER_DTYPE = np.dtype([
+    # Odd while the record is being written, incremented before and after
+    # each write
+    ('version', '<u8'),
+    # Size of the record in bytes, 0 before the first record
+    ('size', '<u8'),
+])
+SLOT_HEADER_SIZE = 64
+# Times a reader retries when the record changes during the read
+SLOT_READ_ATTEMPTS = 100
+
+
+# A record read back by unpack_record
+#   sequence, timestamp, publish_time : from the header
+#   markers : numpy structured array of RECORD_MARKER_DTYPE
+#   cores : numpy structured array of RECORD_CORE_DTYPE
+#   truncated : True if the frame had more detections than the record
+ResultsRecord = namedtuple('ResultsRecord', ['sequence', 'timestamp',
+                                             'publish_time', 'markers',
+                                             'cores', 'truncated'])
+
+
+class RecordWriter():
+    """
+    Packs detections into records in one preallocated buffer, so packing
+    a frame allocates nothing. Detections beyond MAX_MARKERS markers and
+    MAX_CORES cores are left out and the record is flagged as truncated.
+    """
+    def __init__(self, class_names=()):
+        """
+        Args:
+            class_names ([str]): Names of the color classes in the order of
+                their class index
+        """
+        self._class_indexes = {name: index
+                               for index, name in enumerate(class_names)}
+        self._buffer = np.zeros(MAX_RECORD_SIZE, dtype=np.uint8)
+        self._header = self._buffer[:HEADER_DTYPE.itemsize].view(
+            HEADER_DTYPE)
+        self._header['magic'] = RECORD_MAGIC
+        self._header['version'] = RECORD_VERSION
+        self.truncated_count = 0
+
+    def pack(self, sequence, timestamp, publish_time, markers=None,
+             cores=None):
+        """
+        Args:
+            sequence, timestamp: FrameInfo of the frame
+            publish_time (float): time.monotonic() seconds
+            markers (numpy structured array of MARKER_DTYPE, optional)
+            cores (dictionary, optional): Color class name to the [[x, y]]
+                center points of its cores
+
+        Returns:
+            memoryview: The record. Valid until the next call to pack.
+        """
+        marker_count = 0 if markers is None else len(markers)
+        truncated = marker_count > MAX_MARKERS
+        marker_count = min(marker_count, MAX_MARKERS)
+        core_counts = []
+        core_count = 0
+        for name, points in ({} if cores is None else cores).items():
+            count = min(len(points), MAX_CORES - core_count)
+            truncated |= count < len(points)
+            core_counts.append((name, count))
+            core_count += count
+        if truncated:
+            self.truncated_count += 1
+
+        header = self._header
+        header['marker_count'] = marker_count
+        header['core_count'] = core_count
+        header['flags'] = RECORD_TRUNCATED if truncated else 0
+        header['sequence'] = sequence
+        header['timestamp'] = timestamp
+        header['publish_time'] = publish_time
+
+        offset = HEADER_DTYPE.itemsize
+        if marker_count:
+            end = offset + marker_count * RECORD_MARKER_DTYPE.itemsize
+            record_markers = self._buffer[offset:end].view(
+                RECORD_MARKER_DTYPE)
+            record_markers['id'] = markers['id'][:marker_count]
+            record_markers['position'] = markers['position'][:marker_count]
+            record_markers['rotation'] = markers['rotation'][:marker_count]
+            offset = end
+        for name, count in core_counts:
+            if not count:
+                continue
+            end = offset + count * RECORD_CORE_DTYPE.itemsize
+            record_cores = self._buffer[offset:end].view(RECORD_CORE_DTYPE)
+            record_cores['class_index'] = self._class_indexes[name]
+            record_cores['position'] = \
+                np.reshape(cores[name], (-1, 2))[:count]
+            offset = end
+        return memoryview(self._buffer[:offset])
+
+
+def unpack_record(data):
+    """
+    Read a record packed by RecordWriter
+
+    Args:
+        data (bytes-like): The record
+
+    Returns:
+        ResultsRecord: With copies of the markers and cores
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if len(buffer) < HEADER_DTYPE.itemsize:
+        raise ValueError(f'Record too short: {len(buffer)} bytes')
+    header = buffer[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)[0]
+    if header['magic'] != RECORD_MAGIC or \
+            header['version'] != RECORD_VERSION:
+        raise ValueError(f'Not a version {RECORD_VERSION} results record')
+
+    markers_start = HEADER_DTYPE.itemsize
+    cores_start = markers_start + \
+        int(header['marker_count']) * RECORD_MARKER_DTYPE.itemsize
+    end = cores_start + int(header['core_count']) * RECORD_CORE_DTYPE.itemsize
+    if end > len(buffer):
+        raise ValueError(f'Record truncated to {len(buffer)} bytes')
+    markers = buffer[markers_start:cores_start].view(
+        RECORD_MARKER_DTYPE).copy()
+    cores = buffer[cores_start:end].view(RECORD_CORE_DTYPE).copy()
+    return ResultsRecord(int(header['sequence']), float(header['timestamp']),
+                         float(header['publish_time']), markers, cores,
+                         bool(header['flags'] & RECORD_TRUNCATED))
+
+
+def cores_by_class(cores, class_names):
+    """
+    Group the cores of a record by their color class
+
+    Returns : dictionary
+        key : name of the color class : str
+        value : numpy array (N, 2) of center points
+    """
+    return {name: cores['position'][cores['class_index'] == index]
+            for index, name in enumerate(class_names)}
+
+
+class SharedResultsSlot():
+    """
+    The latest record of a publisher in named shared memory. Readers copy
+    the record whenever they want the newest results and never block the
+    publisher. The version in the header tells a reader whether the record
+    changed while it was copied, in which case it reads again.
+    """
+    def __init__(self, shm, owner):
+        self._shm = shm
+        self._owner = owner
+        self._header = np.ndarray(1, dtype=SLOT_HEADER_DTYPE, buffer=shm.buf)
+        self._record = np.ndarray(MAX_RECORD_SIZE, dtype=np.uint8,
+                                  buffer=shm.buf, offset=SLOT_HEADER_SIZE)
+
+    @classmethod
+    def create(cls, name):
+        """
+        Create the slot. A slot left behind by a publisher that crashed is
+        replaced.
+        """
+        size = SLOT_HEADER_SIZE + MAX_RECORD_SIZE
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True,
+                                             size=size)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True,
+                                             size=size)
+        slot = cls(shm, owner=True)
+        slot._header[0] = (0, 0)
+        return slot
+
+    @classmethod
+    def attach(cls, name):
+        shm = shared_memory.SharedMemory(name=name)
+        # Only the publisher may remove the shared memory, see
+        # SharedFrameRing.attach
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, owner=False)
+
+    @property
+    def version(self):
+        return int(self._header['version'][0])
+
+    def write(self, record):
+        """
+        Args:
+            record (bytes-like): Record from RecordWriter.pack
+        """
+        size = len(record)
+        self._header['version'] += 1
+        self._record[:size] = np.frombuffer(record, dtype=np.uint8)
+        self._header['size'] = size
+        self._header['version'] += 1
+
+    def read(self):
+        """
+        Returns:
+            (int, bytes): The version and a copy of the latest record, or
+                None if nothing has been published
+        """
+        for _ in range(SLOT_READ_ATTEMPTS):
+            version = self.version
+            if not version % 2:
+                size = int(self._header['size'][0])
+                record = self._record[:size].tobytes()
+                if self.version == version:
+                    return (version, record) if size else None
+            # Let the publisher finish the write
+            time.sleep(0)
+        raise RuntimeError('The results record kept changing while read')
+
+    def close(self):
+        self._header = None
+        self._record = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
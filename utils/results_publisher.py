@@ -0,0 +1,127 @@
+import socket
+import time
+from utils.results_format import RecordWriter, SharedResultsSlot
+
+
+# Name of the shared memory slot and the multicast port of the results.
+# Give each publishing process its own name and port.
+RESULTS_NAME = 'ai-simple-results'
+RESULTS_PORT = 5300
+# Administratively scoped multicast group. With the default time-to-live
+# of 0 the records never leave this computer.
+MULTICAST_GROUP = '239.255.42.1'
+MULTICAST_TTL = 0
+MULTICAST_INTERFACE = '127.0.0.1'
+
+
+class ResultsPublisher():
+    """
+    Publishes the detections of each frame as a compact binary record, see
+    utils/results_format.py, to any number of local processes. Each record
+    is sent as one UDP multicast datagram and written to a shared memory
+    slot that always holds the latest record. Read them with
+    utils/results_reader.py.
+
+    Publishing packs the record into a preallocated buffer and never
+    blocks. Printing the detections is an optional debug sink that runs
+    at most every print_interval seconds.
+    """
+    def __init__(self, name=RESULTS_NAME, port=RESULTS_PORT,
+                 class_names=(), group=MULTICAST_GROUP,
+                 interface=MULTICAST_INTERFACE, ttl=MULTICAST_TTL,
+                 multicast=True, shared_memory=True, print_interval=None,
+                 print_function=None):
+        """
+        Args:
+            name (str): Name of the shared memory slot
+            port (int): UDP port of the multicast group
+            class_names ([str]): Names of the energy core color classes in
+                the order of their class index in the records
+            interface (str): Address of the interface to send from,
+                loopback by default
+            ttl (int): Multicast time-to-live, 0 keeps the records on
+                this computer
+            multicast (bool): Send the records over UDP multicast
+            shared_memory (bool): Write the records to shared memory
+            print_interval (float, optional): Print the detections at most
+                this often, None to never print
+            print_function (function, optional): Called with the markers
+                and the cores to print them, print by default
+        """
+        self._writer = RecordWriter(class_names)
+        self._destination = (group, port)
+        self._print_interval = print_interval
+        self._print_function = print_function or _print_detections
+        self._last_print = 0.0
+
+        self._sock = None
+        if multicast:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._sock.setblocking(False)
+            self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL,
+                                  ttl)
+            self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                                  socket.inet_aton(interface))
+        self._slot = SharedResultsSlot.create(name) if shared_memory \
+            else None
+
+        self.published_count = 0
+        # Datagrams that could not be sent because the socket buffer was
+        # full or the group was not reachable
+        self.failed_count = 0
+
+    def publish(self, frame_info, markers=None, cores=None):
+        """
+        Publish the detections of a frame
+
+        Args:
+            frame_info (FrameInfo): Sequence number and timestamp of the
+                frame, or None if the source does not give them
+            markers (numpy structured array of MARKER_DTYPE, optional)
+            cores (dictionary, optional): Color class name to the [[x, y]]
+                center points of its cores
+        """
+        now = time.monotonic()
+        sequence, timestamp = (self.published_count + 1, now) \
+            if frame_info is None else frame_info[:2]
+        record = self._writer.pack(sequence, timestamp, now, markers, cores)
+        if self._sock is not None:
+            try:
+                self._sock.sendto(record, self._destination)
+            except OSError:
+                self.failed_count += 1
+        if self._slot is not None:
+            self._slot.write(record)
+        self.published_count += 1
+
+        if self._print_interval is not None and \
+                now - self._last_print >= self._print_interval:
+            self._last_print = now
+            self._print_function(markers, cores)
+
+    def stats(self):
+        return {
+            'published': self.published_count,
+            'failed': self.failed_count,
+            'truncated': self._writer.truncated_count,
+        }
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        if self._slot is not None:
+            self._slot.close()
+            self._slot = None
+
+
+def _print_detections(markers, cores):
+    if markers is not None:
+        for marker in markers:
+            print(f'Aruco {marker["id"]}: '
+                  f'X: {marker["position"][0]:.2f}, '
+                  f'Y: {marker["position"][1]:.2f}, '
+                  f'Rotation: {marker["rotation"][2]:.2f} Degrees')
+    if cores is not None:
+        for name, points in cores.items():
+            print(f'{name} cores: {[list(point) for point in points]}')
@@ -0,0 +1,143 @@
+"""
+Read the detection results that ResultsPublisher publishes. Needs only
+NumPy and the standard library.
+
+Test this by running "python -m utils.results_reader" at the project
+root while a detection script publishes its results.
+"""
+import argparse
+import socket
+import time
+from utils.results_format import (
+    SharedResultsSlot, cores_by_class, unpack_record)
+from utils.results_publisher import (
+    MULTICAST_GROUP, MULTICAST_INTERFACE, RESULTS_NAME, RESULTS_PORT)
+
+
+# Seconds between the checks for a new record in SharedResultsReader.wait
+POLL_INTERVAL = 0.002
+# Receive buffer for the datagrams, larger than the largest record
+RECEIVE_BUFFER_SIZE = 65536
+
+
+class MulticastResultsReader():
+    """
+    Receives every record published over UDP multicast. Any number of
+    readers can join the same group.
+    """
+    def __init__(self, port=RESULTS_PORT, group=MULTICAST_GROUP,
+                 interface=MULTICAST_INTERFACE):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(('', port))
+        self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                              socket.inet_aton(group) +
+                              socket.inet_aton(interface))
+        self.invalid_count = 0
+
+    def read(self, timeout=None):
+        """
+        Wait for the next record
+
+        Args:
+            timeout (float): Seconds to wait or None to wait forever
+
+        Returns:
+            ResultsRecord or None if no record arrived in time
+        """
+        self._sock.settimeout(timeout)
+        while True:
+            try:
+                data = self._sock.recv(RECEIVE_BUFFER_SIZE)
+            except socket.timeout:
+                return None
+            try:
+                return unpack_record(data)
+            except ValueError:
+                self.invalid_count += 1
+
+    def close(self):
+        self._sock.close()
+
+
+class SharedResultsReader():
+    """
+    Reads the latest record from the shared memory slot of a publisher.
+    Records published between two reads are skipped, so a slow reader
+    always gets the newest results.
+    """
+    def __init__(self, name=RESULTS_NAME):
+        self._slot = SharedResultsSlot.attach(name)
+        self._last_version = 0
+
+    def latest(self):
+        """
+        Returns:
+            ResultsRecord or None if nothing has been published
+        """
+        result = self._slot.read()
+        if result is None:
+            return None
+        self._last_version, record = result
+        return unpack_record(record)
+
+    def wait(self, timeout=None):
+        """
+        Wait for a record newer than the last one returned
+
+        Args:
+            timeout (float): Seconds to wait or None to wait forever
+
+        Returns:
+            ResultsRecord or None if no new record arrived in time
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._slot.version <= self._last_version:
+            if deadline is not None and time.monotonic() > deadline:
+                return None
+            time.sleep(POLL_INTERVAL)
+        return self.latest()
+
+    def close(self):
+        self._slot.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--name', default=RESULTS_NAME,
+                        help='Shared memory slot to read')
+    parser.add_argument('--port', type=int, default=RESULTS_PORT,
+                        help='Multicast port to read')
+    parser.add_argument('--multicast', action='store_true',
+                        help='Read the multicast records instead of the '
+                             'shared memory')
+    parser.add_argument('--classes', default='Positive,Negative',
+                        help='Comma separated names of the core classes')
+    args = parser.parse_args()
+
+    reader = MulticastResultsReader(args.port) if args.multicast \
+        else SharedResultsReader(args.name)
+    class_names = args.classes.split(',')
+    try:
+        while True:
+            record = reader.read(timeout=1.0) if args.multicast \
+                else reader.wait(timeout=1.0)
+            if record is None:
+                print("No results")
+                continue
+            latency = time.monotonic() - record.timestamp
+            core_counts = {name: len(points) for name, points
+                           in cores_by_class(record.cores,
+                                             class_names).items()}
+            print(f'Frame {record.sequence}, {latency * 1000:.1f} ms old: '
+                  f'markers {record.markers["id"].tolist()}, '
+                  f'cores {core_counts}'
+                  f'{" (truncated)" if record.truncated else ""}')
+    except KeyboardInterrupt:
+        print("Closing")
+    finally:
+        reader.close()
+
+
+if __name__ == '__main__':
+    main()
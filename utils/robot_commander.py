@@ -0,0 +1,141 @@
+import socket
+import time
+from utils.latency import GLASS_TO_COMMAND, get_latency_stats
+
+
+# Commands to a robot are sent at most this often
+MAX_SEND_RATE_HZ = 30
+
+
+class RobotCommander():
+    """
+    Sends track speed commands to the robots running the ai-robot-udp
+    firmware over one non-blocking UDP socket.
+
+    Commands are only stored by set_speeds. flush sends the latest
+    command of each robot, so a robot that got many commands between
+    flushes gets only the newest one, and a robot is sent to at most
+    max_send_rate_hz times per second. Commands held back by the rate
+    limit stay pending; a pending command replaced by a newer one is
+    counted as dropped. Sends that fail, e.g. because the socket buffer
+    is full or the robot network is down, are counted as failed and do
+    not stop the caller.
+
+    Commands given the capture timestamp of the frame they are based on
+    record the time from the capture to sending the command as the
+    glass-to-command latency.
+    """
+    def __init__(self, max_send_rate_hz=MAX_SEND_RATE_HZ,
+                 latency_stats=None):
+        self._min_interval = 1.0 / max_send_rate_hz
+        self._glass_to_command = (latency_stats or get_latency_stats()) \
+            .histogram(GLASS_TO_COMMAND)
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setblocking(False)
+
+        # Robot name to (ip, port)
+        self._endpoints = {}
+        # Robot name to the latest unsent command
+        self._pending = {}
+        self._last_sent = {}
+        self.sent_count = 0
+        self.dropped_count = 0
+        # Sends that failed, e.g. because the socket buffer was full or
+        # the robot was unreachable
+        self.failed_count = 0
+
+    def add_robot(self, name, ip, port):
+        self._endpoints[name] = (ip, port)
+        self._last_sent.setdefault(name, 0.0)
+
+    def remove_robot(self, name):
+        self._endpoints.pop(name, None)
+        self._pending.pop(name, None)
+        self._last_sent.pop(name, None)
+
+    @property
+    def robots(self):
+        return list(self._endpoints.keys())
+
+    def set_speeds(self, name, left, right, timestamp=None):
+        """
+        Set the track speeds to send to the robot on the next flush
+
+        Args:
+            name: Name of the robot given to add_robot
+            left (int): Left track speed from -100 to 100
+            right (int): Right track speed from -100 to 100
+            timestamp (float, optional): FrameInfo.timestamp of the frame
+                the command is based on
+        """
+        if name not in self._endpoints:
+            raise KeyError(f'Unknown robot: {name}')
+        if name in self._pending:
+            self.dropped_count += 1
+        self._pending[name] = (int(left), int(right), timestamp)
+
+    def flush(self, now=None):
+        """
+        Send the latest command of each robot whose rate limit allows it.
+        Commands held back by the rate limit stay pending and are
+        replaced if a newer command is set before the next flush.
+
+        Returns:
+            int: Number of commands sent
+        """
+        if now is None:
+            now = time.monotonic()
+        sent = 0
+        for name in list(self._pending.keys()):
+            if now - self._last_sent[name] < self._min_interval:
+                continue
+            left, right, timestamp = self._pending.pop(name)
+            try:
+                self._sock.sendto(f'{left};{right}'.encode('utf-8'),
+                                  self._endpoints[name])
+            except OSError:
+                self.failed_count += 1
+                continue
+            if timestamp is not None:
+                self._glass_to_command.record(time.monotonic() - timestamp)
+            self._last_sent[name] = now
+            sent += 1
+        self.sent_count += sent
+        return sent
+
+    def stop_all(self):
+        """
+        Send a zero speed command to all robots right away
+        """
+        for name, endpoint in self._endpoints.items():
+            self._pending.pop(name, None)
+            try:
+                self._sock.sendto(b'0;0', endpoint)
+                self.sent_count += 1
+            except OSError:
+                self.failed_count += 1
+
+    def stats(self):
+        return {
+            'sent': self.sent_count,
+            'dropped': self.dropped_count,
+            'failed': self.failed_count,
+            'pending': len(self._pending),
+        }
+
+    def close(self):
+        self._sock.close()
+
+
+_commander = None
+
+
+def get_commander():
+    """
+    Get the process wide commander so that the whole process uses the
+    same socket
+    """
+    global _commander
+    if _commander is None:
+        _commander = RobotCommander()
+    return _commander
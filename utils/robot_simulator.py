@@ -0,0 +1,332 @@
+import selectors
+import socket
+import threading
+import time
+import numpy as np
+from cv2 import aruco
+from utils.arena_mapping import DEFAULT_CORNER_MARKERS
+from utils.frame_slots import FrameSlots
+from utils.synthetic_arena import (
+    CORE_RADIUS, IMAGE_HEIGHT, IMAGE_WIDTH, MARKER_BORDER, MARKER_SIZE,
+    hsv_range_to_bgr, render_arena)
+
+
+ROBOT_COUNT = 1
+# The robots listen on consecutive ports from this one like robots running
+# the ai-robot-udp firmware at robot_loop.py's default address
+FIRST_PORT = 3001
+HOST = '127.0.0.1'
+FPS = 30
+CORES_PER_CLASS = 3
+# Pixels per second a track moves at speed 100
+MAX_TRACK_SPEED = 300.0
+# Distance between the tracks in pixels
+TRACK_WIDTH = 100.0
+ARUCO_DICT = aruco.Dictionary_get(aruco.DICT_4X4_50)
+
+
+def parse_command(message):
+    """
+    Parse a "left;right" track speed message like the firmware does
+
+    Returns:
+        (int, int) or None: Track speeds clamped to -100..100, or None if
+            the message is not a command
+    """
+    try:
+        left, right = message.decode('utf-8').split(';')
+        left, right = int(float(left)), int(float(right))
+    except (UnicodeDecodeError, ValueError):
+        return None
+    return (max(-100, min(100, left)), max(-100, min(100, right)))
+
+
+class RobotSimulator():
+    """
+    Simulated arena with differential drive robots that take the same UDP
+    track speed commands as the robots running the ai-robot-udp firmware.
+    Each robot listens on its own port. The robots carry aruco markers and
+    drive over energy cores, which then reappear at a random place, so
+    robot_loop.py style control loops can be run against any number of
+    robots without the hardware.
+
+    The robots do not collide with each other, only with the arena walls.
+    """
+    def __init__(self, robot_count=ROBOT_COUNT, color_ranges=(),
+                 cores_per_class=CORES_PER_CLASS, first_port=FIRST_PORT,
+                 host=HOST, corner_markers=DEFAULT_CORNER_MARKERS,
+                 width=IMAGE_WIDTH, height=IMAGE_HEIGHT,
+                 marker_size=MARKER_SIZE, max_track_speed=MAX_TRACK_SPEED,
+                 track_width=TRACK_WIDTH, dictionary=ARUCO_DICT, seed=0):
+        """
+        Args:
+            robot_count (int): Number of robots. Their marker ids are the
+                smallest ids not used by the corner markers.
+            color_ranges ([(str, low_color, high_color)]): Color classes
+                of the energy cores, drawn in the middle of their range
+            cores_per_class (int): Energy cores of each color class
+            first_port (int): UDP port of the first robot
+            corner_markers (dictionary, optional): Corner marker id to its
+                arena position, drawn at the corners of the image for
+                ArenaMapper. None to draw no corner markers.
+            max_track_speed (float): Pixels per second at speed 100
+            track_width (float): Distance between the tracks in pixels
+            seed (int): Seed of the random placement
+        """
+        self._rng = np.random.default_rng(seed)
+        self._dictionary = dictionary
+        self._width = width
+        self._height = height
+        self._marker_size = marker_size
+        self._max_track_speed = max_track_speed
+        self._track_width = track_width
+        # Keep the whole bordered marker inside the image
+        self._margin = (marker_size + 2 * MARKER_BORDER) * 0.75
+
+        self._corner_markers = self._place_corner_markers(corner_markers)
+        used_ids = {marker_id for marker_id, _, _, _ in self._corner_markers}
+        free_ids = [marker_id
+                    for marker_id in range(len(dictionary.bytesList))
+                    if marker_id not in used_ids]
+        if robot_count > len(free_ids):
+            raise ValueError(f'Only {len(free_ids)} marker ids are free for '
+                             f'the robots, got {robot_count} robots')
+        self.marker_ids = free_ids[:robot_count]
+        self.ports = [first_port + index for index in range(robot_count)]
+
+        self.positions = self._random_positions(robot_count)
+        self.headings = self._rng.uniform(-180, 180, robot_count)
+        # Latest left and right track speed of each robot
+        self.speeds = np.zeros((robot_count, 2))
+        self.commands_received = np.zeros(robot_count, dtype=np.int64)
+        self.invalid_commands = 0
+
+        self._core_colors = {name: hsv_range_to_bgr(low_color, high_color)
+                             for name, low_color, high_color in color_ranges}
+        self.cores = {name: self._random_positions(cores_per_class)
+                      for name in self._core_colors}
+        self.cores_collected = {name: 0 for name in self._core_colors}
+        self._last_step = None
+
+        self._selector = selectors.DefaultSelector()
+        self._sockets = []
+        for index, port in enumerate(self.ports):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            sock.bind((host, port))
+            self._selector.register(sock, selectors.EVENT_READ, index)
+            self._sockets.append(sock)
+
+    def receive_commands(self):
+        """
+        Read all the commands that have arrived without blocking. Only the
+        newest command of each robot has an effect.
+        """
+        for key, _ in self._selector.select(timeout=0):
+            while True:
+                try:
+                    message = key.fileobj.recv(64)
+                except BlockingIOError:
+                    break
+                command = parse_command(message)
+                if command is None:
+                    self.invalid_commands += 1
+                    continue
+                self.speeds[key.data] = command
+                self.commands_received[key.data] += 1
+
+    def step(self, now=None):
+        """
+        Receive the commands and move the robots to their positions at the
+        given time
+
+        Args:
+            now (float, optional): time.monotonic() seconds
+        """
+        if now is None:
+            now = time.monotonic()
+        self.receive_commands()
+        dt = 0.0 if self._last_step is None else now - self._last_step
+        self._last_step = now
+        if not dt or not len(self.positions):
+            return
+
+        left = self.speeds[:, 0] / 100 * self._max_track_speed
+        right = self.speeds[:, 1] / 100 * self._max_track_speed
+        # The y axis of the image points down, so a faster left track turns
+        # the robot clockwise in the image, which is a positive rotation
+        turn_rate = np.degrees((left - right) / self._track_width)
+        # Drive along the heading at the middle of the step
+        heading = np.radians(self.headings + turn_rate * dt / 2)
+        speed = (left + right) / 2
+        self.positions[:, 0] += speed * np.cos(heading) * dt
+        self.positions[:, 1] += speed * np.sin(heading) * dt
+        np.clip(self.positions[:, 0], self._margin,
+                self._width - self._margin, out=self.positions[:, 0])
+        np.clip(self.positions[:, 1], self._margin,
+                self._height - self._margin, out=self.positions[:, 1])
+        self.headings = (self.headings + turn_rate * dt + 180) % 360 - 180
+
+        self._collect_cores()
+
+    def render(self, image=None):
+        """
+        Draw the arena as a top-down camera would see it
+
+        Args:
+            image (numpy array, optional): Image to draw to
+
+        Returns:
+            numpy array: BGR image
+        """
+        markers = self._corner_markers + [
+            (marker_id, x, y, heading) for marker_id, (x, y), heading
+            in zip(self.marker_ids, self.positions.tolist(),
+                   self.headings.tolist())]
+        cores = {name: (points.tolist(), self._core_colors[name])
+                 for name, points in self.cores.items()}
+        return render_arena(markers, cores, self._dictionary,
+                            width=self._width, height=self._height,
+                            marker_size=self._marker_size, image=image)
+
+    def stats(self):
+        return {
+            'robots': len(self.marker_ids),
+            'commands_received': int(self.commands_received.sum()),
+            'invalid_commands': self.invalid_commands,
+            'cores_collected': dict(self.cores_collected),
+        }
+
+    def close(self):
+        self._selector.close()
+        for sock in self._sockets:
+            sock.close()
+        self._sockets = []
+
+    def _collect_cores(self):
+        """
+        Move the cores a robot has driven over to a new random place
+        """
+        reach = self._marker_size / 2 + CORE_RADIUS
+        for name, points in self.cores.items():
+            if not len(points) or not len(self.positions):
+                continue
+            offsets = points[:, None, :] - self.positions[None, :, :]
+            collected = (np.hypot(offsets[..., 0], offsets[..., 1]) <
+                         reach).any(axis=1)
+            count = int(collected.sum())
+            if count:
+                points[collected] = self._random_positions(count)
+                self.cores_collected[name] += count
+
+    def _random_positions(self, count):
+        low = (self._margin, self._margin)
+        high = (self._width - self._margin, self._height - self._margin)
+        return self._rng.uniform(low, high, size=(count, 2))
+
+    def _place_corner_markers(self, corner_markers):
+        """
+        Place the corner markers in the image so that the arena positions
+        map linearly to the image inside the margin
+        """
+        if not corner_markers:
+            return []
+        positions = np.array(list(corner_markers.values()), dtype=np.float64)
+        low = positions.min(axis=0)
+        extent = np.maximum(positions.max(axis=0) - low, 1e-9)
+        scale = np.array([self._width, self._height]) - 2 * self._margin
+        pixels = self._margin + (positions - low) / extent * scale
+        return [(marker_id, float(x), float(y), 0.0)
+                for marker_id, (x, y) in zip(corner_markers, pixels)]
+
+
+class SimulatorVideoSource():
+    """
+    Video source that renders the frames of a RobotSimulator at a fixed
+    frame rate in a background thread, like a camera above the arena.
+    The robots are moved to the capture time of each frame before it is
+    rendered, so the FrameInfo timestamps are exact and the latency stats
+    of a control loop measure only its own latency.
+    """
+    def __init__(self, simulator=None, fps=FPS):
+        """
+        Args:
+            simulator (RobotSimulator, optional): One robot and no energy
+                cores by default
+            fps (float): Frames rendered per second
+        """
+        self.simulator = simulator or RobotSimulator()
+        self._frame_interval = 1 / fps
+
+        self._slots = FrameSlots()
+        # Frames that were rendered later than their capture time
+        self.late_frames = 0
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def frame(self, copy=True, out=None):
+        """
+        Get Frame
+        Args:
+            copy (bool): Return a copy of the frame. If false a read-only
+                view is returned. The view stays valid until the next call
+                to frame or latest_frame.
+            out (numpy.array, optional): Copy the frame to this array
+                instead of allocating a new one
+        Returns : numpy.array(int8)
+            Image as a numpy array or None if no frame has been rendered
+        """
+        image, _ = self.latest_frame(copy, out)
+        return image
+
+    def latest_frame(self, copy=True, out=None):
+        """
+        Get the latest frame and its sequence number and capture time,
+        see FrameSlots.latest_frame
+        """
+        return self._slots.latest_frame(copy, out)
+
+    def frame_available(self):
+        """
+        Check if frame is available
+        Returns : boolean
+            true if frame is available otherwise false
+        """
+        return self._slots.frame_available()
+
+    def wait_for_new_frame(self, timeout=None):
+        """
+        Wait until a frame newer than the last one returned by frame or
+        latest_frame has been rendered
+        Args:
+            timeout (float): Seconds to wait or None to wait forever
+        Returns : boolean
+            true if a new frame is available otherwise false
+        """
+        return self._slots.wait_for_new_frame(timeout)
+
+    def stop(self):
+        self._running = False
+        self._thread.join()
+        self.simulator.close()
+
+    def _run(self):
+        slots = self._slots
+        next_frame = time.monotonic()
+        while self._running:
+            delay = next_frame - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -self._frame_interval:
+                # Rendering can not keep up, skip the missed frames
+                self.late_frames += 1
+                next_frame = time.monotonic()
+            timestamp = time.monotonic()
+            next_frame += self._frame_interval
+
+            self.simulator.step(timestamp)
+            slots.images[slots.free_slot] = self.simulator.render(
+                slots.images[slots.free_slot])
+            slots.publish(timestamp, time.monotonic())
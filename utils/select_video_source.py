@@ -1,28 +1,72 @@
-import cv2
+def select_video_source(selection, replay_file=None, record_file=None,
+                        realtime=True):
+    """
+    Create the video source and a function to get the latest image from it.
+    See create_video_source for the arguments.
 
+    The image is copied to the same buffer on every call, so it is valid
+    only until the next call. The source is get_image.source. Stop it when
+    done so that a recording is closed, and check its ended attribute, if
+    it has one, when get_image returns None to see if a replay or the
+    capture daemon has ended.
+    """
+    image_source = create_video_source(selection, replay_file, record_file,
+                                       realtime)
+    buffer = None
 
-def select_video_source(selection):
+    def get_image():
+        nonlocal buffer
+        if buffer is None:
+            image = image_source.frame()
+            buffer = image
+            return image
+        return image_source.frame(out=buffer)
+    get_image.source = image_source
+    return get_image
+
+
+def create_video_source(selection, replay_file=None, record_file=None,
+                        realtime=True):
+    """
+    Create the video source object
+
+    Args:
+        selection (str): 'gstreamer', 'webcam', 'ffmpeg', 'replay',
+            'shared' to read the frames of run_capture_daemon.py or
+            'simulator' to render the frames of simulated robots that take
+            commands on the ports from utils.robot_simulator.FIRST_PORT
+        replay_file (str): Frame log to replay with the 'replay' source
+        record_file (str): Record the frames read from the source to this
+            frame log
+        realtime (bool): Replay at the recorded pace instead of full speed
+    """
     if selection == 'gstreamer':
         from utils.gstreamer_video_source import GStreamerVideoSource
         image_source = GStreamerVideoSource()
-
-        def get_image():
-            return image_source.frame()
-        return get_image
     elif selection == 'webcam':
-        cap = cv2.VideoCapture(0)
-
-        def get_image():
-            ret, frame = cap.read()
-            return frame
-        return get_image
+        from utils.webcam_video_source import WebcamVideoSource
+        image_source = WebcamVideoSource()
     elif selection == 'ffmpeg':
         from utils.ffmpeg_video_source import FFMpegVideoSource
         image_source = FFMpegVideoSource()
-
-        def get_image():
-            return image_source.frame()
-        return get_image
+    elif selection == 'replay':
+        from utils.replay_video_source import ReplayVideoSource
+        image_source = ReplayVideoSource(replay_file, realtime=realtime)
+    elif selection == 'shared':
+        from utils.shared_ring_video_source import SharedRingVideoSource
+        image_source = SharedRingVideoSource()
+    elif selection == 'simulator':
+        from detect_energy_cores_from_image import ECORE_COLOR_RANGES
+        from utils.robot_simulator import RobotSimulator, SimulatorVideoSource
+        image_source = SimulatorVideoSource(
+            RobotSimulator(color_ranges=ECORE_COLOR_RANGES))
     else:
         raise Exception(f"Unknown video source, got: {selection}, "
-                        f"but expected either 'gstreamer' or 'webcam'")
+                        f"but expected either 'gstreamer', 'webcam', "
+                        f"'ffmpeg', 'replay', 'shared' or 'simulator'")
+
+    if record_file:
+        from utils.replay_video_source import RecordingVideoSource
+        image_source = RecordingVideoSource(image_source, record_file)
+
+    return image_source
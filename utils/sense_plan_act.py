@@ -0,0 +1,211 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from cv2 import aruco
+from utils.arena_region import offset_corners
+from utils.aruco_utils import aruco_poses_to_arrays, detect_markers
+from utils.buffer_arena import BufferArena
+from utils.ecore_utils import \
+    image_to_center_points_multi, offset_center_points
+from utils.latency import get_latency_stats, stage
+
+
+FRAME_TIMEOUT = 1.0
+
+
+def make_detector(dictionary, parameters, mtx, dist, marker_size,
+                  color_ranges, calibration=None, arena_mapper=None,
+                  tracker=None, timer=None, ecore_options=None,
+                  region=None):
+    """
+    Make a detection function for SensePlanActLoop that finds both the
+    aruco markers and the energy cores from a frame
+
+    With a CameraCalibration the marker corners and the core centers are
+    undistorted and mtx and dist are not used.
+
+    With an ArenaMapper the detections are also mapped to the arena once
+    the arena corner markers have been seen.
+
+    With a DetectionTracker the marker and core positions are smoothed and
+    the cores are detected only every tracker.core_detect_interval frames
+    and predicted in between.
+
+    With a LatencyStats as the timer each stage of the detection is timed.
+
+    ecore_options are extra keyword arguments to
+    image_to_center_points_multi, e.g. from load_ecore_config.
+
+    With an ArenaRegion only the playfield is processed. The frame is
+    cropped and masked once and both detections use the cropped image. A
+    region with corner marker ids is updated from the markers of each
+    frame.
+
+    Returns:
+        function(frame, timestamp=None) -> dictionary. The timestamp is
+        the capture time of the frame, used by the tracker.
+            markers : numpy structured array from aruco_poses_to_arrays
+            cores : dictionary from image_to_center_points_multi
+            core_tracks : core tracks by color class with a tracker
+            arena : (markers, cores) in arena coordinates from
+                ArenaMapper.map_detections or None
+    """
+    # Detection runs in one executor thread at a time so one arena is enough
+    arena = BufferArena()
+
+    def detect(frame, timestamp=None):
+        offset = (0, 0)
+        if region is not None:
+            with stage(timer, 'arena_region'):
+                frame, offset = region.apply(frame, arena)
+        corners, detected_ids, _ = detect_markers(
+            frame, dictionary, parameters, arena, timer)
+        corners = offset_corners(corners, offset)
+        if region is not None:
+            region.update(corners, detected_ids)
+        cores = None
+        if tracker is None or tracker.need_core_detection():
+            cores = offset_center_points(image_to_center_points_multi(
+                frame, color_ranges, arena=arena, timer=timer,
+                **(ecore_options or {})), offset)
+        with stage(timer, 'estimate_pose'):
+            if calibration is not None:
+                corners, rvecs, _ = calibration.estimate_poses(
+                    corners, marker_size)
+                if cores is not None:
+                    cores = calibration.undistort_center_points(cores)
+            else:
+                rvecs, _, _ = aruco.estimatePoseSingleMarkers(
+                    corners, marker_size, mtx, dist)
+        markers = aruco_poses_to_arrays(detected_ids, corners, rvecs, timer)
+
+        core_tracks = None
+        if tracker is not None:
+            with stage(timer, 'tracking'):
+                markers, core_tracks = tracker.update(markers, cores,
+                                                      timestamp)
+                cores = {name: tracks['position']
+                         for name, tracks in core_tracks.items()}
+
+        arena_detections = None
+        if arena_mapper is not None:
+            with stage(timer, 'arena_mapping'):
+                arena_mapper.update(markers)
+                arena_detections = arena_mapper.map_detections(markers,
+                                                               cores)
+        return {
+            'markers': markers,
+            'cores': cores,
+            'core_tracks': core_tracks,
+            'arena': arena_detections,
+        }
+    return detect
+
+
+class SensePlanActLoop():
+    """
+    Asyncio loop that takes the newest frame from a video source, runs the
+    detection in an executor, hands the detections to a control callback
+    and sends the robot commands without blocking.
+
+    Only one frame is processed at a time and the next one is always the
+    newest frame of the source, so frames that arrive while the detection
+    runs are dropped instead of queued and the command latency stays
+    bounded.
+
+    run returns when stop is called or when a source with an ended
+    attribute, like a ReplayVideoSource that does not loop or a
+    SharedRingVideoSource whose capture daemon is gone, has ended.
+    """
+    def __init__(self, source, detect, control, commander, executor=None,
+                 latency_stats=None, tracker=None):
+        """
+        Args:
+            source: Video source with wait_for_new_frame and latest_frame
+            detect (function): Called in the executor with the frame and
+                the capture timestamp of its FrameInfo, returns the
+                detections
+            control (function): Called in the event loop with the
+                detections, the FrameInfo of the frame and the commander.
+                Sets the robot speeds with commander.set_speeds.
+            commander (RobotCommander): Sends the commands on each frame
+            executor (Executor, optional): Executor for the blocking
+                calls, a thread pool by default. OpenCV releases the GIL so
+                threads run the detection in parallel with the loop.
+            latency_stats (LatencyStats, optional): Where the frame
+                latencies are recorded, the process wide stats by default
+            tracker (DetectionTracker, optional): Tracker used by detect.
+                The dropped frames are passed to its record_load so that
+                the cores are detected less often when the loop falls
+                behind.
+        """
+        self._source = source
+        self._detect = detect
+        self._control = control
+        self._commander = commander
+        self._executor = executor or ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix='sense-plan-act')
+        self._running = False
+        self._latency_stats = latency_stats or get_latency_stats()
+        self._tracker = tracker
+
+        self.frames_processed = 0
+        self.frames_dropped = 0
+        self._last_sequence = 0
+        # Seconds from capture to the commands being sent of the last frame
+        self.last_latency = None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self._running = True
+        while self._running:
+            # Waiting blocks so it is done in the executor too
+            new_frame = await loop.run_in_executor(
+                self._executor, self._source.wait_for_new_frame,
+                FRAME_TIMEOUT)
+            if not new_frame:
+                if getattr(self._source, 'ended', False):
+                    # The replay or the capture daemon has ended
+                    break
+                continue
+            frame, info = self._source.latest_frame(copy=False)
+            if frame is None:
+                continue
+            dropped = 0
+            if self._last_sequence:
+                dropped = max(0, info.sequence - self._last_sequence - 1)
+                self.frames_dropped += dropped
+            self._last_sequence = info.sequence
+            if self._tracker is not None:
+                self._tracker.record_load(dropped)
+
+            if info.decode_time is not None:
+                self._latency_stats.record('capture_to_decode',
+                                           info.decode_time - info.timestamp)
+            self._latency_stats.record('capture_to_detection_start',
+                                       time.monotonic() - info.timestamp)
+
+            detections = await loop.run_in_executor(
+                self._executor, self._detect, frame, info.timestamp)
+            self._latency_stats.record('capture_to_detections',
+                                       time.monotonic() - info.timestamp)
+            # The control passes info.timestamp to set_speeds so that the
+            # commander records the glass-to-command latency
+            self._control(detections, info, self._commander)
+            self._commander.flush()
+
+            self.frames_processed += 1
+            self.last_latency = time.monotonic() - info.timestamp
+
+    def stop(self):
+        self._running = False
+
+    def stats(self):
+        return {
+            'frames_processed': self.frames_processed,
+            'frames_dropped': self.frames_dropped,
+            'last_latency_ms': None if self.last_latency is None
+            else 1000 * self.last_latency,
+            'commands': self._commander.stats(),
+            'latency': self._latency_stats.summary(),
+        }
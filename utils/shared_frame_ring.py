@@ -0,0 +1,194 @@
+import os
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+from utils.frame_info import FrameInfo
+
+
+# Header of each slot in the ring
+SLOT_HEADER_DTYPE = np.dtype([
+    ('sequence', '<i8'),
+    ('timestamp', '<f8'),
+    # NaN if the frame has no decode time
+    ('decode_time', '<f8'),
+])
+# Slot headers are padded so that the frames are 64 byte aligned
+SLOT_HEADER_SIZE = 64
+RING_HEADER_DTYPE = np.dtype([
+    ('slots', '<i8'),
+    ('height', '<i8'),
+    ('width', '<i8'),
+    ('channels', '<i8'),
+    # Sequence number of the latest published frame, 0 if none
+    ('latest', '<i8'),
+    # Process id of the writer, 0 after the writer has closed the ring
+    ('writer_pid', '<i8'),
+])
+RING_HEADER_SIZE = 64
+
+
+class SharedFrameRing():
+    """
+    Ring buffer of frames in named shared memory so that several
+    processes can read the same frame without copying or pickling it.
+
+    The frame with sequence number n is in slot n % slots. The writer
+    must not overwrite a slot the readers still use. SharedFrameRing
+    leaves that to the user, for example by limiting the frames in flight
+    to fewer than the slots.
+    """
+    def __init__(self, shm, owner):
+        self._shm = shm
+        self._owner = owner
+        self._header = np.ndarray(1, dtype=RING_HEADER_DTYPE, buffer=shm.buf)
+        header = self._header[0]
+        self.slots = int(header['slots'])
+        self.frame_shape = (int(header['height']),
+                            int(header['width']),
+                            int(header['channels']))
+        frame_size = int(np.prod(self.frame_shape))
+        slot_size = SLOT_HEADER_SIZE + frame_size
+
+        self._headers = []
+        self._frames = []
+        for slot in range(self.slots):
+            offset = RING_HEADER_SIZE + slot * slot_size
+            self._headers.append(np.ndarray(
+                1, dtype=SLOT_HEADER_DTYPE, buffer=shm.buf, offset=offset))
+            self._frames.append(np.ndarray(
+                self.frame_shape, dtype=np.uint8, buffer=shm.buf,
+                offset=offset + SLOT_HEADER_SIZE))
+
+    @classmethod
+    def create(cls, frame_shape, slots, name=None):
+        """
+        Create a new ring. The creator owns the shared memory and removes
+        it on close.
+        """
+        frame_size = int(np.prod(frame_shape))
+        size = RING_HEADER_SIZE + slots * (SLOT_HEADER_SIZE + frame_size)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray(1, dtype=RING_HEADER_DTYPE, buffer=shm.buf)
+        header['slots'] = slots
+        header['height'], header['width'], header['channels'] = frame_shape
+        header['latest'] = 0
+        header['writer_pid'] = os.getpid()
+        ring = cls(shm, owner=True)
+        for slot_header in ring._headers:
+            slot_header['sequence'] = 0
+        return ring
+
+    @classmethod
+    def attach(cls, name, child=False):
+        """
+        Attach to a ring created by another process
+
+        Args:
+            name (str): Name of the ring
+            child (bool): Set when attaching from a child process of the
+                creator, e.g. a multiprocessing pool worker. Children share
+                the creator's resource tracker.
+        """
+        shm = shared_memory.SharedMemory(name=name)
+        # Only the creator may remove the shared memory. Before Python
+        # 3.13 attaching registers it to the resource tracker, which would
+        # remove it when this process exits. A child shares the tracker
+        # with the creator, so there the registration must stay.
+        if not child:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, owner=False)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def latest_sequence(self):
+        """
+        Sequence number of the latest published frame or 0 if none
+        """
+        return int(self._header['latest'][0])
+
+    def writer_alive(self):
+        """
+        Check that the process that created the ring is still running and
+        has not closed it. A ring whose writer is gone gets no new frames.
+        """
+        pid = int(self._header['writer_pid'][0])
+        if not pid:
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            # Running as another user
+            pass
+        return True
+
+    def slot_of(self, sequence):
+        return sequence % self.slots
+
+    def write(self, frame, info):
+        """
+        Copy a frame to the slot of its sequence number
+
+        Returns:
+            int: The slot the frame was written to
+        """
+        slot = self.slot_of(info.sequence)
+        # Invalidate the slot while it is written so that a reader never
+        # takes a half written frame for a complete one
+        self._headers[slot]['sequence'] = 0
+        np.copyto(self._frames[slot], frame)
+        self.publish(info)
+        return slot
+
+    def frame_buffer(self, sequence):
+        """
+        Get the writable slot of a sequence number to decode a frame
+        straight into it. Call publish when the frame is complete.
+        """
+        slot = self.slot_of(sequence)
+        self._headers[slot]['sequence'] = 0
+        return self._frames[slot]
+
+    def publish(self, info):
+        slot = self.slot_of(info.sequence)
+        self._headers[slot]['timestamp'] = info.timestamp
+        self._headers[slot]['decode_time'] = np.nan \
+            if info.decode_time is None else info.decode_time
+        self._headers[slot]['sequence'] = info.sequence
+        self._header['latest'] = info.sequence
+
+    def info(self, slot):
+        header = self._headers[slot][0]
+        decode_time = float(header['decode_time'])
+        return FrameInfo(int(header['sequence']), float(header['timestamp']),
+                         None if np.isnan(decode_time) else decode_time)
+
+    def read(self, sequence):
+        """
+        Get a read-only view to the frame with the sequence number
+
+        Returns:
+            numpy array: The frame or None if the slot has already been
+                overwritten or is being written
+        """
+        slot = self.slot_of(sequence)
+        if self._headers[slot]['sequence'][0] != sequence:
+            return None
+        view = self._frames[slot].view()
+        view.flags.writeable = False
+        return view
+
+    def close(self):
+        if self._owner:
+            # Tell the readers that no more frames will come
+            self._header['writer_pid'] = 0
+        # Drop the views before closing the memory they point to
+        self._header = None
+        self._headers = []
+        self._frames = []
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
@@ -0,0 +1,151 @@
+import time
+import numpy as np
+from utils.capture_daemon import RING_NAME, ConsumerTable
+from utils.shared_frame_ring import SharedFrameRing
+
+
+# Seconds to wait for the capture daemon to start
+ATTACH_TIMEOUT = 10.0
+# Seconds between the checks for a new frame in wait_for_new_frame
+POLL_INTERVAL = 0.002
+# Seconds between the checks that the capture daemon is still running
+DAEMON_CHECK_INTERVAL = 0.5
+
+
+class SharedRingVideoSource():
+    """
+    Video source that reads the frames a CaptureDaemon decodes to a
+    shared memory ring. Any number of processes can read the same ring.
+
+    With copy=False the frames are read-only views to the ring. A view
+    stays valid until the daemon has written slots - 1 newer frames, check
+    it with frame_valid after the processing if the processing may be
+    slow.
+
+    The source has ended when the capture daemon has exited or crashed,
+    like a ReplayVideoSource at the end of the replay.
+    """
+    def __init__(self, ring_name=RING_NAME, attach_timeout=ATTACH_TIMEOUT):
+        deadline = time.monotonic() + attach_timeout
+        while True:
+            try:
+                self._ring = SharedFrameRing.attach(ring_name)
+                self._consumers = ConsumerTable.attach(ring_name)
+                break
+            except FileNotFoundError:
+                if time.monotonic() > deadline:
+                    raise Exception(f'No capture daemon serving the ring '
+                                    f'"{ring_name}". Start it with '
+                                    f'"python run_capture_daemon.py".')
+                time.sleep(0.1)
+        self._consumer = self._consumers.register()
+        self._last_sequence = 0
+        self._daemon_gone = False
+        self._last_daemon_check = time.monotonic()
+
+    def frame(self, copy=True, out=None):
+        """
+        Get Frame
+        Args:
+            copy (bool): Return a copy of the frame. If false a read-only
+                view to the shared memory is returned.
+            out (numpy.array, optional): Copy the frame to this array
+                instead of allocating a new one
+        Returns : numpy.array(int8)
+            Image as a numpy array or None if no frame has been captured
+        """
+        image, _ = self.latest_frame(copy, out)
+        return image
+
+    def latest_frame(self, copy=True, out=None):
+        """
+        Get the latest frame and its sequence number and capture time
+        Args:
+            copy (bool): See frame
+        Returns : tuple
+            numpy.array(int8) : Image or None if no frame is available
+            FrameInfo : Sequence number and timestamp or None
+        """
+        sequence = self._ring.latest_sequence
+        if not sequence:
+            return None, None
+        # Tell the daemon which frame is held before reading it
+        self._consumers.entries[self._consumer]['sequence'] = sequence
+        image = self._ring.read(sequence)
+        if image is None:
+            # The daemon has already moved past the frame
+            return None, None
+        info = self._ring.info(self._ring.slot_of(sequence))
+        self._last_sequence = sequence
+
+        if out is not None:
+            np.copyto(out, image)
+        elif copy:
+            out = np.copy(image)
+        else:
+            return image, info
+        if not self.frame_valid(info):
+            # Overwritten during the copy
+            return None, None
+        return out, info
+
+    def frame_valid(self, info):
+        """
+        Check that the frame of a FrameInfo has not been overwritten
+        """
+        slot = self._ring.slot_of(info.sequence)
+        return self._ring.info(slot).sequence == info.sequence
+
+    def frame_available(self):
+        return self._ring.latest_sequence > 0
+
+    @property
+    def ended(self):
+        """
+        True when the capture daemon is gone and no new frames will come
+        """
+        if self._consumers is None:
+            return True
+        if not self._daemon_gone and time.monotonic() - \
+                self._last_daemon_check > DAEMON_CHECK_INTERVAL:
+            self._daemon_gone = not self._ring.writer_alive()
+            self._last_daemon_check = time.monotonic()
+        return self._daemon_gone
+
+    def wait_for_new_frame(self, timeout=None):
+        """
+        Wait until a frame newer than the last one returned by frame or
+        latest_frame has been captured
+        Args:
+            timeout (float): Seconds to wait or None to wait forever
+        Returns : boolean
+            true if a new frame is available otherwise false, also when
+            the capture daemon is gone
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._ring.latest_sequence <= self._last_sequence:
+            if self.ended or \
+                    deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(POLL_INTERVAL)
+        return True
+
+    def lag_stats(self):
+        """
+        Returns : dictionary
+            lag : Frames between the last read frame and the latest one
+            overruns : Held frames the daemon has overwritten
+        """
+        entry = self._consumers.entries[self._consumer]
+        return {
+            'lag': self._ring.latest_sequence - int(entry['sequence']),
+            'overruns': int(entry['overruns']),
+        }
+
+    def stop(self):
+        if self._consumers is None:
+            return
+        self._consumers.unregister(self._consumer)
+        self._consumers.close()
+        self._ring.close()
+        self._consumers = None
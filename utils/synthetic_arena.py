@@ -0,0 +1,157 @@
+import numpy as np
+import cv2
+from cv2 import aruco
+
+
+IMAGE_HEIGHT = 1232
+IMAGE_WIDTH = 1232
+ARENA_COLOR = (60, 110, 60)
+MARKER_SIZE = 80
+# White border around the marker like on the robots
+MARKER_BORDER = 20
+CORE_RADIUS = 32
+
+
+def hsv_range_to_bgr(low_color, high_color):
+    """
+    Get the BGR color in the middle of a HSV color range
+    """
+    hsv = (np.asarray(low_color, dtype=np.float32) +
+           np.asarray(high_color, dtype=np.float32)) / 2
+    bgr = cv2.cvtColor(np.uint8([[hsv]]), cv2.COLOR_HSV2BGR)
+    return tuple(int(value) for value in bgr[0, 0])
+
+
+def render_arena(markers,
+                 cores,
+                 dictionary,
+                 width=IMAGE_WIDTH,
+                 height=IMAGE_HEIGHT,
+                 marker_size=MARKER_SIZE,
+                 core_radius=CORE_RADIUS,
+                 background=ARENA_COLOR,
+                 image=None):
+    """
+    Draw a top-down image of the arena
+
+    Args:
+        markers ([(int, float, float, float)]): Aruco id, center x and y in
+            pixels and rotation in degrees of each marker
+        cores ({str: ([[x, y]], (b, g, r))}): Center points and color of
+            the energy cores of each color class
+        dictionary: Aruco dictionary to draw the markers from
+        image (numpy array, optional): Image to draw to, otherwise a new
+            one is allocated
+
+    Returns:
+        numpy array: BGR image
+    """
+    if image is None:
+        image = np.empty((height, width, 3), dtype=np.uint8)
+    image[:] = background
+
+    for name, (points, color) in cores.items():
+        for x, y in points:
+            cv2.circle(image, (int(round(x)), int(round(y))), core_radius,
+                       color, -1, cv2.LINE_AA)
+
+    for marker_id, x, y, rotation in markers:
+        _draw_marker(image, dictionary, marker_id, x, y, rotation,
+                     marker_size)
+
+    return image
+
+
+def marker_corners(x, y, rotation, marker_size=MARKER_SIZE):
+    """
+    Get the corners of a marker in the order aruco.detectMarkers
+    returns them: top left, top right, bottom right and bottom left
+
+    Returns:
+        numpy array (4, 2) float32
+    """
+    half = marker_size / 2
+    square = np.array([[-half, -half], [half, -half],
+                       [half, half], [-half, half]], dtype=np.float64)
+    angle = np.radians(rotation)
+    rotation_matrix = np.array([[np.cos(angle), -np.sin(angle)],
+                                [np.sin(angle), np.cos(angle)]])
+    return (square @ rotation_matrix.T + [x, y]).astype(np.float32)
+
+
+def _draw_marker(image, dictionary, marker_id, x, y, rotation, marker_size):
+    bordered_size = marker_size + 2 * MARKER_BORDER
+    marker = np.full((bordered_size, bordered_size), 255, dtype=np.uint8)
+    marker[MARKER_BORDER:-MARKER_BORDER, MARKER_BORDER:-MARKER_BORDER] = \
+        aruco.drawMarker(dictionary, marker_id, marker_size)
+
+    source = np.array([[0, 0], [bordered_size, 0],
+                       [bordered_size, bordered_size], [0, bordered_size]],
+                      dtype=np.float32) - 0.5
+    target = marker_corners(x, y, rotation, bordered_size) - 0.5
+    transform = cv2.getPerspectiveTransform(source, target)
+
+    # Warp only the bounding box of the marker to keep this cheap
+    left = max(0, int(target[:, 0].min()) - 1)
+    top = max(0, int(target[:, 1].min()) - 1)
+    right = min(image.shape[1], int(target[:, 0].max()) + 2)
+    bottom = min(image.shape[0], int(target[:, 1].max()) + 2)
+    if right <= left or bottom <= top:
+        return
+    shift = np.array([[1, 0, -left], [0, 1, -top], [0, 0, 1]],
+                     dtype=np.float64)
+    region = image[top:bottom, left:right]
+    cv2.warpPerspective(cv2.cvtColor(marker, cv2.COLOR_GRAY2BGR),
+                        shift @ transform,
+                        (right - left, bottom - top),
+                        dst=region,
+                        flags=cv2.INTER_LINEAR,
+                        borderMode=cv2.BORDER_TRANSPARENT)
+
+
+def random_arena(rng,
+                 marker_count,
+                 color_ranges,
+                 cores_per_class,
+                 width=IMAGE_WIDTH,
+                 height=IMAGE_HEIGHT,
+                 marker_size=MARKER_SIZE,
+                 core_radius=CORE_RADIUS):
+    """
+    Place markers and energy cores randomly so that they don't overlap
+
+    Args:
+        rng (numpy.random.Generator): Random number generator
+        marker_count (int): Number of markers, ids are 0..marker_count-1
+        color_ranges ([(str, low_color, high_color)]): Color classes of
+            the energy cores
+        cores_per_class (int): Number of cores of each color class
+
+    Returns:
+        markers and cores in the format render_arena takes
+    """
+    # Place the objects on a jittered grid which keeps them apart
+    # Leave room for the diagonal of a rotated bordered marker
+    marker_cell = (marker_size + 2 * MARKER_BORDER) * 1.45
+    cell = max(marker_cell, 4 * core_radius)
+    columns = int(width // cell)
+    rows = int(height // cell)
+    object_count = marker_count + cores_per_class * len(color_ranges)
+    if object_count > columns * rows:
+        raise ValueError(f'Can not fit {object_count} objects to the arena')
+    cells = rng.permutation(columns * rows)[:object_count]
+    jitter = (cell - marker_cell) / 2
+    centers = np.stack([(cells % columns + 0.5) * cell,
+                        (cells // columns + 0.5) * cell], axis=1)
+    centers += rng.uniform(-jitter, jitter, size=centers.shape)
+
+    markers = [(marker_id, float(x), float(y), float(rng.uniform(-180, 180)))
+               for marker_id, (x, y) in enumerate(centers[:marker_count])]
+    cores = {}
+    core_centers = centers[marker_count:]
+    for index, (name, low_color, high_color) in enumerate(color_ranges):
+        points = core_centers[index * cores_per_class:
+                              (index + 1) * cores_per_class]
+        cores[name] = (points.tolist(),
+                       hsv_range_to_bgr(low_color, high_color))
+    return markers, cores
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+import threading
+import time
+import cv2
+from utils.frame_slots import FrameSlots
+
+
+CAMERA_INDEX = 0
+
+
+class WebcamVideoSource():
+    def __init__(self, camera_index=CAMERA_INDEX):
+        self._cap = cv2.VideoCapture(camera_index)
+        self._camera_index = camera_index
+
+        self._slots = FrameSlots()
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def frame(self, copy=True, out=None):
+        """
+        Get Frame
+        Args:
+            copy (bool): Return a copy of the frame. If false a read-only
+                view is returned. The view stays valid until the next call
+                to frame or latest_frame.
+            out (numpy.array, optional): Copy the frame to this array
+                instead of allocating a new one
+        Returns : numpy.array(int8)
+            Image as a numpy array or None if no frame has been captured
+        """
+        image, _ = self.latest_frame(copy, out)
+        return image
+
+    def latest_frame(self, copy=True, out=None):
+        """
+        Get the latest frame and its sequence number and capture time,
+        see FrameSlots.latest_frame
+        """
+        return self._slots.latest_frame(copy, out)
+
+    def frame_available(self):
+        """
+        Check if frame is available
+        Returns : boolean
+            true if frame is available otherwise false
+        """
+        return self._slots.frame_available()
+
+    def wait_for_new_frame(self, timeout=None):
+        """
+        Wait until a frame newer than the last one returned by frame or
+        latest_frame has been captured
+        Args:
+            timeout (float): Seconds to wait or None to wait forever
+        Returns : boolean
+            true if a new frame is available otherwise false
+        """
+        return self._slots.wait_for_new_frame(timeout)
+
+    def stop(self):
+        self._running = False
+        self._thread.join()
+        self._cap.release()
+
+    def _run(self):
+        """
+        Grab frames continuously so that the camera's buffer queue never
+        fills up with stale frames and decode each one into a free slot
+        """
+        slots = self._slots
+        while self._running:
+            # grab blocks until the camera has a new frame
+            if not self._cap.grab():
+                print(f'No image from camera {self._camera_index}')
+                time.sleep(0.1)
+                continue
+            timestamp = time.monotonic()
+
+            ret, image = self._cap.retrieve(slots.images[slots.free_slot])
+            if not ret:
+                continue
+            slots.images[slots.free_slot] = image
+            slots.publish(timestamp, time.monotonic())
+
+
+# Test this script by running "python -m utils.webcam_video_source" at the
+# project root
+if __name__ == '__main__':
+    video = WebcamVideoSource()
+
+    try:
+        while True:
+            # Wait for the next frame
+            if not video.wait_for_new_frame(timeout=1.0):
+                print("Frame not available")
+                continue
+
+            frame = video.frame()
+            cv2.imshow('frame', frame)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    except KeyboardInterrupt:
+        print("Closing")
+    finally:
+        video.stop()
+        print("Exiting")